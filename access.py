@@ -0,0 +1,65 @@
+"""Immutable access-control snapshot
+
+The bot compiles its access settings (mode, allow list, block list and
+supervisors) into one AccessSnapshot and replaces the global reference
+whenever an admin changes them. Readers always see a consistent view, and
+every check is a frozenset lookup.
+"""
+
+# Reasons returned by AccessSnapshot.denial_reason()
+INACTIVE, BLOCKED, OWNER_ONLY, NOT_ALLOWED = "inactive", "blocked", "owner_only", "not_allowed"
+
+# Settings keys the snapshot is compiled from
+ACCESS_KEYS = ('active', 'owner_only', 'allowed_users', 'blocked_users', 'privileged_users')
+
+
+class AccessSnapshot:
+    """Who may use the bot, compiled from bot_settings"""
+
+    __slots__ = ('owner_id', 'active', 'owner_only', 'allowed', 'blocked', 'privileged')
+
+    def __init__(self, owner_id, active=True, owner_only=False, allowed=(), blocked=(), privileged=()):
+        self.owner_id = owner_id
+        self.active = active
+        self.owner_only = owner_only
+        self.allowed = frozenset(allowed)
+        self.blocked = frozenset(blocked)
+        self.privileged = frozenset(privileged) | {owner_id}
+
+    @classmethod
+    def from_settings(cls, settings, owner_id):
+        return cls(
+            owner_id,
+            settings['active'],
+            settings['owner_only'],
+            settings['allowed_users'],
+            settings['blocked_users'],
+            settings['privileged_users']
+        )
+
+    def __setattr__(self, name, value):
+        if hasattr(self, name):
+            raise AttributeError("AccessSnapshot is immutable")
+        object.__setattr__(self, name, value)
+
+    def is_owner(self, user_id):
+        return user_id == self.owner_id
+
+    def is_privileged(self, user_id):
+        """Owner or supervisor"""
+        return user_id in self.privileged
+
+    def denial_reason(self, user_id):
+        """Why a user may not use the bot, or None if they may"""
+        if not self.active:
+            return INACTIVE
+        if user_id in self.blocked:
+            return BLOCKED
+        if self.owner_only:
+            return None if user_id == self.owner_id else OWNER_ONLY
+        if self.allowed and user_id not in self.allowed and user_id != self.owner_id:
+            return NOT_ALLOWED
+        return None
+
+    def can_use(self, user_id):
+        return self.denial_reason(user_id) is None
@@ -0,0 +1,259 @@
+"""Per-user price alerts: durable storage and a per-symbol sorted index
+
+Alerts are one-shot: an alert on a level fires the first time the price
+moves onto or across it, and is marked triggered once its notification has
+been queued. Every active alert lives in AlertStore (SQLite) and in an
+AlertIndex, which keeps the levels of each symbol sorted. A price move from `previous` to `price` can only
+trigger the levels inside that interval, so matching is two bisects plus
+the alerts that actually fire, however many alerts are waiting.
+"""
+import bisect
+import datetime
+import logging
+import math
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class AlertStore:
+    """Durable price alerts (SQLite)"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS alerts (
+            alert_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            symbol TEXT NOT NULL,
+            price REAL NOT NULL,
+            label TEXT,
+            status TEXT NOT NULL,
+            created TEXT NOT NULL,
+            triggered TEXT,
+            trigger_price REAL
+        );
+        CREATE INDEX IF NOT EXISTS idx_alerts_status ON alerts(status);
+        CREATE INDEX IF NOT EXISTS idx_alerts_user ON alerts(user_id, status);
+    """
+
+    # Alert statuses
+    ACTIVE, TRIGGERED, CANCELLED = "active", "triggered", "cancelled"
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(self.SCHEMA)
+        self.db.commit()
+
+    def add(self, user_id, symbol, price, label=None):
+        """Store a new active alert, returns it as a dict"""
+        now = datetime.datetime.now().isoformat()
+        with self.lock, self.db:
+            cursor = self.db.execute(
+                "INSERT INTO alerts (user_id, symbol, price, label, status, created) VALUES (?, ?, ?, ?, ?, ?)",
+                (user_id, symbol, price, label, self.ACTIVE, now)
+            )
+            row = self.db.execute("SELECT * FROM alerts WHERE alert_id = ?", (cursor.lastrowid,)).fetchone()
+        return dict(row)
+
+    def active(self):
+        """Every active alert, oldest first"""
+        with self.lock:
+            rows = self.db.execute("SELECT * FROM alerts WHERE status = ? ORDER BY alert_id", (self.ACTIVE,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def user_alerts(self, user_id):
+        """Active alerts of one user"""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT * FROM alerts WHERE user_id = ? AND status = ? ORDER BY symbol, price",
+                (user_id, self.ACTIVE)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def cancel(self, alert_ids, user_id=None):
+        """Cancel active alerts (only the user's own when user_id is given);
+        returns the ids that were cancelled"""
+        placeholders = ",".join("?" for _ in alert_ids)
+        query = f"SELECT alert_id FROM alerts WHERE status = ? AND alert_id IN ({placeholders})"
+        params = [self.ACTIVE, *alert_ids]
+        if user_id is not None:
+            query += " AND user_id = ?"
+            params.append(user_id)
+        with self.lock, self.db:
+            cancelled = [row[0] for row in self.db.execute(query, params).fetchall()]
+            self.db.executemany(
+                "UPDATE alerts SET status = ? WHERE alert_id = ?",
+                ((self.CANCELLED, alert_id) for alert_id in cancelled)
+            )
+        return cancelled
+
+    def mark_triggered(self, alert_ids, price):
+        now = datetime.datetime.now().isoformat()
+        with self.lock, self.db:
+            self.db.executemany(
+                "UPDATE alerts SET status = ?, triggered = ?, trigger_price = ? WHERE alert_id = ? AND status = ?",
+                ((self.TRIGGERED, now, price, alert_id, self.ACTIVE) for alert_id in alert_ids)
+            )
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+class SymbolAlerts:
+    """Active alerts of one symbol sorted by level"""
+
+    __slots__ = ('prices', 'ids')
+
+    def __init__(self):
+        # Parallel lists ordered by (price, alert id)
+        self.prices = []
+        self.ids = []
+
+    def __len__(self):
+        return len(self.ids)
+
+    def insert(self, price, alert_id):
+        index = bisect.bisect_right(self.prices, price)
+        self.prices.insert(index, price)
+        self.ids.insert(index, alert_id)
+
+    def remove(self, price, alert_id):
+        index = bisect.bisect_left(self.prices, price)
+        while index < len(self.prices) and self.prices[index] == price:
+            if self.ids[index] == alert_id:
+                del self.prices[index]
+                del self.ids[index]
+                return True
+            index += 1
+        return False
+
+    def take_crossed(self, previous, price):
+        """Remove and return the ids of the levels a move from `previous`
+        to `price` reached: (previous, price] rising, [price, previous) falling"""
+        if price > previous:
+            low = bisect.bisect_right(self.prices, previous)
+            high = bisect.bisect_right(self.prices, price)
+        else:
+            low = bisect.bisect_left(self.prices, price)
+            high = bisect.bisect_left(self.prices, previous)
+        if low == high:
+            return []
+        crossed = self.ids[low:high]
+        del self.prices[low:high]
+        del self.ids[low:high]
+        return crossed
+
+
+class AlertIndex:
+    """Active alerts of every symbol, and the last price seen of each"""
+
+    def __init__(self):
+        self.symbols = {}
+        # alert id -> alert dict
+        self.alerts = {}
+        self.last_prices = {}
+
+    def __len__(self):
+        return len(self.alerts)
+
+    def add(self, alert):
+        symbol_alerts = self.symbols.get(alert['symbol'])
+        if symbol_alerts is None:
+            symbol_alerts = self.symbols[alert['symbol']] = SymbolAlerts()
+        symbol_alerts.insert(alert['price'], alert['alert_id'])
+        self.alerts[alert['alert_id']] = alert
+
+    def remove(self, alert_id):
+        alert = self.alerts.pop(alert_id, None)
+        if alert is None:
+            return None
+        symbol_alerts = self.symbols[alert['symbol']]
+        symbol_alerts.remove(alert['price'], alert_id)
+        if not symbol_alerts:
+            del self.symbols[alert['symbol']]
+        return alert
+
+    def match(self, symbol, price):
+        """Alerts triggered by a new price of a symbol, removed from the index"""
+        previous = self.last_prices.get(symbol)
+        self.last_prices[symbol] = price
+        symbol_alerts = self.symbols.get(symbol)
+        if symbol_alerts is None or previous is None or previous == price:
+            return []
+        crossed = symbol_alerts.take_crossed(previous, price)
+        if not symbol_alerts:
+            del self.symbols[symbol]
+        return [self.alerts.pop(alert_id) for alert_id in crossed]
+
+
+class AlertBook:
+    """AlertStore and AlertIndex kept in step
+
+    on_trigger(alert, price) is called for every alert that fires and
+    returns whether the notification was queued. Alerts whose notification
+    could not be queued stay active and fire on the next crossing."""
+
+    def __init__(self, store, on_trigger=None):
+        self.store = store
+        self.on_trigger = on_trigger
+        self.index = AlertIndex()
+        for alert in store.active():
+            self.index.add(alert)
+        logger.info(f"Loaded {len(self.index)} active price alerts")
+
+    def add(self, user_id, symbol, price, label=None):
+        if not (math.isfinite(price) and price > 0):
+            raise ValueError(f"Invalid alert price: {price!r}")
+        alert = self.store.add(user_id, symbol, price, label)
+        self.index.add(alert)
+        return alert
+
+    def user_alerts(self, user_id):
+        return self.store.user_alerts(user_id)
+
+    def cancel(self, alert_ids, user_id=None):
+        """Cancel alerts; returns the ids that were cancelled"""
+        cancelled = self.store.cancel(alert_ids, user_id)
+        for alert_id in cancelled:
+            self.index.remove(alert_id)
+        return cancelled
+
+    def last_price(self, symbol):
+        return self.index.last_prices.get(symbol)
+
+    def _notify(self, alert, price):
+        if self.on_trigger is None:
+            return True
+        try:
+            return self.on_trigger(alert, price)
+        except Exception as e:
+            logger.warning(f"Alert {alert['alert_id']} callback failed: {e}")
+            return False
+
+    def on_price(self, symbol, price):
+        """Match a new price; returns the alerts it triggered"""
+        if not math.isfinite(price):
+            return []
+        triggered = []
+        for alert in self.index.match(symbol, price):
+            if self._notify(alert, price):
+                triggered.append(alert)
+            else:
+                self.index.add(alert)
+        if not triggered:
+            return triggered
+        try:
+            self.store.mark_triggered([alert['alert_id'] for alert in triggered], price)
+        except sqlite3.Error as e:
+            # Still active on disk, so keep them in the index too; they may
+            # be sent again rather than silently lost
+            logger.error(f"Could not mark {len(triggered)} alerts triggered: {e}")
+            for alert in triggered:
+                self.index.add(alert)
+        return triggered
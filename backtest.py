@@ -0,0 +1,400 @@
+"""Backtest of the scalp/swing recommendation rules over stored OHLC bars
+
+The rules are the ones format_custom_recommendation() publishes. Levels
+come from the previous period's high, low and close, and the trade runs
+through the bars of the next period:
+
+    BUY when the previous close is above the pivot, SELL otherwise
+    entry    BUY: limit in the zone pivot..S1, at the pivot by default
+             SELL: limit in the zone pivot..R1, at the pivot by default
+             A period that opens beyond the far edge of the zone has no trade.
+    targets  TP1..TP3 at R1..R3 (BUY) or S1..S3 (SELL)
+    stop     pivot -/+ min(distance to S2/R2, 25 points)
+    exit     at the exit target (TP3 by default), at the stop, or at the
+             close of the period
+
+Rules holds the tunable parts: the stop cap, how deep into the zone the
+entry is (0 at the pivot, 0.5 halfway to S1/R1) and the exit target.
+
+Scalp trades use daily levels, swing trades weekly ones. Bars are only
+OHLC, so a bar that reaches both the stop and a target is counted as
+stopped first, and targets are only checked from the bar after the entry.
+A bar that opens beyond the stop fills it at the open, and rules whose
+entry is not above the stop (deep entries with a small cap) do not trade.
+
+With NumPy every period of a symbol is simulated at once; otherwise the
+same rules run in a plain loop.
+
+    python backtest.py [--strategy scalp|swing] [--stop-cap 25] [--entry-depth 0] [--target 3] [SYMBOL ...]
+"""
+from ohlc_store import period_key, period_keys
+from pivot_engine import DEFAULT_METHOD, PIVOT_FORMULAS, compute_levels
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# strategy -> period the levels are computed from and the trade lasts
+STRATEGIES = {
+    'scalp': 'daily',
+    'swing': 'weekly'
+}
+
+STOP_CAP = 25.0
+TARGETS = 3
+
+
+class BacktestError(ValueError):
+    """Raised for an unknown strategy or invalid rules"""
+
+
+class Rules:
+    """Parameters of the recommendation rules"""
+
+    __slots__ = ('stop_cap', 'entry_depth', 'target', 'method')
+
+    def __init__(self, stop_cap=STOP_CAP, entry_depth=0.0, target=TARGETS, method=DEFAULT_METHOD):
+        if method not in PIVOT_FORMULAS:
+            raise BacktestError(f"Unknown pivot formula: {method}")
+        if not stop_cap > 0:
+            raise BacktestError(f"Invalid stop cap: {stop_cap}")
+        if not 0 <= entry_depth < 1:
+            raise BacktestError(f"Entry depth must be in [0, 1): {entry_depth}")
+        if target not in range(1, TARGETS + 1):
+            raise BacktestError(f"Exit target must be 1-{TARGETS}: {target}")
+        self.stop_cap = float(stop_cap)
+        self.entry_depth = float(entry_depth)
+        self.target = int(target)
+        self.method = method
+
+    @classmethod
+    def from_dict(cls, values):
+        return cls(values['stop_cap'], values['entry_depth'], values['target'])
+
+    def as_dict(self):
+        """The parameters kept in the bot settings"""
+        return {'stop_cap': self.stop_cap, 'entry_depth': self.entry_depth, 'target': self.target}
+
+    def entry_price(self, pivot, far_edge):
+        """Limit price of the entry inside the zone pivot..far_edge"""
+        return pivot + self.entry_depth * (far_edge - pivot)
+
+    def stop_price(self, pivot, outer_level, is_buy):
+        """Stop beyond the pivot: at S2/R2 but at most stop_cap away"""
+        distance = min(abs(pivot - outer_level), self.stop_cap)
+        return pivot - distance if is_buy else pivot + distance
+
+
+class Trades:
+    """Simulated trades of one symbol, one entry per traded period"""
+
+    __slots__ = ('periods', 'times', 'is_buy', 'entry', 'exit', 'stopped', 'hits')
+
+    def __init__(self, periods=0, times=(), is_buy=(), entry=(), exit=(), stopped=(), hits=None):
+        # Periods that had levels, whether or not the entry was reached
+        self.periods = periods
+        self.times = list(times)
+        self.is_buy = list(is_buy)
+        self.entry = list(entry)
+        self.exit = list(exit)
+        self.stopped = list(stopped)
+        # One list per target: whether it was reached before the stop
+        self.hits = hits if hits is not None else [[] for _ in range(TARGETS)]
+
+    def __len__(self):
+        return len(self.times)
+
+    def pnl(self):
+        """Result of every trade in price points"""
+        return [(exit - entry) if is_buy else (entry - exit)
+                for is_buy, entry, exit in zip(self.is_buy, self.entry, self.exit)]
+
+
+def _signed_levels(levels, is_buy, rules):
+    """(entry, far edge, stop, targets) with SELL prices negated, so both
+    directions follow the BUY logic"""
+    pivot = levels['pivot']
+    if is_buy:
+        stop = rules.stop_price(pivot, levels['s2'], True)
+        return pivot, levels['s1'], stop, (levels['r1'], levels['r2'], levels['r3'])
+    stop = rules.stop_price(pivot, levels['r2'], False)
+    return -pivot, -levels['r1'], -stop, (-levels['s1'], -levels['s2'], -levels['s3'])
+
+
+def _check_formula(levels):
+    if any(value is None for value in levels.values()):
+        raise BacktestError("The recommendation rules need R1-R3 and S1-S3")
+
+
+def _simulate_loop(times, opens, highs, lows, closes, period, rules):
+    trades = Trades()
+    count = len(times)
+    start = 0
+    previous = None
+    while start < count:
+        key = period_key(times[start], period)
+        end = start
+        high, low = highs[start], lows[start]
+        while end + 1 < count and period_key(times[end + 1], period) == key:
+            end += 1
+            high = max(high, highs[end])
+            low = min(low, lows[end])
+
+        if previous is not None:
+            trades.periods += 1
+            _simulate_period(trades, times, opens, highs, lows, closes, start, end, previous, rules)
+        previous = (high, low, closes[end], opens[start])
+        start = end + 1
+    return trades
+
+
+def _simulate_period(trades, times, opens, highs, lows, closes, start, end, previous, rules):
+    high, low, close, open_price = previous
+    levels = compute_levels(high, low, close, rules.method, open_price)
+    _check_formula(levels)
+    is_buy = close > levels['pivot']
+    sign = 1 if is_buy else -1
+    pivot, far_edge, stop, targets = _signed_levels(levels, is_buy, rules)
+    entry_level = rules.entry_price(pivot, far_edge)
+
+    if sign * opens[start] < far_edge or entry_level <= stop:
+        return
+
+    entry = None
+    hits = [False] * TARGETS
+    stopped = False
+    for index in range(start, end + 1):
+        bar_high, bar_low = (highs[index], lows[index]) if is_buy else (-lows[index], -highs[index])
+        if entry is None:
+            if bar_low > entry_level:
+                continue
+            entry = min(entry_level, sign * opens[index])
+        else:
+            for target, level in enumerate(targets):
+                if bar_high >= level and bar_low > stop:
+                    hits[target] = True
+        if bar_low <= stop:
+            stopped = not hits[rules.target - 1]
+            stop_exit = min(stop, sign * opens[index])
+            break
+        if hits[-1]:
+            break
+    if entry is None:
+        return
+
+    if hits[rules.target - 1]:
+        exit = targets[rules.target - 1]
+    elif stopped:
+        exit = stop_exit
+    else:
+        exit = sign * closes[end]
+    trades.times.append(times[start])
+    trades.is_buy.append(is_buy)
+    trades.entry.append(sign * entry)
+    trades.exit.append(sign * exit)
+    trades.stopped.append(stopped)
+    for target in range(TARGETS):
+        trades.hits[target].append(hits[target])
+
+
+def _simulate_vectorized(times, opens, highs, lows, closes, period, rules):
+    times = np.asarray(times)
+    opens, highs, lows, closes = (np.asarray(column, dtype=np.float64) for column in (opens, highs, lows, closes))
+    count = len(times)
+    keys = period_keys(times, period)
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(keys)) + 1))
+    ends = np.append(starts[1:], count)
+    if len(starts) < 2:
+        return Trades()
+
+    # Levels of period i + 1 come from period i
+    formula = PIVOT_FORMULAS[rules.method][1]
+    high = np.maximum.reduceat(highs, starts)[:-1]
+    low = np.minimum.reduceat(lows, starts)[:-1]
+    close = closes[ends - 1][:-1]
+    levels = formula(high, low, close, opens[starts][:-1], (high + low + close) / 3, high - low)
+    _check_formula(levels)
+    levels = {name: np.round(values, 2) for name, values in levels.items()}
+    is_buy = close > levels['pivot']
+    sign = np.where(is_buy, 1.0, -1.0)
+
+    pivot = levels['pivot']
+    far_edge = np.where(is_buy, levels['s1'], -levels['r1'])
+    entry_level = rules.entry_price(sign * pivot, far_edge)
+    stop = np.where(
+        is_buy,
+        pivot - np.minimum(np.abs(pivot - levels['s2']), rules.stop_cap),
+        -(pivot + np.minimum(np.abs(levels['r2'] - pivot), rules.stop_cap))
+    )
+    targets = [np.where(is_buy, levels[up], -levels[down]) for up, down in (('r1', 's1'), ('r2', 's2'), ('r3', 's3'))]
+
+    # Bars of the traded periods, with SELL periods mirrored
+    first = starts[1]
+    lengths = ends[1:] - starts[1:]
+    period_of = np.repeat(np.arange(len(lengths)), lengths)
+    local_starts = starts[1:] - first
+    bar_buy = is_buy[period_of]
+    bar_sign = sign[period_of]
+    bar_high = np.where(bar_buy, highs[first:], -lows[first:])
+    bar_low = np.where(bar_buy, lows[first:], -highs[first:])
+    bar_open = bar_sign * opens[first:]
+
+    index = np.arange(len(period_of))
+    never = len(period_of)
+
+    def first_index(mask):
+        return np.minimum.reduceat(np.where(mask, index, never), local_starts)
+
+    entry_index = first_index(bar_low <= entry_level[period_of])
+    entered = (entry_index < never) & (bar_open[local_starts] >= far_edge) & (entry_level > stop)
+    entry_at = entry_index[period_of]
+    stop_index = first_index((index >= entry_at) & (bar_low <= stop[period_of]))
+    # Reached before the stop, and not on a bar that also reaches it
+    hits = [entered & (first_index((index > entry_at) & (bar_high >= level[period_of])) < stop_index)
+            for level in targets]
+
+    entry = np.minimum(entry_level, bar_open[np.minimum(entry_index, never - 1)])
+    exit_hit = hits[rules.target - 1]
+    stopped = entered & (stop_index < never) & ~exit_hit
+    stop_exit = np.minimum(stop, bar_open[np.minimum(stop_index, never - 1)])
+    exit = np.where(exit_hit, targets[rules.target - 1], np.where(stopped, stop_exit, sign * closes[ends[1:] - 1]))
+
+    traded = np.flatnonzero(entered)
+    return Trades(
+        len(lengths),
+        times[starts[1:]][traded].tolist(),
+        is_buy[traded].tolist(),
+        (sign * entry)[traded].tolist(),
+        (sign * exit)[traded].tolist(),
+        stopped[traded].tolist(),
+        [hit[traded].tolist() for hit in hits]
+    )
+
+
+def simulate_columns(columns, period, rules):
+    """Trades over (time, open, high, low, close) columns"""
+    if np is not None:
+        return _simulate_vectorized(*columns, period, rules)
+    return _simulate_loop(*columns, period, rules)
+
+
+def simulate(series, period, rules):
+    """Trades of one SymbolSeries"""
+    return simulate_columns(series.columns(), period, rules)
+
+
+class BacktestReport:
+    """Aggregated results of a backtest"""
+
+    def __init__(self, strategy, rules):
+        self.strategy = strategy
+        self.rules = rules
+        self.symbols = {}
+        self.periods = 0
+        self.trades = 0
+        self.buys = 0
+        self.target_hits = [0] * TARGETS
+        self.stopped = 0
+        self.wins = 0
+        self.pnl = 0.0
+        self.max_drawdown = 0.0
+        self.first_time = None
+        self.last_time = None
+        self._results = []
+
+    def add(self, symbol, trades, start=None, end=None):
+        """Add the trades of a symbol that started within [start, end)"""
+        keep = [index for index, started in enumerate(trades.times)
+                if (start is None or started >= start) and (end is None or started < end)]
+        pnl = trades.pnl()
+        self.periods += trades.periods
+        symbol_pnl = 0.0
+        for index in keep:
+            self.trades += 1
+            self.buys += trades.is_buy[index]
+            self.stopped += trades.stopped[index]
+            self.wins += pnl[index] > 0
+            symbol_pnl += pnl[index]
+            for target in range(TARGETS):
+                self.target_hits[target] += trades.hits[target][index]
+            self._results.append((trades.times[index], pnl[index]))
+        self.pnl += symbol_pnl
+        self.symbols[symbol] = (len(keep), symbol_pnl)
+
+    def finish(self):
+        """Compute the drawdown of all symbols traded together"""
+        self._results.sort(key=lambda result: result[0])
+        equity = peak = 0.0
+        for _, pnl in self._results:
+            equity += pnl
+            peak = max(peak, equity)
+            self.max_drawdown = max(self.max_drawdown, peak - equity)
+        if self._results:
+            self.first_time = self._results[0][0]
+            self.last_time = self._results[-1][0]
+        self._results = []
+        return self
+
+    def rate(self, count):
+        return count / self.trades if self.trades else 0.0
+
+
+def run(store, symbols=None, strategy='scalp', rules=None, start=None, end=None):
+    """Backtest the rules over the stored bars of `symbols` (default: all)"""
+    if strategy not in STRATEGIES:
+        raise BacktestError(f"Unknown strategy: {strategy}")
+    rules = rules or Rules()
+    report = BacktestReport(strategy, rules)
+    for symbol in symbols or store.symbols():
+        series = store.get(symbol)
+        if series is None or not series.count:
+            continue
+        report.add(symbol.upper(), simulate(series, STRATEGIES[strategy], rules), start, end)
+    return report.finish()
+
+
+def format_report(report):
+    """Plain text summary for the command line"""
+    lines = [
+        f"strategy {report.strategy}, stop cap {report.rules.stop_cap:g}, entry depth {report.rules.entry_depth:g}, "
+        f"exit TP{report.rules.target}, formula {report.rules.method}",
+        f"periods {report.periods}, trades {report.trades} ({report.buys} buy / {report.trades - report.buys} sell)"
+    ]
+    for target, hits in enumerate(report.target_hits, 1):
+        lines.append(f"TP{target} hit rate {report.rate(hits):7.1%}")
+    lines += [
+        f"stop-outs   {report.rate(report.stopped):7.1%}",
+        f"win rate    {report.rate(report.wins):7.1%}",
+        f"net points  {report.pnl:10.2f}",
+        f"max drawdown {report.max_drawdown:9.2f}"
+    ]
+    for symbol, (trades, pnl) in sorted(report.symbols.items()):
+        lines.append(f"  {symbol:<12} {trades:6d} trades {pnl:12.2f} points")
+    return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    import argparse
+    import os
+    import time
+
+    from ohlc_store import OHLCStore, parse_time
+
+    parser = argparse.ArgumentParser(description="Backtest the scalp/swing recommendation rules")
+    parser.add_argument('symbols', nargs='*', help="symbols to test (default: all stored)")
+    parser.add_argument('--strategy', choices=sorted(STRATEGIES), default='scalp')
+    parser.add_argument('--stop-cap', type=float, default=STOP_CAP, help="maximum stop distance in points")
+    parser.add_argument('--entry-depth', type=float, default=0.0, help="entry position in the zone, 0 = pivot")
+    parser.add_argument('--target', type=int, choices=range(1, TARGETS + 1), default=TARGETS, help="exit target")
+    parser.add_argument('--method', choices=sorted(PIVOT_FORMULAS), default=DEFAULT_METHOD)
+    parser.add_argument('--from', dest='start', type=parse_time, help="first period, e.g. 2023-01-01")
+    parser.add_argument('--to', dest='end', type=parse_time, help="end of the last period")
+    parser.add_argument('--dir', default=os.getenv("OHLC_DIR", "ohlc"), help="OHLC store directory")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    rules = Rules(args.stop_cap, args.entry_depth, args.target, args.method)
+    result = run(OHLCStore(args.dir), args.symbols, args.strategy, rules, args.start, args.end)
+    print(format_report(result))
+    print(f"({time.perf_counter() - started:.2f}s)")
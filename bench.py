@@ -0,0 +1,226 @@
+"""Micro-benchmarks
+
+    python bench.py [templates] [users]
+"""
+import datetime
+import json
+import sys
+import timeit
+import tracemalloc
+
+from message_templates import MessageTemplates
+from pivot_engine import compute_levels
+from user_store import UserRecord, UserTable
+
+CUSTOM_TEXTS = {
+    'channel_recommendation_header': "🔔 توصية جديدة - تحليل النقاط المحورية",
+    'custom_recommendation_header': "🔥 توصية جديدة - طريقة دخول خاصة",
+    'scalp_footer': "⚡ نوع التداول: سكالبينغ (دخول وخروج سريع)",
+    'swing_footer': "📊 نوع التداول: سوينغ (صبر على الأهداف)"
+}
+
+
+def _report(name, legacy_seconds, compiled_seconds, number):
+    legacy_us = legacy_seconds / number * 1e6
+    compiled_us = compiled_seconds / number * 1e6
+    print(f"{name:<32} legacy {legacy_us:8.2f} us   compiled {compiled_us:8.2f} us   x{legacy_us / compiled_us:5.2f}")
+
+
+def bench_templates(number=20000):
+    """String concatenation formatters (as before templates) vs compiled templates"""
+    # Formatters as they were before message_templates.py
+    def legacy_format_results(results):
+        """Format the results in a professional way"""
+        message = "📊 تحليل النقاط المحورية\n"
+        message += "━━━━━━━━━━━━━━━━━━━━━━\n\n"
+
+        message += f"🎯 الأهداف (مستويات المقاومة):\n"
+        message += f"الهدف الثالث: {results['r3']:.2f}\n"
+        message += f"الهدف الثاني: {results['r2']:.2f}\n"
+        message += f"الهدف الأول: {results['r1']:.2f}\n\n"
+
+        message += f"🚪 منطقة دخول:\n"
+        message += f"PP: {results['pivot']:.2f}\n\n"
+
+        message += f"🛡️ مستويات الدعم:\n"
+        message += f"S1: {results['s1']:.2f}\n"
+        message += f"S2: {results['s2']:.2f}\n"
+        message += f"S3: {results['s3']:.2f}\n\n"
+
+        message += "━━━━━━━━━━━━━━━━━━━━━━\n"
+        message += "📈 تم الحساب باستخدام الصيغة الكلاسيكية"
+
+        return message
+
+    def legacy_format_channel_recommendation(results, high, low, close):
+        """Format recommendation message for channel"""
+        message = f"{CUSTOM_TEXTS['channel_recommendation_header']}\n"
+        message += "━━━━━━━━━━━━━━━━━━━━━━\n\n"
+
+        if close > results['pivot']:
+            recommendation = "📈 شراء (BUY)"
+            entry_zone = f"{results['pivot']:.2f} - {results['s1']:.2f}"
+            targets = f"🎯 الأهداف:\nTP1: {results['r1']:.2f}\nTP2: {results['r2']:.2f}\nTP3: {results['r3']:.2f}"
+            stop_loss = f"🛑 وقف الخسارة: {results['s2']:.2f}"
+
+            # إضافة توصيات السكالبينغ والسوينغ
+            scalp_target = f"⚡ سكالبينغ: {results['r1']:.2f}"
+            swing_target = f"📊 سوينغ: {results['r2']:.2f} - {results['r3']:.2f}"
+        else:
+            recommendation = "📉 بيع (SELL)"
+            entry_zone = f"{results['pivot']:.2f} - {results['r1']:.2f}"
+            targets = f"🎯 الأهداف:\nTP1: {results['s1']:.2f}\nTP2: {results['s2']:.2f}\nTP3: {results['s3']:.2f}"
+            stop_loss = f"🛑 وقف الخسارة: {results['r2']:.2f}"
+
+            # إضافة توصيات السكالبينغ والسوينغ
+            scalp_target = f"⚡ سكالبينغ: {results['s1']:.2f}"
+            swing_target = f"📊 سوينغ: {results['s2']:.2f} - {results['s3']:.2f}"
+
+        message += f"{recommendation}\n\n"
+        message += f"🔴 منطقة الدخول: {entry_zone}\n\n"
+        message += f"{targets}\n\n"
+        message += f"{stop_loss}\n\n"
+        message += "━━━━━━━━━━━━━━━━━━━━━━\n"
+        message += f"{scalp_target}\n"
+        message += f"{swing_target}\n\n"
+        message += "⚠️ تداول بحذر وأدر المخاطر بحكمة"
+
+        return message
+
+    def legacy_format_custom_recommendation(results, high, low, close, trade_type):
+        """Format custom recommendation message for channel (scalp/swing)"""
+        message = f"{CUSTOM_TEXTS['custom_recommendation_header']}\n"
+        message += "━━━━━━━━━━━━━━━━━━━━━━\n\n"
+
+        if close > results['pivot']:
+            recommendation = "📈 شراء (BUY)"
+            entry_zone = f"{results['pivot']:.2f} - {results['s1']:.2f}"
+            targets = f"🎯 الأهداف:\nTP1: {results['r1']:.2f}\nTP2: {results['r2']:.2f}\nTP3: {results['r3']:.2f}"
+
+            # حساب وقف الخسارة بحد أقصى 25 نقطة
+            if trade_type == "scalp":
+                # للسكالبينغ: وقف خسارة ضيق
+                stop_distance = min(abs(results['pivot'] - results['s2']), 25.0)
+                calculated_stop = results['pivot'] - stop_distance
+            else:  # swing
+                # للسوينغ: وقف خسارة أوسع قليلاً لكن ضمن 25 نقطة
+                stop_distance = min(abs(results['pivot'] - results['s2']), 25.0)
+                calculated_stop = results['pivot'] - stop_distance
+
+        else:
+            recommendation = "📉 بيع (SELL)"
+            entry_zone = f"{results['pivot']:.2f} - {results['r1']:.2f}"
+            targets = f"🎯 الأهداف:\nTP1: {results['s1']:.2f}\nTP2: {results['s2']:.2f}\nTP3: {results['s3']:.2f}"
+
+            # حساب وقف الخسارة بحد أقصى 25 نقطة
+            if trade_type == "scalp":
+                # للسكالبينغ: وقف خسارة ضيق
+                stop_distance = min(abs(results['r2'] - results['pivot']), 25.0)
+                calculated_stop = results['pivot'] + stop_distance
+            else:  # swing
+                # للسوينغ: وقف خسارة أوسع قليلاً لكن ضمن 25 نقطة
+                stop_distance = min(abs(results['r2'] - results['pivot']), 25.0)
+                calculated_stop = results['pivot'] + stop_distance
+
+        stop_loss = f"🛑 وقف الخسارة : {calculated_stop:.2f}"
+
+        message += f"{recommendation}\n\n"
+        message += f"🔴 منطقة الدخول: {entry_zone}\n\n"
+        message += f"{targets}\n\n"
+        message += f"{stop_loss}\n\n"
+        message += "━━━━━━━━━━━━━━━━━━━━━━\n"
+        message += "🫰🏻رجاءًا اقل لوت حبيبي\n\n"
+
+        if trade_type == "scalp":
+            message += CUSTOM_TEXTS['scalp_footer']
+        else:
+            message += CUSTOM_TEXTS['swing_footer']
+
+        return message
+
+    templates = MessageTemplates(CUSTOM_TEXTS)
+    high, low, close = 3250.75, 3200.25, 3225.50
+    results = compute_levels(high, low, close)
+    is_buy = close > results['pivot']
+    if is_buy:
+        stop = results['pivot'] - min(abs(results['pivot'] - results['s2']), 25.0)
+    else:
+        stop = results['pivot'] + min(abs(results['r2'] - results['pivot']), 25.0)
+
+    cases = [
+        (
+            "format_results",
+            lambda: legacy_format_results(results),
+            lambda: templates.render_results(results, "الكلاسيكية")
+        ),
+        (
+            "format_channel_recommendation",
+            lambda: legacy_format_channel_recommendation(results, high, low, close),
+            lambda: templates.render_channel_recommendation(results, is_buy)
+        ),
+        (
+            "format_custom_recommendation",
+            lambda: legacy_format_custom_recommendation(results, high, low, close, "scalp"),
+            lambda: templates.render_custom_recommendation(results, is_buy, "scalp", stop)
+        )
+    ]
+
+    for name, legacy, compiled in cases:
+        assert legacy() == compiled(), f"{name}: compiled output differs"
+        _report(name, timeit.timeit(legacy, number=number), timeit.timeit(compiled, number=number), number)
+
+
+def bench_users(count=100000):
+    """Memory of user_stats as a dict of dicts (as before UserTable) vs UserRecords"""
+    usernames = [f"user_{index % 5000}" for index in range(count)]
+    start = datetime.datetime(2024, 1, 1)
+
+    def measure(build):
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        users = build()
+        used = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        return users, used
+
+    def build_dicts():
+        users = {}
+        for index in range(count):
+            timestamp = start + datetime.timedelta(seconds=index)
+            # Each update brings a fresh username string object
+            users[100000000 + index] = {
+                'username': "".join(usernames[index]),
+                'first_name': "Name",
+                'calculations': index % 50,
+                'first_use': timestamp.isoformat(),
+                'last_seen': timestamp.isoformat()
+            }
+        return users
+
+    def build_records():
+        users = UserTable()
+        for index in range(count):
+            epoch = int((start + datetime.timedelta(seconds=index)).timestamp())
+            users[100000000 + index] = UserRecord("".join(usernames[index]), "Name", index % 50, epoch, epoch)
+        return users
+
+    dicts, dicts_bytes = measure(build_dicts)
+    records, records_bytes = measure(build_records)
+    dicts_json = len(json.dumps(dicts, separators=(',', ':')))
+    records_json = len(json.dumps(records.to_json(), separators=(',', ':')))
+
+    print(f"{'memory per user':<32} dicts {dicts_bytes / count:8.1f} B    records {records_bytes / count:8.1f} B    x{dicts_bytes / records_bytes:5.2f}")
+    print(f"{'JSON per user':<32} dicts {dicts_json / count:8.1f} B    records {records_json / count:8.1f} B    x{dicts_json / records_json:5.2f}")
+
+
+BENCHMARKS = {
+    'templates': bench_templates,
+    'users': bench_users
+}
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        print(f"== {name}")
+        BENCHMARKS[name]()
@@ -0,0 +1,295 @@
+"""Concurrent, rate-limit aware broadcast engine"""
+import asyncio
+import datetime
+import logging
+import sqlite3
+import threading
+import time
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TimedOut
+
+from rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Telegram allows about 30 messages per second bot-wide and one message
+# per second to the same chat
+GLOBAL_RATE = 30
+PER_CHAT_INTERVAL = 1.0
+CONCURRENCY = 20
+MAX_ATTEMPTS = 4
+PROGRESS_INTERVAL = 3.0
+
+# BadRequest texts that mean the chat will never accept messages again
+DEAD_CHAT_ERRORS = (
+    "chat not found",
+    "user is deactivated",
+    "bot was blocked",
+    "bot was kicked",
+    "bot can't initiate conversation",
+    "peer_id_invalid",
+    "have no rights to send"
+)
+
+SENT, RETRY, FAILED, DEAD = "sent", "retry", "failed", "dead"
+
+
+def retry_after_seconds(error):
+    """RetryAfter.retry_after is an int or a timedelta depending on the version"""
+    value = error.retry_after
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+    return float(value)
+
+
+def classify_error(error):
+    """Classify a send error as RETRY, FAILED (permanent) or DEAD (chat gone)"""
+    if isinstance(error, RetryAfter):
+        return RETRY
+    if isinstance(error, Forbidden):
+        return DEAD
+    if isinstance(error, BadRequest):
+        message = str(error).lower()
+        if any(text in message for text in DEAD_CHAT_ERRORS):
+            return DEAD
+        return FAILED
+    if isinstance(error, (TimedOut, NetworkError)):
+        return RETRY
+    return FAILED
+
+
+class BroadcastProgress:
+    """Counters of a running broadcast"""
+
+    __slots__ = ('total', 'sent', 'failed', 'dead', 'retries', 'started', 'initial', 'finished')
+
+    def __init__(self, total=0, sent=0, failed=0, dead=0):
+        self.total = total
+        self.sent = sent
+        self.failed = failed
+        self.dead = dead
+        self.retries = 0
+        self.started = time.monotonic()
+        # Deliveries made before a resume do not count towards the rate
+        self.initial = sent + failed + dead
+        self.finished = False
+
+    @property
+    def done(self):
+        return self.sent + self.failed + self.dead
+
+    @property
+    def rate(self):
+        elapsed = time.monotonic() - self.started
+        return (self.done - self.initial) / elapsed if elapsed > 0 else 0.0
+
+
+class BroadcastEngine:
+    """Send one message to many chats with bounded concurrency"""
+
+    def __init__(self, rate=GLOBAL_RATE, concurrency=CONCURRENCY, max_attempts=MAX_ATTEMPTS):
+        self.bucket = TokenBucket(rate)
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+
+    async def deliver(self, send, chat_id, progress):
+        """Send to one chat, retrying transient errors; returns the outcome"""
+        for attempt in range(1, self.max_attempts + 1):
+            await self.bucket.acquire()
+            try:
+                await send(chat_id)
+                return SENT
+            except Exception as e:
+                outcome = classify_error(e)
+                if outcome != RETRY or attempt == self.max_attempts:
+                    logger.error(f"Failed to send broadcast to {chat_id}: {e}")
+                    return DEAD if outcome == DEAD else FAILED
+
+                progress.retries += 1
+                if isinstance(e, RetryAfter):
+                    # Flood control applies to the whole bot, not only this chat
+                    wait = retry_after_seconds(e)
+                    self.bucket.pause(wait)
+                else:
+                    wait = 2 ** (attempt - 1)
+                await asyncio.sleep(max(wait, PER_CHAT_INTERVAL))
+        return FAILED
+
+    async def run(self, send, chat_ids, progress, on_result=None, on_progress=None, should_stop=None):
+        """Deliver to every chat id; on_result(chat_id, outcome) and
+        on_progress(progress) are optional async callbacks. Delivery stops
+        early, leaving the remaining chats untouched, once should_stop()
+        returns True"""
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+
+        async def worker():
+            while True:
+                chat_id = await queue.get()
+                try:
+                    if should_stop and should_stop():
+                        continue
+                    outcome = await self.deliver(send, chat_id, progress)
+                    if outcome == SENT:
+                        progress.sent += 1
+                    elif outcome == DEAD:
+                        progress.dead += 1
+                    else:
+                        progress.failed += 1
+                    if on_result:
+                        await on_result(chat_id, outcome)
+                except Exception as e:
+                    logger.error(f"Broadcast worker error for {chat_id}: {e}")
+                finally:
+                    queue.task_done()
+
+        async def reporter():
+            while True:
+                await asyncio.sleep(PROGRESS_INTERVAL)
+                try:
+                    await on_progress(progress)
+                except Exception as e:
+                    logger.warning(f"Broadcast progress update failed: {e}")
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        reporter_task = asyncio.create_task(reporter()) if on_progress else None
+        try:
+            for chat_id in chat_ids:
+                if should_stop and should_stop():
+                    break
+                await queue.put(chat_id)
+            await queue.join()
+        finally:
+            for task in workers:
+                task.cancel()
+            if reporter_task:
+                reporter_task.cancel()
+            await asyncio.gather(*workers, *([reporter_task] if reporter_task else []), return_exceptions=True)
+            progress.finished = True
+        return progress
+
+
+class BroadcastJobStore:
+    """Durable broadcast jobs with per-recipient delivery state (SQLite)"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sender_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            status TEXT NOT NULL,
+            total INTEGER NOT NULL DEFAULT 0,
+            status_chat_id INTEGER,
+            status_message_id INTEGER,
+            created TEXT NOT NULL,
+            finished TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status);
+        CREATE TABLE IF NOT EXISTS recipients (
+            job_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            state TEXT NOT NULL DEFAULT 'pending',
+            PRIMARY KEY (job_id, user_id)
+        ) WITHOUT ROWID;
+    """
+
+    # Job statuses
+    RUNNING, PAUSED, CANCELLED, DONE = "running", "paused", "cancelled", "done"
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(self.SCHEMA)
+        self.db.commit()
+
+    def create_job(self, sender_id, text, recipients):
+        """Store a new job and its audience, returns the job id"""
+        now = datetime.datetime.now().isoformat()
+        with self.lock, self.db:
+            cursor = self.db.execute(
+                "INSERT INTO jobs (sender_id, text, status, created) VALUES (?, ?, ?, ?)",
+                (sender_id, text, self.RUNNING, now)
+            )
+            job_id = cursor.lastrowid
+            self.db.executemany(
+                "INSERT OR IGNORE INTO recipients (job_id, user_id) VALUES (?, ?)",
+                ((job_id, user_id) for user_id in recipients)
+            )
+            total = self.db.execute("SELECT COUNT(*) FROM recipients WHERE job_id = ?", (job_id,)).fetchone()[0]
+            self.db.execute("UPDATE jobs SET total = ? WHERE job_id = ?", (total, job_id))
+        return job_id
+
+    def get_job(self, job_id):
+        """Return a job as a dict or None"""
+        with self.lock:
+            row = self.db.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def jobs(self, statuses, limit=10):
+        """Most recent jobs with one of the given statuses"""
+        placeholders = ",".join("?" for _ in statuses)
+        with self.lock:
+            rows = self.db.execute(
+                f"SELECT * FROM jobs WHERE status IN ({placeholders}) ORDER BY job_id DESC LIMIT ?",
+                (*statuses, limit)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def set_status(self, job_id, status):
+        finished = datetime.datetime.now().isoformat() if status in (self.DONE, self.CANCELLED) else None
+        with self.lock, self.db:
+            self.db.execute("UPDATE jobs SET status = ?, finished = ? WHERE job_id = ?", (status, finished, job_id))
+
+    def set_status_message(self, job_id, chat_id, message_id):
+        """Remember the message that shows the job's progress"""
+        with self.lock, self.db:
+            self.db.execute(
+                "UPDATE jobs SET status_chat_id = ?, status_message_id = ? WHERE job_id = ?",
+                (chat_id, message_id, job_id)
+            )
+
+    def pending_recipients(self, job_id, batch_size=500):
+        """Yield recipients not delivered yet, in user id order"""
+        last_id = None
+        while True:
+            with self.lock:
+                rows = self.db.execute(
+                    """SELECT user_id FROM recipients
+                       WHERE job_id = ? AND state = 'pending' AND user_id > ?
+                       ORDER BY user_id LIMIT ?""",
+                    (job_id, last_id if last_id is not None else -(2 ** 63), batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield row[0]
+            last_id = rows[-1][0]
+
+    def mark(self, job_id, user_id, state):
+        """Record the delivery outcome of one recipient"""
+        with self.lock, self.db:
+            self.db.execute(
+                "UPDATE recipients SET state = ? WHERE job_id = ? AND user_id = ?",
+                (state, job_id, user_id)
+            )
+
+    def counts(self, job_id):
+        """Number of recipients per delivery state"""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT state, COUNT(*) FROM recipients WHERE job_id = ? GROUP BY state", (job_id,)
+            ).fetchall()
+        return {state: count for state, count in rows}
+
+    def progress(self, job_id):
+        """BroadcastProgress initialised from the stored delivery state"""
+        job = self.get_job(job_id)
+        counts = self.counts(job_id)
+        return BroadcastProgress(job['total'], counts.get(SENT, 0), counts.get(FAILED, 0), counts.get(DEAD, 0))
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,142 @@
+"""Routing table for inline keyboard callbacks
+
+Exact callback data is looked up in a dict. Parameterized data such as
+"revoke_<user id>" is matched against a character trie of prefixes, so the
+longest registered prefix wins. The rest of the data is split on "_" and
+decoded into typed arguments. Both lookups cost the same no matter how many
+routes are registered.
+"""
+import time
+
+
+class PayloadError(ValueError):
+    """Raised when callback data does not match the payload of its route"""
+
+
+class RouteStats:
+    """Call, error and latency counters of one route"""
+
+    __slots__ = ('calls', 'errors', 'total_ms', 'max_ms')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    @property
+    def average_ms(self):
+        return self.total_ms / self.calls if self.calls else 0.0
+
+
+class Route:
+    """A handler with the decoders of its payload fields"""
+
+    __slots__ = ('name', 'handler', 'decoders', 'stats')
+
+    def __init__(self, name, handler, decoders=()):
+        self.name = name
+        self.handler = handler
+        self.decoders = decoders
+        self.stats = RouteStats()
+
+    def decode(self, payload):
+        """Typed handler arguments from the data following the prefix"""
+        if not self.decoders:
+            return ()
+        if len(self.decoders) == 1:
+            fields = [payload]
+        else:
+            fields = payload.split("_", len(self.decoders) - 1)
+            if len(fields) != len(self.decoders):
+                raise PayloadError(payload)
+        try:
+            return tuple(decoder(field) for decoder, field in zip(self.decoders, fields))
+        except ValueError:
+            raise PayloadError(payload)
+
+
+class CallbackRouter:
+    """Dispatch callback data to handler(update, context, *payload)"""
+
+    def __init__(self, observe=None):
+        # observe(route, elapsed_ms, failed) is called after every dispatch
+        self.observe = observe
+        self.exact = {}
+        self.trie = {}
+        self.routes = []
+
+    def add(self, data, handler):
+        """Route callback data equal to `data`"""
+        route = Route(data, handler)
+        self.exact[data] = route
+        self.routes.append(route)
+        return route
+
+    def add_many(self, names, handler):
+        """Route several exact values to the same handler"""
+        for data in names:
+            self.add(data, handler)
+
+    def add_prefix(self, prefix, handler, *decoders):
+        """Route data starting with `prefix`; each decoder converts one "_"
+        separated field of the rest, the last one gets whatever remains"""
+        route = Route(prefix + "*", handler, decoders)
+        node = self.trie
+        for char in prefix:
+            node = node.setdefault(char, {})
+        # None can never collide with a single character key
+        node[None] = route
+        self.routes.append(route)
+        return route
+
+    def match(self, data):
+        """Return (route, args) or (None, None)"""
+        route = self.exact.get(data)
+        if route is not None:
+            return route, ()
+
+        match, end = None, 0
+        node = self.trie
+        for index, char in enumerate(data):
+            node = node.get(char)
+            if node is None:
+                break
+            if None in node:
+                match, end = node[None], index + 1
+        if match is None:
+            return None, None
+        return match, match.decode(data[end:])
+
+    async def dispatch(self, update, context, on_unknown, on_error):
+        """Run the route for update.callback_query.data
+
+        on_unknown(update, context) and on_error(update, context, error) are
+        awaited for unrouted data and for handler failures.
+        """
+        data = update.callback_query.data or ""
+        try:
+            route, args = self.match(data)
+        except PayloadError:
+            route = None
+        if route is None:
+            await on_unknown(update, context)
+            return
+
+        stats = route.stats
+        started = time.perf_counter()
+        failed = False
+        try:
+            await route.handler(update, context, *args)
+        except Exception as e:
+            failed = True
+            stats.errors += 1
+            await on_error(update, context, e)
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            stats.calls += 1
+            stats.total_ms += elapsed
+            if elapsed > stats.max_ms:
+                stats.max_ms = elapsed
+            if self.observe is not None:
+                self.observe(route, elapsed, failed)
@@ -0,0 +1,118 @@
+"""Throttled, deduplicating publisher for recommendation posts to channels
+
+Posts are sent through the outbound queue, so the handler that produced a
+recommendation never waits on the channel. Consecutive posts to the same
+channel are spaced by at least `min_interval` seconds, and a post whose
+dedup key was already published to that channel within `dedup_window`
+seconds, or is still waiting to be sent, is dropped. Failed posts do not
+count as published, so they can be retried right away.
+"""
+import asyncio
+import logging
+import math
+import time
+from collections import OrderedDict
+
+from broadcast import SENT
+
+logger = logging.getLogger(__name__)
+
+MIN_INTERVAL = 3.0
+DEDUP_WINDOW = 300.0
+
+# Outcomes passed to on_outcome, besides SENT and FAILED
+DUPLICATE, DROPPED = "duplicate", "dropped"
+
+
+def level_key(results, close, tolerance=0.0005):
+    """Dedup key of a recommendation: its direction and main levels, rounded
+    to about `tolerance` of the pivot so near-identical inputs share a key"""
+    # A power of ten, so nearby pivots round on the same grid; a step
+    # proportional to the pivot would make pivot / step the same for all
+    scale = abs(results['pivot']) * tolerance
+    step = 10 ** math.floor(math.log10(scale)) if scale > 0 else 0.01
+    return (
+        close > results['pivot'],
+        round(results['pivot'] / step),
+        round(results['r1'] / step),
+        round(results['s1'] / step)
+    )
+
+
+class ChannelPublisher:
+    """Channel posts on top of an OutboundQueue"""
+
+    def __init__(self, outbound, min_interval=MIN_INTERVAL, dedup_window=DEDUP_WINDOW,
+                 on_outcome=None, clock=time.monotonic):
+        # on_outcome(chat_id, outcome, seconds) is called for every post,
+        # including the ones that were never sent
+        self.outbound = outbound
+        self.min_interval = min_interval
+        self.dedup_window = dedup_window
+        self.on_outcome = on_outcome
+        self.clock = clock
+        # chat_id -> OrderedDict of dedup key -> time it was sent
+        self.recent = {}
+        # chat_id -> dedup keys of posts queued but not sent yet
+        self.pending = {}
+
+    def _report(self, chat_id, outcome, seconds=0.0):
+        if self.on_outcome is not None:
+            try:
+                self.on_outcome(chat_id, outcome, seconds)
+            except Exception as e:
+                logger.warning(f"Channel publisher outcome callback failed: {e}")
+
+    def is_duplicate(self, chat_id, dedup_key):
+        """True if `dedup_key` was sent to this chat within the window or is
+        waiting in the queue"""
+        now = self.clock()
+        recent = self.recent.setdefault(chat_id, OrderedDict())
+        # Keys are in sending order, so expired ones are at the front
+        while recent:
+            key, sent = next(iter(recent.items()))
+            if now - sent < self.dedup_window:
+                break
+            recent.popitem(last=False)
+        return dedup_key in recent or dedup_key in self.pending.get(chat_id, ())
+
+    def _settle(self, chat_id, dedup_key, sent):
+        pending = self.pending.get(chat_id)
+        if pending is not None:
+            pending.discard(dedup_key)
+            if not pending:
+                del self.pending[chat_id]
+        if sent:
+            recent = self.recent.setdefault(chat_id, OrderedDict())
+            recent.pop(dedup_key, None)
+            recent[dedup_key] = self.clock()
+
+    def submit(self, chat_id, text, dedup_key=None, callback=None):
+        """Queue a post; callback(sent) runs once it is sent or has failed.
+        Returns False when the post was dropped as a duplicate or because
+        the outbound queue is full"""
+        if dedup_key is not None and self.is_duplicate(chat_id, dedup_key):
+            self._report(chat_id, DUPLICATE)
+            return False
+
+        queued = self.clock()
+
+        def done(outcome):
+            if dedup_key is not None:
+                # Only a published post blocks identical ones
+                self._settle(chat_id, dedup_key, outcome == SENT)
+            self._report(chat_id, outcome, self.clock() - queued)
+            if callback is not None:
+                callback(outcome == SENT)
+
+        if dedup_key is not None:
+            self.pending.setdefault(chat_id, set()).add(dedup_key)
+        self.outbound.set_interval(chat_id, self.min_interval)
+        try:
+            self.outbound.put_nowait(chat_id, text, done)
+        except asyncio.QueueFull:
+            if dedup_key is not None:
+                self._settle(chat_id, dedup_key, False)
+            self._report(chat_id, DROPPED)
+            return False
+        return True
@@ -1,11 +1,41 @@
 
 import asyncio
+import functools
+import html
+import io
 import logging
 import json
+import math
 import os
+import secrets
+import signal
+import threading
+import time
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler, ConversationHandler
+from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler, ConversationHandler, TypeHandler, ApplicationHandlerStop
+from telegram.request import HTTPXRequest
 import datetime
+from access import ACCESS_KEYS, BLOCKED, INACTIVE, OWNER_ONLY, AccessSnapshot
+from alerts import AlertBook, AlertStore
+import backtest
+from broadcast import BroadcastEngine, BroadcastJobStore
+from callback_router import CallbackRouter
+from channel_publisher import ChannelPublisher, level_key
+from outbound import OutboundQueue
+import price_feed
+from pivot_engine import (
+    DEFAULT_METHOD, LEVEL_TITLES, LEVELS, MAX_CSV_ROWS, PIVOT_FORMULAS, BatchError, calculate_rows, compute_all, compute_levels,
+    format_batch_csv, format_batch_table, format_methods_table, method_title, parse_rows
+)
+from message_templates import MessageTemplates
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, registry as metrics_registry
+from rate_limit import KeyedRateLimiter, parse_limit
+from ohlc_store import OHLCError, OHLCStore, format_time, normalize_symbol, parse_bars
+from result_cache import LRUCache
+import settings_model
+import sweep
+from user_store import MemoryUserStore, SqliteUserStore, UserTable
+from webhook_server import WebhookServer
 
 # Bot configuration
 import os
@@ -22,10 +52,14 @@ bot_settings = {
     'allowed_users': set(),
     'blocked_users': set(),
     'total_calculations': 0,
-    'user_stats': {},
+    'user_stats': UserTable(),
     'channel_id': None,
     'channel_username': None,
     'privileged_users': set(),  # المستخدمين ذوي الصلاحيات الخاصة
+    'pivot_methods': {},  # صيغة الحساب المفضلة لكل مستخدم
+    # معايير توصيات السكالبينغ والسوينغ (وقف الخسارة، عمق الدخول، هدف الخروج)
+    'strategy': {trade_type: backtest.Rules().as_dict() for trade_type in ('scalp', 'swing')},
+    'level_watchers': {},  # الرمز -> المستخدمين الذين يتابعون مستوياته
     'custom_texts': {
         'welcome_message': """🤖 مرحباً بك في بوت حساب النقاط المحورية
 
@@ -67,6 +101,10 @@ bot_settings = {
     }
 }
 
+# Access control compiled from bot_settings, replaced by refresh_access()
+# on every change so checks never see a half-edited state
+access = AccessSnapshot.from_settings(bot_settings, OWNER_CHAT_ID)
+
 # Enable logging
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -77,52 +115,549 @@ logger = logging.getLogger(__name__)
 # Settings file path
 SETTINGS_FILE = "bot_settings.json"
 
+# User stats backend: "memory" (kept in bot_settings) or "sqlite"
+USER_STORE_BACKEND = os.getenv("USER_STORE", "memory")
+USER_DB_FILE = os.getenv("USER_DB_FILE", "users.db")
+
+memory_user_store = MemoryUserStore(bot_settings)
+user_store = memory_user_store
+
+# Update delivery: "polling" (default) or "webhook". In webhook mode the
+# embedded HTTP server listens on PORT and, when WEBHOOK_URL (the public
+# base URL) is set, registers WEBHOOK_URL + WEBHOOK_PATH with Telegram.
+# Updates must carry WEBHOOK_SECRET; one is generated when the bot registers
+# the webhook itself, otherwise webhook mode refuses to start without it.
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8443"))
+
+# Broadcast jobs are stored durably so they survive restarts
+BROADCAST_DB_FILE = os.getenv("BROADCAST_DB_FILE", "broadcasts.db")
+
+# Calculation results keyed on (high, low, close, formula, texts version)
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "1024"))
+result_cache = LRUCache(RESULT_CACHE_SIZE)
+texts_version = 0
+message_templates = MessageTemplates(bot_settings['custom_texts'])
+
+# Historical OHLC bars for /pivot, one directory per symbol
+OHLC_DIR = os.getenv("OHLC_DIR", "ohlc")
+ohlc_store = OHLCStore(OHLC_DIR)
+PERIOD_NAMES = {'daily': "يومي", 'weekly': "أسبوعي", 'monthly': "شهري"}
+PERIOD_ALIASES = {'يومي': 'daily', 'اسبوعي': 'weekly', 'أسبوعي': 'weekly', 'شهري': 'monthly'}
+
+# Strategy sweeps run in worker processes (default: sweep.default_workers(),
+# at most 2, as each one re-imports the bot); the top rule sets of the last
+# sweep per trade type can be applied from the panel
+SWEEP_WORKERS = int(os.getenv("SWEEP_WORKERS", "0")) or None
+SWEEP_SHOWN = 10
+last_sweeps = {}
+sweep_lock = asyncio.Lock()
+
+# Live ticks from PRICE_FEED ("file:/path/to/ticks.csv" or "tcp:host:port")
+# build session bars in the background; chats watching a symbol get a
+# message when price touches one of its pivot levels
+PRICE_FEED = os.getenv("PRICE_FEED")
+PRICE_FEED_PERIOD = os.getenv("PRICE_FEED_PERIOD", "daily")
+MAX_WATCHED_SYMBOLS = 20
+tick_processor = None
+price_feed_task = None
+
+# One-shot price alerts (/alert), matched against every feed tick
+ALERTS_DB_FILE = os.getenv("ALERTS_DB_FILE", "alerts.db")
+MAX_ALERTS_PER_USER = 50
+alert_book = None
+
+# Metrics, summarized in the admin panel and, when METRICS_PORT is set,
+# served on GET /metrics by a separate server bound to METRICS_HOST
+# (loopback by default). They are never exposed on the public webhook port.
+METRICS_PORT = os.getenv("METRICS_PORT")
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+metrics_server = None
+
+handler_latency = metrics_registry.histogram("bot_handler_seconds", "Handler latency", ("handler",))
+handler_errors = metrics_registry.counter("bot_handler_errors_total", "Handler exceptions", ("handler",))
+callback_latency = metrics_registry.histogram("bot_callback_seconds", "Callback route latency", ("route",))
+callback_errors = metrics_registry.counter("bot_callback_errors_total", "Callback route exceptions", ("route",))
+api_latency = metrics_registry.histogram("telegram_api_seconds", "Telegram Bot API request latency", ("method",))
+api_errors = metrics_registry.counter("telegram_api_errors_total", "Failed Telegram Bot API requests", ("method", "error"))
+flush_latency = metrics_registry.histogram("settings_flush_seconds", "Settings snapshot write duration")
+broadcast_deliveries = metrics_registry.counter("broadcast_deliveries_total", "Broadcast deliveries by outcome", ("outcome",))
+queue_depth = metrics_registry.gauge("bot_queue_depth", "Items waiting in internal queues", ("queue",))
+
+def observe_callback(route, elapsed_ms, failed):
+    """Feed callback router timings into the metrics"""
+    callback_latency.observe(elapsed_ms / 1000, route.name)
+    if failed:
+        callback_errors.inc(route.name)
+
+def instrumented(callback):
+    """Wrap a handler callback to record its latency and errors"""
+    name = callback.__name__
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            handler_errors.inc(name)
+            raise
+        finally:
+            handler_latency.observe(time.perf_counter() - started, name)
+    return wrapper
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest that records the latency and errors of every Bot API call"""
+
+    async def do_request(self, url, *args, **kwargs):
+        method = url.rsplit('/', 1)[-1]
+        started = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, *args, **kwargs)
+        except Exception as e:
+            api_errors.inc(method, type(e).__name__)
+            raise
+        finally:
+            # getUpdates is a long poll, its duration is mostly waiting
+            if method != 'getUpdates':
+                api_latency.observe(time.perf_counter() - started, method)
+        if code >= 400:
+            api_errors.inc(method, str(code))
+        return code, payload
+
+# Per-user flood protection, "count/seconds" per kind of request. Owner and
+# supervisors are exempt. Each limiter tracks at most RATE_LIMIT_MAX_USERS keys.
+RATE_LIMITS = {
+    'calculate': os.getenv("RATE_LIMIT_CALCULATE", "10/60"),
+    'command': os.getenv("RATE_LIMIT_COMMAND", "20/60"),
+    'callback': os.getenv("RATE_LIMIT_CALLBACK", "30/60")
+}
+RATE_LIMIT_MAX_USERS = int(os.getenv("RATE_LIMIT_MAX_USERS", "10000"))
+
+rate_limiters = {
+    kind: KeyedRateLimiter(*parse_limit(limit), max_keys=RATE_LIMIT_MAX_USERS)
+    for kind, limit in RATE_LIMITS.items()
+}
+# Commands with a bucket of their own, filled from the registered handlers;
+# unknown commands share one bucket per user so they cannot flood the limiter
+registered_commands = set()
+UNKNOWN_COMMAND = "?"
+rate_limited = metrics_registry.counter("bot_rate_limited_total", "Requests dropped by the per-user rate limit", ("kind",))
+
+# Channel posts go through a throttled queue: at least CHANNEL_MIN_INTERVAL
+# seconds between posts, and calculate() posts whose levels match (within
+# CHANNEL_DEDUP_TOLERANCE of the pivot) one published in the last
+# CHANNEL_DEDUP_WINDOW seconds are skipped.
+CHANNEL_MIN_INTERVAL = float(os.getenv("CHANNEL_MIN_INTERVAL", "3"))
+CHANNEL_DEDUP_WINDOW = float(os.getenv("CHANNEL_DEDUP_WINDOW", "300"))
+CHANNEL_DEDUP_TOLERANCE = float(os.getenv("CHANNEL_DEDUP_TOLERANCE", "0.0005"))
+channel_publisher = None
+
+# Channel posts and their acknowledgements are sent by background workers
+# (outbound.py) sharing the broadcast engine's bot-wide rate limit
+OUTBOUND_WORKERS = int(os.getenv("OUTBOUND_WORKERS", "4"))
+OUTBOUND_QUEUE_SIZE = int(os.getenv("OUTBOUND_QUEUE_SIZE", "1000"))
+outbound_queue = None
+
+channel_posts = metrics_registry.counter("channel_posts_total", "Channel posts by outcome", ("channel", "outcome"))
+channel_send_latency = metrics_registry.histogram(
+    "channel_post_seconds", "Time from queuing a channel post to its completion", ("channel",)
+)
+outbound_messages = metrics_registry.counter("outbound_messages_total", "Outbound queue messages by outcome", ("outcome",))
+outbound_latency = metrics_registry.histogram("outbound_message_seconds", "Time from queuing a message to its completion")
+feed_ticks = metrics_registry.counter("price_feed_ticks_total", "Price feed ticks by outcome", ("outcome",))
+level_touches = metrics_registry.counter("price_level_touches_total", "Pivot levels touched by live prices", ("level",))
+alert_notifications = metrics_registry.counter("price_alerts_triggered_total", "Price alerts triggered by live prices")
+
+# Inline keyboard routes, filled by register_callback_routes()
+callback_router = CallbackRouter(observe=observe_callback)
+
+broadcast_engine = BroadcastEngine()
+broadcast_jobs = None
+broadcast_controls = {}
+broadcast_tasks = {}
+
+# Write-behind persistence: every change is appended to a small journal
+# right away, and a background task fsyncs it and periodically compacts it
+# into an atomically replaced snapshot (SETTINGS_FILE).
+SAVE_INTERVAL = float(os.getenv("SAVE_INTERVAL", "5"))
+SAVE_DIRTY_THRESHOLD = int(os.getenv("SAVE_DIRTY_THRESHOLD", "100"))
+JOURNAL_PREFIX = SETTINGS_FILE + ".journal."
+JOURNAL_COMPACT_RECORDS = int(os.getenv("JOURNAL_COMPACT_RECORDS", "5000"))
+
+persistence_stats = {
+    'pending_changes': 0,
+    'flushes': 0,
+    'failed_flushes': 0,
+    'coalesced_writes': 0,
+    'last_flush_ms': 0.0,
+    'max_flush_ms': 0.0,
+    'total_flush_ms': 0.0,
+    'compactions': 0,
+    'journal_records': 0,
+    'replayed_records': 0
+}
+
+journal_state = {
+    'seq': 0,
+    'segment': 0
+}
+
+_settings_file_lock = threading.Lock()
+_journal_file = None
+_flush_requested = None
+_settings_writer_task = None
+
+def serialize_settings():
+    """Build a JSON-ready snapshot of the bot settings"""
+    return settings_model.dump(bot_settings, journal_state['seq'])
+
+def write_settings_file(settings_to_save):
+    """Atomically replace the settings snapshot on disk"""
+    temp_file = SETTINGS_FILE + ".tmp"
+    with _settings_file_lock:
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump(settings_to_save, f, ensure_ascii=False, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_file, SETTINGS_FILE)
+
+def journal_segments():
+    """Return the existing journal segment numbers in order"""
+    directory = os.path.dirname(JOURNAL_PREFIX) or "."
+    prefix = os.path.basename(JOURNAL_PREFIX)
+    segments = []
+    for name in os.listdir(directory):
+        if name.startswith(prefix) and name[len(prefix):].isdigit():
+            segments.append(int(name[len(prefix):]))
+    return sorted(segments)
+
+def open_journal_segment(segment):
+    """Switch journal appends to a new segment file"""
+    global _journal_file
+    if _journal_file:
+        _journal_file.close()
+    journal_state['segment'] = segment
+    # Line buffered: each record reaches the OS as soon as it is written
+    _journal_file = open(f"{JOURNAL_PREFIX}{segment}", 'a', encoding='utf-8', buffering=1)
+
+def close_journal():
+    """Close the current journal segment"""
+    global _journal_file
+    if _journal_file:
+        _journal_file.close()
+        _journal_file = None
+
+def journal_record(record):
+    """Append one change record to the journal"""
+    journal_state['seq'] += 1
+    if _journal_file:
+        record = dict(record, seq=journal_state['seq'])
+        _journal_file.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + "\n")
+        persistence_stats['journal_records'] += 1
+
+def sync_journal():
+    """fsync the current journal segment"""
+    journal_file = _journal_file
+    if journal_file:
+        os.fsync(journal_file.fileno())
+
+def rotate_journal():
+    """Start a new journal segment and return the segments it replaces"""
+    old_segments = journal_segments()
+    open_journal_segment(journal_state['segment'] + 1)
+    persistence_stats['journal_records'] = 0
+    return [segment for segment in old_segments if segment < journal_state['segment']]
+
+def remove_journal_segments(segments):
+    """Delete journal segments already covered by a snapshot"""
+    for segment in segments:
+        try:
+            os.remove(f"{JOURNAL_PREFIX}{segment}")
+        except FileNotFoundError:
+            pass
+
+def write_snapshot(settings_to_save, old_segments):
+    """Write a snapshot and drop the journal segments it covers"""
+    write_settings_file(settings_to_save)
+    remove_journal_segments(old_segments)
+
+def record_flush(started, pending):
+    """Update the flush counters"""
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    persistence_stats['flushes'] += 1
+    persistence_stats['coalesced_writes'] += max(pending - 1, 0)
+    persistence_stats['last_flush_ms'] = elapsed_ms
+    persistence_stats['max_flush_ms'] = max(persistence_stats['max_flush_ms'], elapsed_ms)
+    persistence_stats['total_flush_ms'] += elapsed_ms
+    flush_latency.observe(elapsed_ms / 1000)
+
 def save_settings():
-    """Save bot settings to file"""
+    """Save bot settings to file (snapshot + journal compaction)"""
+    pending = persistence_stats['pending_changes']
+    persistence_stats['pending_changes'] = 0
+    started = time.perf_counter()
     try:
-        settings_to_save = bot_settings.copy()
-        settings_to_save['allowed_users'] = list(bot_settings['allowed_users'])
-        settings_to_save['blocked_users'] = list(bot_settings['blocked_users'])
-        settings_to_save['privileged_users'] = list(bot_settings['privileged_users'])
-
-        with open(SETTINGS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(settings_to_save, f, ensure_ascii=False, indent=2)
+        settings_to_save = serialize_settings()
+        old_segments = rotate_journal() if _journal_file else []
+        write_snapshot(settings_to_save, old_segments)
+        record_flush(started, pending)
+        persistence_stats['compactions'] += 1
         logger.info("Settings saved successfully")
         return True
     except Exception as e:
+        persistence_stats['pending_changes'] += pending
+        persistence_stats['failed_flushes'] += 1
         logger.error(f"Error saving settings: {e}")
         return False
 
+async def flush_settings():
+    """fsync the journal, compacting it into a snapshot when it grows large"""
+    pending = persistence_stats['pending_changes']
+    if not pending:
+        return True
+
+    persistence_stats['pending_changes'] = 0
+    started = time.perf_counter()
+    try:
+        if persistence_stats['journal_records'] >= JOURNAL_COMPACT_RECORDS or not _journal_file:
+            # Snapshot and rotation happen together on the loop thread, so
+            # changes made while the file is written land in the new segment
+            settings_to_save = serialize_settings()
+            old_segments = rotate_journal() if _journal_file else []
+            await asyncio.to_thread(write_snapshot, settings_to_save, old_segments)
+            persistence_stats['compactions'] += 1
+        else:
+            await asyncio.to_thread(sync_journal)
+        record_flush(started, pending)
+        return True
+    except Exception as e:
+        persistence_stats['pending_changes'] += pending
+        persistence_stats['failed_flushes'] += 1
+        logger.error(f"Error flushing settings: {e}")
+        return False
+
+async def settings_writer():
+    """Background task that coalesces settings changes into periodic flushes"""
+    while True:
+        try:
+            await asyncio.wait_for(_flush_requested.wait(), timeout=SAVE_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _flush_requested.clear()
+        await flush_settings()
+
+def apply_record(record):
+    """Apply one change record to the in-memory settings"""
+    op = record['op']
+
+    if op == 'stat':
+        memory_user_store.record_use(record['uid'], record['username'], record.get('first_name'), record['ts'])
+    elif op == 'method':
+        bot_settings['pivot_methods'][record['uid']] = record['method']
+    elif op == 'delivery':
+        memory_user_store.record_delivery(record['uid'], record['outcome'])
+    elif op == 'watch':
+        bot_settings['level_watchers'].setdefault(record['symbol'], set()).add(record['uid'])
+    elif op == 'unwatch':
+        watchers = bot_settings['level_watchers'].get(record['symbol'], set())
+        watchers.discard(record['uid'])
+        if not watchers:
+            bot_settings['level_watchers'].pop(record['symbol'], None)
+    elif op in ('set', 'add', 'discard', 'clear'):
+        key = record['key']
+        if op == 'set':
+            bot_settings[key] = record['value']
+        elif op == 'add':
+            bot_settings[key].add(record['uid'])
+        elif op == 'discard':
+            bot_settings[key].discard(record['uid'])
+        else:
+            bot_settings[key].clear()
+        if key in ACCESS_KEYS:
+            refresh_access()
+    elif op == 'text':
+        bot_settings['custom_texts'][record['key']] = record['value']
+        invalidate_rendered_texts()
+    else:
+        raise ValueError(f"Unknown journal record: {op}")
+
+def refresh_access():
+    """Compile the access settings into a new snapshot and swap it in"""
+    global access
+    access = AccessSnapshot.from_settings(bot_settings, OWNER_CHAT_ID)
+
+def invalidate_rendered_texts():
+    """Recompile the message templates and forget cached messages rendered with the old custom texts"""
+    global texts_version, message_templates
+    texts_version += 1
+    message_templates = MessageTemplates(bot_settings['custom_texts'])
+    result_cache.clear()
+
+def commit_change(op, **fields):
+    """Apply a change and append it to the journal"""
+    record = dict(fields, op=op)
+    apply_record(record)
+    journal_record(record)
+    auto_save()
+
+def set_setting(key, value):
+    """Change a scalar setting (active, owner_only, channel...)"""
+    commit_change('set', key=key, value=value)
+
+def add_user_to(key, user_id):
+    """Add a user to allowed_users, blocked_users or privileged_users"""
+    commit_change('add', key=key, uid=user_id)
+
+def discard_user_from(key, user_id):
+    """Remove a user from allowed_users, blocked_users or privileged_users"""
+    if user_id in bot_settings[key]:
+        commit_change('discard', key=key, uid=user_id)
+
+def clear_users(key):
+    """Empty allowed_users, blocked_users or privileged_users"""
+    commit_change('clear', key=key)
+
+def set_pivot_method(user_id, method):
+    """Change the default pivot formula of a user"""
+    commit_change('method', uid=user_id, method=method)
+
+def get_pivot_method(user_id):
+    """Default pivot formula of a user"""
+    method = bot_settings['pivot_methods'].get(user_id, DEFAULT_METHOD)
+    return method if method in PIVOT_FORMULAS else DEFAULT_METHOD
+
+def set_custom_text(key, value):
+    """Change one of the admin-editable texts"""
+    commit_change('text', key=key, value=value)
+
+def record_delivery(user_id, outcome):
+    """Track a broadcast delivery outcome so dead chats leave the audience"""
+    if user_store.journaled:
+        # Only state changes are journaled, not every successful delivery
+        if memory_user_store.record_delivery(user_id, outcome):
+            journal_record({'op': 'delivery', 'uid': user_id, 'outcome': outcome})
+            auto_save()
+    else:
+        user_store.record_delivery(user_id, outcome)
+
+def replay_journal(snapshot_seq):
+    """Replay journal records newer than the snapshot, returns the count"""
+    replayed = 0
+    for segment in journal_segments():
+        path = f"{JOURNAL_PREFIX}{segment}"
+        with open(path, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, 1):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A crash can leave the last record half written
+                    logger.warning(f"Skipping torn journal record {path}:{line_number}")
+                    break
+                seq = record.get('seq', 0)
+                journal_state['seq'] = max(journal_state['seq'], seq)
+                if seq <= snapshot_seq:
+                    continue
+                try:
+                    apply_record(record)
+                    replayed += 1
+                except Exception as e:
+                    logger.error(f"Error replaying journal record {path}:{line_number}: {e}")
+        journal_state['segment'] = max(journal_state['segment'], segment)
+    return replayed
+
 def load_settings():
-    """Load bot settings from file"""
+    """Load bot settings from snapshot and replay the journal"""
+    loaded = False
+    snapshot_seq = 0
+
     try:
         if os.path.exists(SETTINGS_FILE):
             with open(SETTINGS_FILE, 'r', encoding='utf-8') as f:
-                loaded_settings = json.load(f)
-
-            if 'allowed_users' in loaded_settings:
-                loaded_settings['allowed_users'] = set(loaded_settings['allowed_users'])
-            if 'blocked_users' in loaded_settings:
-                loaded_settings['blocked_users'] = set(loaded_settings['blocked_users'])
-            if 'privileged_users' in loaded_settings:
-                loaded_settings['privileged_users'] = set(loaded_settings['privileged_users'])
-
-            for key, value in loaded_settings.items():
-                if key in bot_settings:
-                    bot_settings[key] = value
+                loaded_settings, snapshot_seq = settings_model.load(f.read(), bot_settings['custom_texts'])
+            bot_settings.update(loaded_settings)
 
+            journal_state['seq'] = snapshot_seq
+            invalidate_rendered_texts()
+            loaded = True
             logger.info("Settings loaded successfully")
-            return True
         else:
             logger.info("Settings file not found, using default settings")
-            return False
+    except settings_model.UnsupportedSchema as e:
+        # Written by a newer bot; running on would overwrite it with less
+        logger.error(f"Error loading settings: {e}")
+        raise
     except Exception as e:
+        # Keep the broken snapshot aside instead of overwriting it later
         logger.error(f"Error loading settings: {e}")
-        return False
+        try:
+            os.replace(SETTINGS_FILE, f"{SETTINGS_FILE}.corrupt-{int(time.time())}")
+        except OSError:
+            pass
+
+    try:
+        replayed = replay_journal(snapshot_seq)
+        persistence_stats['replayed_records'] = replayed
+        if replayed:
+            loaded = True
+            logger.info(f"Replayed {replayed} journal records")
+        open_journal_segment(journal_state['segment'] + 1)
+    except Exception as e:
+        logger.error(f"Error replaying settings journal: {e}")
+
+    refresh_access()
+    return loaded
+
+def init_user_store():
+    """Open the configured user stats backend"""
+    global user_store
+    if USER_STORE_BACKEND != "sqlite":
+        user_store = memory_user_store
+        return
+
+    user_store = SqliteUserStore(USER_DB_FILE)
+    if bot_settings['user_stats']:
+        # Move stats kept in the JSON settings into the database once
+        imported = user_store.import_users(bot_settings['user_stats'])
+        bot_settings['user_stats'] = UserTable()
+        save_settings()
+        logger.info(f"Imported {imported} users into {USER_DB_FILE}")
 
 def auto_save():
-    """Auto save settings after any change"""
+    """Mark settings as changed; the background writer saves them"""
+    persistence_stats['pending_changes'] += 1
+
+    if _flush_requested is None:
+        # Writer not running yet (startup or scripts), save right away
+        save_settings()
+    elif persistence_stats['pending_changes'] >= SAVE_DIRTY_THRESHOLD:
+        _flush_requested.set()
+
+async def start_settings_writer(application):
+    """Start the background settings writer"""
+    global _flush_requested, _settings_writer_task
+    _flush_requested = asyncio.Event()
+    _settings_writer_task = asyncio.create_task(settings_writer())
+
+async def stop_settings_writer(application):
+    """Stop the background writer and compact the journal"""
+    global _flush_requested, _settings_writer_task
+    if _settings_writer_task:
+        _settings_writer_task.cancel()
+        try:
+            await _settings_writer_task
+        except asyncio.CancelledError:
+            pass
+    _settings_writer_task = None
+    _flush_requested = None
+
     save_settings()
+    close_journal()
+    user_store.close()
 
 def is_owner(user_id):
     """Check if user is the owner"""
@@ -130,171 +665,149 @@ def is_owner(user_id):
 
 def is_privileged(user_id):
     """Check if user has special privileges"""
-    return is_owner(user_id) or user_id in bot_settings['privileged_users']
+    return access.is_privileged(user_id)
+
+def rate_limit_key(update):
+    """(limiter kind, key) of an update, or None when it is not limited"""
+    if update.callback_query is not None:
+        return 'callback', update.callback_query.from_user.id
+    message = update.message
+    if message is None or message.from_user is None:
+        return None
+    text = message.text or ""
+    if text.startswith("/"):
+        # Each command gets its own bucket, so /help does not eat /scalp
+        command = text.split(maxsplit=1)[0].split("@", 1)[0][1:].lower()
+        if command not in registered_commands:
+            command = UNKNOWN_COMMAND
+        return 'command', (message.from_user.id, command)
+    if text or message.document:
+        return 'calculate', message.from_user.id
+    return None
+
+async def rate_limit_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Runs before every other handler and drops updates over the user's limit"""
+    if not isinstance(update, Update) or update.effective_user is None:
+        return
+    if is_privileged(update.effective_user.id):
+        return
+    limited = rate_limit_key(update)
+    if limited is None:
+        return
+
+    kind, key = limited
+    allowed, first_denial = rate_limiters[kind].hit(key)
+    if allowed:
+        return
+
+    rate_limited.inc(kind)
+    if first_denial:
+        # Warn once per burst, later requests are dropped silently
+        logger.warning(f"Rate limit hit by {update.effective_user.id} ({kind})")
+        try:
+            if update.callback_query is not None:
+                await update.callback_query.answer("⏳ طلبات كثيرة، انتظر قليلاً")
+            else:
+                await update.message.reply_text("⏳ أرسلت طلبات كثيرة، يرجى الانتظار قليلاً ثم المحاولة مرة أخرى")
+        except Exception as e:
+            logger.warning(f"Could not send rate limit notice: {e}")
+    raise ApplicationHandlerStop
 
 def can_use_bot(user_id):
     """Check if user can use the bot"""
-    if not bot_settings['active']:
-        return False
+    return access.can_use(user_id)
 
-    if user_id in bot_settings['blocked_users']:
-        return False
+# Static replies for rejected users, so rejecting formats nothing
+DENIAL_MESSAGES = {
+    INACTIVE: "🔴 البوت متوقف حالياً من قبل الإدارة",
+    BLOCKED: "🚫 تم حظرك من استخدام البوت",
+    OWNER_ONLY: "👑 البوت متاح للمالك فقط حالياً"
+}
+DEFAULT_DENIAL_MESSAGE = "❌ غير مسموح لك باستخدام البوت"
 
-    if bot_settings['owner_only']:
-        return is_owner(user_id)
+# At most one rejection notice per user per minute
+denial_notices = KeyedRateLimiter(1 / 60, 1, max_keys=RATE_LIMIT_MAX_USERS)
+access_denied = metrics_registry.counter("bot_access_denied_total", "Updates rejected by access control", ("reason",))
 
-    if bot_settings['allowed_users']:
-        return user_id in bot_settings['allowed_users'] or is_owner(user_id)
+async def access_guard(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Runs before every other handler and drops updates from users who may
+    not use the bot; supervisors always pass so they can reach their panels"""
+    if not isinstance(update, Update):
+        return
+    user = update.effective_user
+    if user is None:
+        return
+    snapshot = access
+    if user.id in snapshot.privileged:
+        return
+    reason = snapshot.denial_reason(user.id)
+    if reason is None:
+        return
 
-    return True
+    access_denied.inc(reason)
+    if denial_notices.hit(user.id)[0]:
+        text = DENIAL_MESSAGES.get(reason, DEFAULT_DENIAL_MESSAGE)
+        try:
+            if update.callback_query is not None:
+                await update.callback_query.answer(text, show_alert=True)
+            elif update.message is not None:
+                await update.message.reply_text(text)
+        except Exception as e:
+            logger.warning(f"Could not send access denial notice: {e}")
+    raise ApplicationHandlerStop
 
 def update_user_stats(user_id, username, first_name=None):
     """Update user statistics"""
-    if user_id not in bot_settings['user_stats']:
-        bot_settings['user_stats'][user_id] = {
-            'username': username,
-            'first_name': first_name,
-            'calculations': 0,
-            'first_use': datetime.datetime.now().isoformat()
-        }
+    timestamp = int(time.time())
+    if user_store.journaled:
+        commit_change('stat', uid=user_id, username=username, first_name=first_name, ts=timestamp)
     else:
-        bot_settings['user_stats'][user_id]['username'] = username
-        if first_name:
-            bot_settings['user_stats'][user_id]['first_name'] = first_name
-
-    bot_settings['user_stats'][user_id]['calculations'] += 1
-    bot_settings['total_calculations'] += 1
-
-def calculate_pivot_points(high, low, close):
-    """Calculate pivot points using classic formula"""
-    pivot = (high + low + close) / 3
-
-    r1 = (2 * pivot) - low
-    r2 = pivot + (high - low)
-    r3 = high + 2 * (pivot - low)
-
-    s1 = (2 * pivot) - high
-    s2 = pivot - (high - low)
-    s3 = low - 2 * (high - pivot)
-
-    return {
-        'pivot': round(pivot, 2),
-        'r1': round(r1, 2),
-        'r2': round(r2, 2),
-        'r3': round(r3, 2),
-        's1': round(s1, 2),
-        's2': round(s2, 2),
-        's3': round(s3, 2)
-    }
+        user_store.record_use(user_id, username, first_name, timestamp)
 
-def format_results(results):
-    """Format the results in a professional way"""
-    message = "📊 تحليل النقاط المحورية\n"
-    message += "━━━━━━━━━━━━━━━━━━━━━━\n\n"
-
-    message += f"🎯 الأهداف (مستويات المقاومة):\n"
-    message += f"الهدف الثالث: {results['r3']:.2f}\n"
-    message += f"الهدف الثاني: {results['r2']:.2f}\n"
-    message += f"الهدف الأول: {results['r1']:.2f}\n\n"
-
-    message += f"🚪 منطقة دخول:\n"
-    message += f"PP: {results['pivot']:.2f}\n\n"
-
-    message += f"🛡️ مستويات الدعم:\n"
-    message += f"S1: {results['s1']:.2f}\n"
-    message += f"S2: {results['s2']:.2f}\n"
-    message += f"S3: {results['s3']:.2f}\n\n"
+def calculate_pivot_points(high, low, close, method=DEFAULT_METHOD):
+    """Calculate pivot points using the given formula (classic by default)"""
+    return compute_levels(high, low, close, method)
 
-    message += "━━━━━━━━━━━━━━━━━━━━━━\n"
-    message += "📈 تم الحساب باستخدام الصيغة الكلاسيكية"
-
-    return message
+def format_results(results, method=DEFAULT_METHOD):
+    """Format the results in a professional way"""
+    return message_templates.render_results(results, method_title(method))
+
+def get_cached_result(high, low, close, method):
+    """Levels and rendered reply for an input, from the LRU cache when possible"""
+    key = (round(high, 8), round(low, 8), round(close, 8), method, texts_version)
+    cached = result_cache.get(key)
+    if cached is None:
+        # One pass over the shared intermediates gives every formula
+        all_levels = compute_all(high, low, close)
+        cached = {
+            'results': all_levels[method],
+            'classic': all_levels[DEFAULT_METHOD],
+            'message': format_results(all_levels[method], method),
+            'channel_message': None
+        }
+        result_cache.put(key, cached)
+    return cached
 
 def format_channel_recommendation(results, high, low, close):
     """Format recommendation message for channel"""
-    message = f"{bot_settings['custom_texts']['channel_recommendation_header']}\n"
-    message += "━━━━━━━━━━━━━━━━━━━━━━\n\n"
-
-    if close > results['pivot']:
-        recommendation = "📈 شراء (BUY)"
-        entry_zone = f"{results['pivot']:.2f} - {results['s1']:.2f}"
-        targets = f"🎯 الأهداف:\nTP1: {results['r1']:.2f}\nTP2: {results['r2']:.2f}\nTP3: {results['r3']:.2f}"
-        stop_loss = f"🛑 وقف الخسارة: {results['s2']:.2f}"
-        
-        # إضافة توصيات السكالبينغ والسوينغ
-        scalp_target = f"⚡ سكالبينغ: {results['r1']:.2f}"
-        swing_target = f"📊 سوينغ: {results['r2']:.2f} - {results['r3']:.2f}"
-    else:
-        recommendation = "📉 بيع (SELL)"
-        entry_zone = f"{results['pivot']:.2f} - {results['r1']:.2f}"
-        targets = f"🎯 الأهداف:\nTP1: {results['s1']:.2f}\nTP2: {results['s2']:.2f}\nTP3: {results['s3']:.2f}"
-        stop_loss = f"🛑 وقف الخسارة: {results['r2']:.2f}"
-        
-        # إضافة توصيات السكالبينغ والسوينغ
-        scalp_target = f"⚡ سكالبينغ: {results['s1']:.2f}"
-        swing_target = f"📊 سوينغ: {results['s2']:.2f} - {results['s3']:.2f}"
-
-    message += f"{recommendation}\n\n"
-    message += f"🔴 منطقة الدخول: {entry_zone}\n\n"
-    message += f"{targets}\n\n"
-    message += f"{stop_loss}\n\n"
-    message += "━━━━━━━━━━━━━━━━━━━━━━\n"
-    message += f"{scalp_target}\n"
-    message += f"{swing_target}\n\n"
-    message += "⚠️ تداول بحذر وأدر المخاطر بحكمة"
-
-    return message
+    return message_templates.render_channel_recommendation(results, close > results['pivot'])
 
 def format_custom_recommendation(results, high, low, close, trade_type):
     """Format custom recommendation message for channel (scalp/swing)"""
-    message = f"{bot_settings['custom_texts']['custom_recommendation_header']}\n"
-    message += "━━━━━━━━━━━━━━━━━━━━━━\n\n"
-
-    if close > results['pivot']:
-        recommendation = "📈 شراء (BUY)"
-        entry_zone = f"{results['pivot']:.2f} - {results['s1']:.2f}"
-        targets = f"🎯 الأهداف:\nTP1: {results['r1']:.2f}\nTP2: {results['r2']:.2f}\nTP3: {results['r3']:.2f}"
-        
-        # حساب وقف الخسارة بحد أقصى 25 نقطة
-        if trade_type == "scalp":
-            # للسكالبينغ: وقف خسارة ضيق
-            stop_distance = min(abs(results['pivot'] - results['s2']), 25.0)
-            calculated_stop = results['pivot'] - stop_distance
-        else:  # swing
-            # للسوينغ: وقف خسارة أوسع قليلاً لكن ضمن 25 نقطة
-            stop_distance = min(abs(results['pivot'] - results['s2']), 25.0)
-            calculated_stop = results['pivot'] - stop_distance
-            
+    trade_type = "scalp" if trade_type == "scalp" else "swing"
+    # وقف الخسارة بحد أقصى stop_cap نقطة (25 افتراضياً، قابل للضبط من لوحة الإدارة)
+    rules = backtest.Rules.from_dict(bot_settings['strategy'][trade_type])
+    is_buy = close > results['pivot']
+    if is_buy:
+        calculated_stop = rules.stop_price(results['pivot'], results['s2'], True)
+        entry = rules.entry_price(results['pivot'], results['s1'])
     else:
-        recommendation = "📉 بيع (SELL)"
-        entry_zone = f"{results['pivot']:.2f} - {results['r1']:.2f}"
-        targets = f"🎯 الأهداف:\nTP1: {results['s1']:.2f}\nTP2: {results['s2']:.2f}\nTP3: {results['s3']:.2f}"
-        
-        # حساب وقف الخسارة بحد أقصى 25 نقطة
-        if trade_type == "scalp":
-            # للسكالبينغ: وقف خسارة ضيق
-            stop_distance = min(abs(results['r2'] - results['pivot']), 25.0)
-            calculated_stop = results['pivot'] + stop_distance
-        else:  # swing
-            # للسوينغ: وقف خسارة أوسع قليلاً لكن ضمن 25 نقطة
-            stop_distance = min(abs(results['r2'] - results['pivot']), 25.0)
-            calculated_stop = results['pivot'] + stop_distance
-
-    stop_loss = f"🛑 وقف الخسارة : {calculated_stop:.2f}"
-
-    message += f"{recommendation}\n\n"
-    message += f"🔴 منطقة الدخول: {entry_zone}\n\n"
-    message += f"{targets}\n\n"
-    message += f"{stop_loss}\n\n"
-    message += "━━━━━━━━━━━━━━━━━━━━━━\n"
-    message += "🫰🏻رجاءًا اقل لوت حبيبي\n\n"
-    
-    if trade_type == "scalp":
-        message += bot_settings['custom_texts']['scalp_footer']
-    else:
-        message += bot_settings['custom_texts']['swing_footer']
+        calculated_stop = rules.stop_price(results['pivot'], results['r2'], False)
+        entry = rules.entry_price(results['pivot'], results['r1'])
 
-    return message
+    return message_templates.render_custom_recommendation(
+        results, is_buy, trade_type, calculated_stop, round(entry, 2), rules.target
+    )
 
 async def send_user_notification(context, user_id, username):
     """Send user entry notification to owner"""
@@ -314,52 +827,317 @@ async def send_user_notification(context, user_id, username):
     except Exception as e:
         logger.error(f"Error sending notification to owner: {e}")
 
-async def send_to_channel(context, message):
-    """Send message to channel if configured"""
-    if bot_settings['channel_id']:
-        try:
-            logger.info(f"Sending message to channel: {bot_settings['channel_id']}")
-            await context.bot.send_message(
-                chat_id=bot_settings['channel_id'],
-                text=message
-            )
-            logger.info("Message sent to channel successfully")
-            return True
-        except Exception as e:
-            logger.error(f"Error sending to channel {bot_settings['channel_id']}: {e}")
-            return False
-    else:
+def observe_channel_post(chat_id, outcome, seconds):
+    """Feed channel publisher outcomes into the metrics"""
+    channel_posts.inc(str(chat_id), outcome)
+    if seconds:
+        channel_send_latency.observe(seconds, str(chat_id))
+
+def observe_outbound(chat_id, outcome, seconds):
+    """Feed outbound queue outcomes into the metrics"""
+    outbound_messages.inc(outcome)
+    outbound_latency.observe(seconds)
+
+def send_later(chat_id, text, **options):
+    """Queue a message on the outbound queue; returns False if it is full"""
+    try:
+        outbound_queue.put_nowait(chat_id, text, **options)
+        return True
+    except asyncio.QueueFull:
+        logger.warning(f"Outbound queue full, dropped message to {chat_id}")
+        return False
+
+def notify_when_posted(chat_id, sent_text, failed_text=None):
+    """Completion callback telling a chat whether its channel post went out"""
+    def callback(sent):
+        if sent:
+            send_later(chat_id, sent_text)
+        elif failed_text:
+            send_later(chat_id, failed_text)
+        else:
+            logger.warning("Failed to send recommendation to channel")
+    return callback
+
+def publish_to_channel(message, dedup_key=None, callback=None):
+    """Queue a post for the recommendations channel; callback(sent) runs once
+    it is done. Returns False if nothing was queued"""
+    if not bot_settings['channel_id'] or channel_publisher is None:
         logger.info("No channel configured for recommendations")
-    return False
+        return False
+    return channel_publisher.submit(bot_settings['channel_id'], message, dedup_key, callback)
+
+def start_outbound(application):
+    """Start the outbound workers and the channel publisher on top of them"""
+    global outbound_queue, channel_publisher
+
+    async def send(chat_id, text, **options):
+        await application.bot.send_message(chat_id=chat_id, text=text, **options)
+
+    outbound_queue = OutboundQueue(
+        send,
+        workers=OUTBOUND_WORKERS,
+        max_size=OUTBOUND_QUEUE_SIZE,
+        bucket=broadcast_engine.bucket,
+        on_outcome=observe_outbound
+    )
+    channel_publisher = ChannelPublisher(
+        outbound_queue,
+        min_interval=CHANNEL_MIN_INTERVAL,
+        dedup_window=CHANNEL_DEDUP_WINDOW,
+        on_outcome=observe_channel_post
+    )
+    outbound_queue.start()
+
+async def stop_outbound():
+    """Let queued messages go out for a few seconds, then stop the workers"""
+    global outbound_queue, channel_publisher
+    if outbound_queue is not None:
+        await outbound_queue.stop()
+        outbound_queue = None
+        channel_publisher = None
+
+def reachable_watchers(symbol):
+    """Watchers of a symbol that may still use the bot (not blocked, not
+    shut out by owner-only mode or a stopped bot)"""
+    return [watcher for watcher in bot_settings['level_watchers'].get(symbol, ()) if can_use_bot(watcher)]
+
+def on_level_touch(symbol, name, level, price):
+    """Tell the chats watching a symbol that price reached one of its levels"""
+    title = price_feed.level_title(name)
+    level_touches.inc(title)
+    direction = "⬆️" if price >= level else "⬇️"
+    for watcher in reachable_watchers(symbol):
+        send_later(watcher, f"🔔 {symbol} {direction} وصل السعر إلى {title} ({level:.2f})\nالسعر الحالي: {price:.2f}")
+
+def on_new_session(symbol, closed_bar, levels):
+    """Send the levels of the new session to the chats watching a symbol"""
+    watchers = reachable_watchers(symbol)
+    if not watchers:
+        return
+    open_price, high, low, close = closed_bar
+    message = (
+        f"📈 {symbol} - مستويات الجلسة الجديدة ({PERIOD_NAMES[PRICE_FEED_PERIOD]})\n"
+        f"أعلى: {high:.2f} | أدنى: {low:.2f} | إغلاق: {close:.2f}\n\n"
+        + format_watched_levels(levels)
+    )
+    for watcher in watchers:
+        send_later(watcher, message)
+
+def count_feed_batch(valid, invalid):
+    feed_ticks.inc("accepted", amount=valid)
+    if invalid:
+        feed_ticks.inc("invalid", amount=invalid)
+
+def start_price_feed():
+    """Start following PRICE_FEED in the background"""
+    global tick_processor, price_feed_task
+    if not PRICE_FEED:
+        return
+    if PRICE_FEED_PERIOD not in PERIOD_NAMES:
+        logger.error(f"Price feed disabled: unknown period {PRICE_FEED_PERIOD}")
+        return
+    try:
+        feed = price_feed.create_feed(PRICE_FEED)
+    except ValueError as e:
+        logger.error(f"Price feed disabled: {e}")
+        return
+    tick_processor = price_feed.TickProcessor(
+        PRICE_FEED_PERIOD, store=ohlc_store, on_touch=on_level_touch, on_session=on_new_session,
+        on_price=alert_book.on_price if alert_book is not None else None
+    )
+    price_feed_task = asyncio.create_task(price_feed.run_feed(feed, tick_processor, count_feed_batch))
+    price_feed_task.add_done_callback(log_price_feed_exit)
+    logger.info(f"Following price feed {PRICE_FEED} ({PRICE_FEED_PERIOD} sessions)")
+
+def log_price_feed_exit(task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Price feed stopped: {task.exception()}")
+
+async def stop_price_feed():
+    """Stop the price feed task, storing the bars still being built"""
+    global price_feed_task
+    if price_feed_task is not None:
+        price_feed_task.cancel()
+        try:
+            await price_feed_task
+        except (asyncio.CancelledError, Exception):
+            # A failure was already logged by log_price_feed_exit()
+            pass
+        price_feed_task = None
+
+def on_alert_triggered(alert, price):
+    """Tell a user their price alert fired; returns False if it could not be queued"""
+    if not can_use_bot(alert['user_id']):
+        # Stays active without a notification, and fires on a later
+        # crossing if the user gets access back
+        return False
+    alert_notifications.inc()
+    label = f" ({alert['label']})" if alert['label'] else ""
+    return send_later(
+        alert['user_id'],
+        f"⏰ تنبيه سعر {alert['symbol']}: وصل السعر إلى {alert['price']:.2f}{label}\n"
+        f"السعر الحالي: {price:.2f}"
+    )
 
-async def broadcast_message(context, message, sender_id):
-    """Send broadcast message to all users"""
-    success_count = 0
-    failed_count = 0
+def init_alert_book():
+    """Open the price alert store and index its active alerts"""
+    global alert_book
+    alert_book = AlertBook(AlertStore(ALERTS_DB_FILE), on_trigger=on_alert_triggered)
 
+def close_alert_book():
+    global alert_book
+    if alert_book is not None:
+        alert_book.store.close()
+        alert_book = None
+
+def format_broadcast_text(message, sender_id):
+    """Add the sender header and timestamp to a broadcast message"""
     sender_info = ""
     if sender_id == OWNER_CHAT_ID:
         sender_info = "📢 رسالة من المالك"
     else:
-        sender_username = bot_settings['user_stats'].get(sender_id, {}).get('username', 'مجهول')
+        sender_username = user_store.username(sender_id, 'مجهول')
         sender_info = f"📢 رسالة من المشرف @{sender_username}"
 
-    broadcast_text = f"{sender_info}\n━━━━━━━━━━━━━━━━━━━━━━\n\n{message}\n\n━━━━━━━━━━━━━━━━━━━━━━\n⏰ {datetime.datetime.now().strftime('%Y-%m-%d %H:%M')}"
+    return f"{sender_info}\n━━━━━━━━━━━━━━━━━━━━━━\n\n{message}\n\n━━━━━━━━━━━━━━━━━━━━━━\n⏰ {datetime.datetime.now().strftime('%Y-%m-%d %H:%M')}"
 
-    for user_id in bot_settings['user_stats'].keys():
-        if user_id != sender_id:
-            try:
-                await context.bot.send_message(
-                    chat_id=user_id,
-                    text=broadcast_text
-                )
-                success_count += 1
-                await asyncio.sleep(0.1)
-            except Exception as e:
-                failed_count += 1
-                logger.error(f"Failed to send broadcast to {user_id}: {e}")
-
-    return success_count, failed_count
+def broadcast_audience(message, sender_id):
+    """Text and recipients of a broadcast: every reachable user except the sender
+
+    Runs on the event loop thread, the memory user store is not safe to
+    iterate while handlers add users."""
+    broadcast_text = format_broadcast_text(message, sender_id)
+    recipients = [user_id for user_id in user_store.iter_user_ids(reachable_only=True) if user_id != sender_id]
+    return broadcast_text, recipients
+
+def start_broadcast_job(bot, job_id):
+    """Run a stored broadcast job in the background"""
+    broadcast_controls[job_id] = BroadcastJobStore.RUNNING
+    task = asyncio.create_task(run_broadcast_job(bot, job_id))
+    broadcast_tasks[job_id] = task
+    task.add_done_callback(functools.partial(forget_broadcast_task, job_id))
+
+def forget_broadcast_task(job_id, task):
+    # The stored job status survives; controls only steer a running task
+    broadcast_tasks.pop(job_id, None)
+    broadcast_controls.pop(job_id, None)
+
+def broadcast_job_keyboard(job_id, status, sender_id):
+    """Control buttons for a broadcast job"""
+    keyboard = []
+    if status == BroadcastJobStore.RUNNING:
+        keyboard.append([
+            InlineKeyboardButton("⏸ إيقاف مؤقت", callback_data=f"bc_pause_{job_id}"),
+            InlineKeyboardButton("✖️ إلغاء", callback_data=f"bc_cancel_{job_id}")
+        ])
+    elif status == BroadcastJobStore.PAUSED:
+        keyboard.append([
+            InlineKeyboardButton("▶️ استئناف", callback_data=f"bc_resume_{job_id}"),
+            InlineKeyboardButton("✖️ إلغاء", callback_data=f"bc_cancel_{job_id}")
+        ])
+
+    if is_owner(sender_id):
+        keyboard.append([InlineKeyboardButton("🔙 رجوع للإدارة", callback_data="admin_panel")])
+    else:
+        keyboard.append([InlineKeyboardButton("🔙 رجوع للوحة المشرف", callback_data="supervisor_panel")])
+    return InlineKeyboardMarkup(keyboard)
+
+def format_broadcast_progress(job_id, progress, status):
+    """Format the status message of a broadcast job"""
+    if status == BroadcastJobStore.RUNNING:
+        text = f"⏳ جارٍ إرسال الرسالة الجماعية #{job_id}...\n\n"
+    elif status == BroadcastJobStore.PAUSED:
+        text = f"⏸ الرسالة الجماعية #{job_id} متوقفة مؤقتاً\n\n"
+    elif status == BroadcastJobStore.CANCELLED:
+        text = f"✖️ تم إلغاء الرسالة الجماعية #{job_id}\n\n"
+    else:
+        text = f"✅ تم إرسال الرسالة الجماعية #{job_id}!\n\n"
+
+    text += f"📊 النتائج:\n"
+    text += f"• تم الإرسال بنجاح: {progress.sent}\n"
+    text += f"• فشل الإرسال: {progress.failed + progress.dead}\n"
+    text += f"• المتبقي: {max(progress.total - progress.done, 0)}\n"
+    text += f"• المجموع: {progress.total}"
+    if status == BroadcastJobStore.RUNNING:
+        text += f"\n• السرعة: {progress.rate:.1f} رسالة/ثانية"
+    return text
+
+async def update_broadcast_status(bot, job, progress, status):
+    """Edit the status message of a broadcast job"""
+    if not job['status_message_id']:
+        return
+    await bot.edit_message_text(
+        chat_id=job['status_chat_id'],
+        message_id=job['status_message_id'],
+        text=format_broadcast_progress(job['job_id'], progress, status),
+        reply_markup=broadcast_job_keyboard(job['job_id'], status, job['sender_id'])
+    )
+
+async def run_broadcast_job(bot, job_id):
+    """Deliver a broadcast job to its pending recipients"""
+    job = broadcast_jobs.get_job(job_id)
+    progress = broadcast_jobs.progress(job_id)
+
+    async def send(chat_id):
+        await bot.send_message(chat_id=chat_id, text=job['text'])
+
+    async def on_result(chat_id, outcome):
+        broadcast_jobs.mark(job_id, chat_id, outcome)
+        record_delivery(chat_id, outcome)
+        broadcast_deliveries.inc(outcome)
+
+    async def report(progress):
+        await update_broadcast_status(bot, job, progress, BroadcastJobStore.RUNNING)
+
+    def should_stop():
+        return broadcast_controls.get(job_id) != BroadcastJobStore.RUNNING
+
+    try:
+        await broadcast_engine.run(
+            send,
+            broadcast_jobs.pending_recipients(job_id),
+            progress,
+            on_result=on_result,
+            on_progress=report,
+            should_stop=should_stop
+        )
+    except asyncio.CancelledError:
+        # Shutdown: the job stays "running" and resumes on the next start
+        raise
+    except Exception as e:
+        logger.error(f"Broadcast job {job_id} failed: {e}")
+        broadcast_controls[job_id] = BroadcastJobStore.PAUSED
+        broadcast_jobs.set_status(job_id, BroadcastJobStore.PAUSED)
+
+    status = broadcast_controls.get(job_id, BroadcastJobStore.RUNNING)
+    if status == BroadcastJobStore.RUNNING:
+        status = BroadcastJobStore.DONE
+        broadcast_jobs.set_status(job_id, status)
+
+    logger.info(f"Broadcast job {job_id} {status}: {progress.sent} sent, {progress.failed + progress.dead} failed")
+    try:
+        await update_broadcast_status(bot, job, progress, status)
+    except Exception as e:
+        logger.warning(f"Could not update broadcast status message: {e}")
+
+def init_broadcast_jobs():
+    """Open the broadcast job store"""
+    global broadcast_jobs
+    broadcast_jobs = BroadcastJobStore(BROADCAST_DB_FILE)
+
+async def resume_broadcast_jobs(application):
+    """Restart broadcast jobs interrupted by a shutdown"""
+    for job in broadcast_jobs.jobs([BroadcastJobStore.RUNNING], limit=100):
+        logger.info(f"Resuming broadcast job {job['job_id']}")
+        start_broadcast_job(application.bot, job['job_id'])
+
+async def stop_broadcast_jobs(application):
+    """Cancel running broadcast tasks; their jobs resume on the next start"""
+    tasks = list(broadcast_tasks.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    broadcast_jobs.close()
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Start command handler"""
@@ -386,7 +1164,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text(error_message)
         return
 
-    if not is_owner(user_id) and user_id not in bot_settings['user_stats'] and not is_callback:
+    if not is_owner(user_id) and user_id not in user_store and not is_callback:
         await send_user_notification(context, user_id, username)
 
     welcome_message = bot_settings['custom_texts']['welcome_message']
@@ -442,8 +1220,8 @@ async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
 • حالة البوت: {status}
 • نمط الوصول: {access_mode}
 • قناة التوصيات: {channel_status}
-• إجمالي الحسابات: {bot_settings['total_calculations']}
-• عدد المستخدمين: {len(bot_settings['user_stats'])}
+• إجمالي الحسابات: {user_store.total_calculations()}
+• عدد المستخدمين: {user_store.count()}
 • المحظورين: {len(bot_settings['blocked_users'])}
 • المشرفين: {len(bot_settings['privileged_users'])}
 
@@ -455,9 +1233,12 @@ async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
         [InlineKeyboardButton("👑 إدارة الصلاحيات", callback_data="manage_permissions")],
         [InlineKeyboardButton("📢 إعداد قناة التوصيات", callback_data="setup_channel")],
         [InlineKeyboardButton("📨 إرسال رسالة جماعية", callback_data="send_broadcast")],
+        [InlineKeyboardButton("📡 الرسائل الجماعية الجارية", callback_data="broadcast_jobs")],
         [InlineKeyboardButton("📝 تحرير النصوص", callback_data="edit_texts")],
         [InlineKeyboardButton("💾 حفظ الإعدادات", callback_data="save_settings")],
         [InlineKeyboardButton("📊 الإحصائيات التفصيلية", callback_data="detailed_stats")],
+        [InlineKeyboardButton("📈 مقاييس الأداء", callback_data="metrics_summary")],
+        [InlineKeyboardButton("🧪 ضبط الاستراتيجية", callback_data="strategy_menu")],
         [InlineKeyboardButton("📚 قائمة الأوامر", callback_data="commands_list")],
         [InlineKeyboardButton("🏠 القائمة الرئيسية", callback_data="main_menu")]
     ]
@@ -488,14 +1269,15 @@ async def supervisor_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     supervisor_text = f"""🔧 لوحة المشرف
 
 📊 الإحصائيات:
-• إجمالي الحسابات: {bot_settings['total_calculations']}
-• عدد المستخدمين: {len(bot_settings['user_stats'])}
+• إجمالي الحسابات: {user_store.total_calculations()}
+• عدد المستخدمين: {user_store.count()}
 
 🎛️ الأدوات المتاحة:"""
 
     keyboard = [
         [InlineKeyboardButton("📢 إعداد قناة التوصيات", callback_data="setup_channel")],
         [InlineKeyboardButton("📨 إرسال رسالة جماعية", callback_data="send_broadcast")],
+        [InlineKeyboardButton("📡 الرسائل الجماعية الجارية", callback_data="broadcast_jobs")],
         [InlineKeyboardButton("📊 الإحصائيات التفصيلية", callback_data="detailed_stats")],
         [InlineKeyboardButton("📚 قائمة الأوامر", callback_data="commands_list")],
         [InlineKeyboardButton("🏠 القائمة الرئيسية", callback_data="main_menu")]
@@ -546,9 +1328,10 @@ async def list_supervisors(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         text = "📋 قائمة المشرفين:\n\n"
         for user_id in bot_settings['privileged_users']:
-            if user_id in bot_settings['user_stats']:
-                username = bot_settings['user_stats'][user_id]['username']
-                first_name = bot_settings['user_stats'][user_id].get('first_name', 'مجهول')
+            user_data = user_store.get(user_id)
+            if user_data:
+                username = user_data['username']
+                first_name = user_data.get('first_name') or 'مجهول'
                 text += f"• @{username} ({first_name}) - ID: {user_id}\n"
             else:
                 text += f"• ID: {user_id}\n"
@@ -575,8 +1358,8 @@ async def revoke_permissions_menu(update: Update, context: ContextTypes.DEFAULT_
     keyboard = []
 
     for user_id in list(bot_settings['privileged_users'])[:10]:
-        if user_id in bot_settings['user_stats']:
-            username = bot_settings['user_stats'][user_id]['username']
+        if user_id in user_store:
+            username = user_store.username(user_id)
             text += f"• @{username} (ID: {user_id})\n"
             keyboard.append([InlineKeyboardButton(f"إزالة @{username}", callback_data=f"revoke_{user_id}")])
         else:
@@ -672,20 +1455,18 @@ async def send_broadcast_process(update: Update, context: ContextTypes.DEFAULT_T
         f"━━━━━━━━━━━━━━━━━━━━━━\n"
         f"{message}\n"
         f"━━━━━━━━━━━━━━━━━━━━━━\n\n"
-        f"سيتم إرسالها لـ {len(bot_settings['user_stats'])} مستخدم\n\n"
+        f"سيتم إرسالها لـ {user_store.reachable_count()} مستخدم\n\n"
         f"هل تريد المتابعة؟",
         reply_markup=reply_markup
     )
 
     return ConversationHandler.END
 
-async def confirm_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def confirm_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int):
     """Confirm and send broadcast"""
     query = update.callback_query
     await query.answer()
 
-    user_id = int(query.data.split("_")[2])
-
     if query.from_user.id != user_id:
         await query.edit_message_text("❌ خطأ في التحقق")
         return
@@ -695,23 +1476,101 @@ async def confirm_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_text("❌ لم يتم العثور على الرسالة")
         return
 
-    await query.edit_message_text("⏳ جارٍ إرسال الرسالة...")
-    success_count, failed_count = await broadcast_message(context, message, user_id)
+    context.user_data.pop('broadcast_message', None)
+    await query.edit_message_text("⏳ جارٍ تجهيز الرسالة الجماعية...")
+
+    broadcast_text, recipients = broadcast_audience(message, user_id)
+    job_id = await asyncio.to_thread(broadcast_jobs.create_job, user_id, broadcast_text, recipients)
+    broadcast_jobs.set_status_message(job_id, query.message.chat_id, query.message.message_id)
+
+    # Runs in the background so other updates keep being processed
+    start_broadcast_job(context.bot, job_id)
+
+async def broadcast_jobs_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """List active broadcast jobs with their controls"""
+    query = update.callback_query
+    await query.answer()
+
+    user_id = query.from_user.id
+    if not is_privileged(user_id):
+        await query.edit_message_text("❌ غير مسموح لك بالوصول لهذه الصفحة")
+        return
 
-    result_text = f"✅ تم إرسال الرسالة!\n\n"
-    result_text += f"📊 النتائج:\n"
-    result_text += f"• تم الإرسال بنجاح: {success_count}\n"
-    result_text += f"• فشل الإرسال: {failed_count}\n"
-    result_text += f"• المجموع: {success_count + failed_count}"
+    jobs = broadcast_jobs.jobs([BroadcastJobStore.RUNNING, BroadcastJobStore.PAUSED])
+    if not is_owner(user_id):
+        jobs = [job for job in jobs if job['sender_id'] == user_id]
 
     keyboard = []
+    if not jobs:
+        text = "📡 الرسائل الجماعية\n\n❌ لا توجد رسائل جماعية قيد الإرسال"
+    else:
+        text = "📡 الرسائل الجماعية الجارية:\n\n"
+        for job in jobs:
+            progress = broadcast_jobs.progress(job['job_id'])
+            status = "⏳ جارية" if job['status'] == BroadcastJobStore.RUNNING else "⏸ متوقفة"
+            text += f"• #{job['job_id']} {status}: {progress.done}/{progress.total}\n"
+            if job['status'] == BroadcastJobStore.RUNNING:
+                keyboard.append([
+                    InlineKeyboardButton(f"⏸ #{job['job_id']}", callback_data=f"bc_pause_{job['job_id']}"),
+                    InlineKeyboardButton(f"✖️ #{job['job_id']}", callback_data=f"bc_cancel_{job['job_id']}")
+                ])
+            else:
+                keyboard.append([
+                    InlineKeyboardButton(f"▶️ #{job['job_id']}", callback_data=f"bc_resume_{job['job_id']}"),
+                    InlineKeyboardButton(f"✖️ #{job['job_id']}", callback_data=f"bc_cancel_{job['job_id']}")
+                ])
+
     if is_owner(user_id):
         keyboard.append([InlineKeyboardButton("🔙 رجوع للإدارة", callback_data="admin_panel")])
     else:
         keyboard.append([InlineKeyboardButton("🔙 رجوع للوحة المشرف", callback_data="supervisor_panel")])
 
     reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.edit_message_text(result_text, reply_markup=reply_markup)
+    await query.edit_message_text(text, reply_markup=reply_markup)
+
+async def control_broadcast_job(update: Update, context: ContextTypes.DEFAULT_TYPE, action: str, job_id: int):
+    """Pause, resume or cancel a broadcast job"""
+    query = update.callback_query
+
+    job = broadcast_jobs.get_job(job_id)
+    user_id = query.from_user.id
+
+    if not job or not (is_owner(user_id) or (is_privileged(user_id) and job['sender_id'] == user_id)):
+        await query.answer("❌ غير مسموح لك بهذه العملية")
+        return
+
+    if job['status'] in (BroadcastJobStore.DONE, BroadcastJobStore.CANCELLED):
+        await query.answer("ℹ️ انتهت هذه الرسالة الجماعية بالفعل")
+        return
+
+    if action == "pause" and job['status'] == BroadcastJobStore.RUNNING:
+        if job_id in broadcast_tasks:
+            broadcast_controls[job_id] = BroadcastJobStore.PAUSED
+        broadcast_jobs.set_status(job_id, BroadcastJobStore.PAUSED)
+        await query.answer("⏸ تم الإيقاف المؤقت")
+    elif action == "resume" and job['status'] == BroadcastJobStore.PAUSED:
+        if job_id in broadcast_tasks:
+            await query.answer("⏳ انتظر حتى يتوقف الإرسال الحالي")
+            return
+        broadcast_jobs.set_status(job_id, BroadcastJobStore.RUNNING)
+        start_broadcast_job(context.bot, job_id)
+        await query.answer("▶️ تم الاستئناف")
+    elif action == "cancel":
+        if job_id in broadcast_tasks:
+            broadcast_controls[job_id] = BroadcastJobStore.CANCELLED
+        broadcast_jobs.set_status(job_id, BroadcastJobStore.CANCELLED)
+        await query.answer("✖️ تم الإلغاء")
+    else:
+        await query.answer()
+        return
+
+    if job_id not in broadcast_tasks and job['status_message_id']:
+        # No running task will refresh the status message, do it here
+        job = broadcast_jobs.get_job(job_id)
+        try:
+            await update_broadcast_status(context.bot, job, broadcast_jobs.progress(job_id), job['status'])
+        except Exception as e:
+            logger.warning(f"Could not update broadcast status message: {e}")
 
 async def cancel_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Cancel broadcast"""
@@ -768,15 +1627,14 @@ async def grant_permissions_process(update: Update, context: ContextTypes.DEFAUL
             await update.message.reply_text("❌ هذا المستخدم مشرف بالفعل!")
             return GRANT_PERMISSIONS
 
-        bot_settings['privileged_users'].add(user_id)
-        auto_save()
+        add_user_to('privileged_users', user_id)
 
         keyboard = [[InlineKeyboardButton("🔙 رجوع للإدارة", callback_data="manage_permissions")]]
         reply_markup = InlineKeyboardMarkup(keyboard)
 
         user_info = ""
-        if user_id in bot_settings['user_stats']:
-            username = bot_settings['user_stats'][user_id]['username']
+        if user_id in user_store:
+            username = user_store.username(user_id)
             user_info = f" (@{username})"
 
         await update.message.reply_text(
@@ -908,9 +1766,8 @@ async def set_channel_process(update: Update, context: ContextTypes.DEFAULT_TYPE
             )
             return SET_CHANNEL
 
-        bot_settings['channel_id'] = chat_id
-        bot_settings['channel_username'] = channel_username
-        auto_save()
+        set_setting('channel_id', chat_id)
+        set_setting('channel_username', channel_username)
 
         keyboard = []
         if is_owner(user_id):
@@ -971,19 +1828,18 @@ async def calculate(update: Update, context: ContextTypes.DEFAULT_TYPE):
     username = update.effective_user.username
     first_name = update.effective_user.first_name
 
-    if not can_use_bot(user_id):
-        if not bot_settings['active']:
-            await update.message.reply_text("🔴 البوت متوقف حالياً من قبل الإدارة")
-        elif user_id in bot_settings['blocked_users']:
-            await update.message.reply_text("🚫 تم حظرك من استخدام البوت")
-        elif bot_settings['owner_only']:
-            await update.message.reply_text("👑 البوت متاح للمالك فقط حالياً")
-        else:
-            await update.message.reply_text("❌ غير مسموح لك باستخدام البوت")
+    reason = access.denial_reason(user_id)
+    if reason is not None:
+        # Only supervisors get here, everyone else is stopped by access_guard()
+        await update.message.reply_text(DENIAL_MESSAGES.get(reason, DEFAULT_DENIAL_MESSAGE))
         return
 
     try:
         text = update.message.text.strip()
+        if '\n' in text:
+            await calculate_batch_message(update, context, text.splitlines())
+            return
+
         prices = text.split(',')
 
         if len(prices) != 3:
@@ -1006,21 +1862,22 @@ async def calculate(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return
 
-        results = calculate_pivot_points(high, low, close)
+        method = get_pivot_method(user_id)
+        cached = get_cached_result(high, low, close, method)
         update_user_stats(user_id, username, first_name)
-        auto_save()
 
-        message = format_results(results)
-        await update.message.reply_text(message)
+        await update.message.reply_text(cached['message'])
 
-        # Send to channel if configured
+        # Send to channel if configured (channel posts always use the classic levels)
         if bot_settings['channel_id']:
-            channel_message = format_channel_recommendation(results, high, low, close)
-            channel_sent = await send_to_channel(context, channel_message)
-            if channel_sent:
-                await update.message.reply_text("📢 تم إرسال التوصية للقناة أيضاً!")
-            else:
-                logger.warning("Failed to send recommendation to channel")
+            if cached['channel_message'] is None:
+                cached['channel_message'] = format_channel_recommendation(cached['classic'], high, low, close)
+            # The reply does not wait for the channel, the ack follows once posted
+            publish_to_channel(
+                cached['channel_message'],
+                level_key(cached['classic'], close, CHANNEL_DEDUP_TOLERANCE),
+                notify_when_posted(update.effective_chat.id, "📢 تم إرسال التوصية للقناة أيضاً!")
+            )
 
         logger.info(f"Calculated pivot points for user {user_id} - H:{high}, L:{low}, C:{close}")
 
@@ -1037,6 +1894,547 @@ async def calculate(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "يرجى المحاولة مرة أخرى أو التواصل مع المطور"
         )
 
+async def reply_batch_results(update, rows, errors):
+    """Reply with a batch result table, or a CSV file when it is too long"""
+    levels = calculate_rows(rows, get_pivot_method(update.effective_user.id))
+
+    header = f"📊 تحليل النقاط المحورية - {len(rows)} صف\n"
+    footer = ""
+    if errors:
+        skipped = "، ".join(f"سطر {line_number} ({reason})" for line_number, reason in errors[:5])
+        footer = f"\n⚠️ تم تجاهل {len(errors)} صف: {html.escape(skipped)}"
+        if len(errors) > 5:
+            footer += " ..."
+
+    table = format_batch_table(rows, levels)
+    message = f"{header}{table}{footer}"
+    if len(message) <= 4000:
+        await update.message.reply_text(message, parse_mode="HTML")
+        return
+
+    csv_data = format_batch_csv(rows, levels).encode('utf-8')
+    await update.message.reply_document(
+        document=io.BytesIO(csv_data),
+        filename="pivot_points.csv",
+        caption=f"{header}{footer}".strip()[:1000],
+        parse_mode="HTML"
+    )
+
+async def calculate_batch_message(update, context, lines):
+    """Calculate pivot points for a message with several rows"""
+    try:
+        rows, errors = parse_rows(lines)
+    except BatchError as e:
+        await update.message.reply_text(f"❌ عدد الصفوف كبير جداً\n\n{e}\nأرسل ملف CSV بدلاً من ذلك")
+        return
+
+    if not rows:
+        await update.message.reply_text(
+            "❌ خطأ في التنسيق\n\n"
+            "أرسل صفاً لكل أداة بالتنسيق التالي:\n"
+            "أعلى سعر,أدنى سعر,سعر الإغلاق\n"
+            "أو: الرمز,أعلى سعر,أدنى سعر,سعر الإغلاق"
+        )
+        return
+
+    user = update.effective_user
+    update_user_stats(user.id, user.username, user.first_name)
+    await reply_batch_results(update, rows, errors)
+    logger.info(f"Calculated batch pivot points for user {user.id} - {len(rows)} rows")
+
+async def calculate_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Calculate pivot points for an uploaded CSV file"""
+    user = update.effective_user
+
+    if not can_use_bot(user.id):
+        await update.message.reply_text("❌ غير مسموح لك باستخدام البوت")
+        return
+
+    document = update.message.document
+    if document.file_size and document.file_size > 5 * 1024 * 1024:
+        await update.message.reply_text("❌ حجم الملف كبير جداً (الحد الأقصى 5MB)")
+        return
+
+    try:
+        telegram_file = await document.get_file()
+        data = await telegram_file.download_as_bytearray()
+        lines = bytes(data).decode('utf-8-sig').splitlines()
+        rows, errors = parse_rows(lines, max_rows=MAX_CSV_ROWS)
+    except BatchError as e:
+        await update.message.reply_text(f"❌ عدد الصفوف كبير جداً\n\n{e}")
+        return
+    except UnicodeDecodeError:
+        await update.message.reply_text("❌ يجب أن يكون الملف بترميز UTF-8")
+        return
+    except Exception as e:
+        logger.error(f"Error reading CSV upload: {e}")
+        await update.message.reply_text("❌ تعذر قراءة الملف")
+        return
+
+    if not rows:
+        await update.message.reply_text(
+            "❌ لم يتم العثور على صفوف صحيحة في الملف\n\n"
+            "يجب أن يحتوي كل صف على: أعلى,أدنى,إغلاق\n"
+            "أو: الرمز,أعلى,أدنى,إغلاق"
+        )
+        return
+
+    update_user_stats(user.id, user.username, user.first_name)
+    await reply_batch_results(update, rows, errors)
+    logger.info(f"Calculated CSV pivot points for user {user.id} - {len(rows)} rows")
+
+def pivot_methods_keyboard(current):
+    """Inline keyboard to choose the default pivot formula"""
+    keyboard = []
+    for method in PIVOT_FORMULAS:
+        mark = "✅ " if method == current else ""
+        keyboard.append([InlineKeyboardButton(f"{mark}{method_title(method)}", callback_data=f"method_{method}")])
+    keyboard.append([InlineKeyboardButton("🏠 القائمة الرئيسية", callback_data="main_menu")])
+    return InlineKeyboardMarkup(keyboard)
+
+async def method_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Let the user choose the default pivot formula"""
+    user_id = update.effective_user.id
+
+    if not can_use_bot(user_id):
+        await update.message.reply_text("❌ غير مسموح لك باستخدام البوت")
+        return
+
+    current = get_pivot_method(user_id)
+    await update.message.reply_text(
+        f"📐 صيغة حساب النقاط المحورية\n\n"
+        f"الصيغة الحالية: {method_title(current)}\n\n"
+        "اختر الصيغة الافتراضية لحساباتك:",
+        reply_markup=pivot_methods_keyboard(current)
+    )
+
+async def choose_pivot_method(update: Update, context: ContextTypes.DEFAULT_TYPE, method: str):
+    """Save the pivot formula chosen from the keyboard"""
+    query = update.callback_query
+    user_id = query.from_user.id
+
+    if not can_use_bot(user_id) or method not in PIVOT_FORMULAS:
+        await query.answer("❌ خيار غير معروف")
+        return
+
+    if method != get_pivot_method(user_id):
+        set_pivot_method(user_id, method)
+    await query.answer(f"✅ {method_title(method)}")
+    await query.edit_message_text(
+        f"📐 صيغة حساب النقاط المحورية\n\n"
+        f"✅ تم اختيار الصيغة {method_title(method)}\n\n"
+        "سيتم استخدامها في جميع حساباتك القادمة.",
+        reply_markup=pivot_methods_keyboard(method)
+    )
+
+async def compare_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Compare the levels of every pivot formula for one input"""
+    user_id = update.effective_user.id
+
+    if not can_use_bot(user_id):
+        await update.message.reply_text("❌ غير مسموح لك باستخدام البوت")
+        return
+
+    usage = (
+        "❌ خطأ في التنسيق\n\n"
+        "الاستخدام الصحيح:\n"
+        "/compare أعلى,أدنى,إغلاق[,افتتاح]\n\n"
+        "مثال: /compare 3250.75,3200.25,3225.50"
+    )
+    message_parts = update.message.text.split(' ', 1)
+    if len(message_parts) < 2:
+        await update.message.reply_text(usage)
+        return
+
+    try:
+        prices = [float(price.strip()) for price in message_parts[1].split(',')]
+    except ValueError:
+        await update.message.reply_text(usage)
+        return
+
+    if len(prices) not in (3, 4):
+        await update.message.reply_text(usage)
+        return
+
+    high, low, close = prices[:3]
+    open_price = prices[3] if len(prices) == 4 else None
+    if high < low:
+        await update.message.reply_text("❌ أعلى سعر يجب أن يكون أكبر من أو يساوي أدنى سعر")
+        return
+
+    all_levels = compute_all(high, low, close, open_price)
+    update_user_stats(user_id, update.effective_user.username, update.effective_user.first_name)
+
+    message = "📐 مقارنة صيغ النقاط المحورية\n"
+    message += format_methods_table(all_levels)
+    if open_price is None:
+        message += "\nℹ️ ديمارك يستخدم سعر الإغلاق كسعر افتتاح عند عدم إرساله"
+    await update.message.reply_text(message, parse_mode="HTML")
+
+async def pivot_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Pivot levels of a symbol from its stored bars"""
+    user = update.effective_user
+
+    if not can_use_bot(user.id):
+        await update.message.reply_text("❌ غير مسموح لك باستخدام البوت")
+        return
+
+    usage = (
+        "❌ خطأ في التنسيق\n\n"
+        "الاستخدام الصحيح:\n"
+        "/pivot الرمز [daily|weekly|monthly]\n\n"
+        "مثال: /pivot XAUUSD weekly"
+    )
+    args = update.message.text.split()[1:]
+    if not 1 <= len(args) <= 2:
+        await update.message.reply_text(usage)
+        return
+
+    period = args[1].lower() if len(args) == 2 else 'daily'
+    period = PERIOD_ALIASES.get(period, period)
+    if period not in PERIOD_NAMES:
+        await update.message.reply_text(usage)
+        return
+
+    try:
+        symbol = args[0].upper()
+        bar = ohlc_store.latest_period(symbol, period, time.time())
+    except OHLCError as e:
+        await update.message.reply_text(f"❌ {e}")
+        return
+
+    if bar is None:
+        symbols = "، ".join(ohlc_store.symbols()[:20]) or "لا توجد"
+        await update.message.reply_text(
+            f"❌ لا توجد بيانات {PERIOD_NAMES[period]}ة مكتملة للرمز {symbol}\n\n"
+            f"الرموز المتاحة: {symbols}"
+        )
+        return
+
+    started, open_price, high, low, close = bar
+    method = get_pivot_method(user.id)
+    cached = get_cached_result(high, low, close, method)
+    update_user_stats(user.id, user.username, user.first_name)
+
+    header = (
+        f"📈 {symbol} - إطار {PERIOD_NAMES[period]} ({format_time(started, period)})\n"
+        f"أعلى: {high:.2f} | أدنى: {low:.2f} | إغلاق: {close:.2f}\n\n"
+    )
+    await update.message.reply_text(header + cached['message'])
+    logger.info(f"Calculated {period} pivot points of {symbol} for user {user.id}")
+
+def parse_and_store_bars(symbol, lines):
+    """(parsed bars, errors, added, stored count, last stored time)"""
+    bars, errors = parse_bars(lines)
+    added = ohlc_store.append(symbol, bars)
+    series = ohlc_store.get(symbol)
+    return len(bars), errors, added, series.count, series.last_time()
+
+async def store_bars(update, symbol, lines):
+    """Append bars parsed from `lines` to a symbol and report the result"""
+    try:
+        # Up to MAX_CSV_BARS rows take seconds to parse and write
+        parsed, errors, added, count, last_time = await asyncio.to_thread(parse_and_store_bars, symbol, lines)
+    except OHLCError as e:
+        await update.message.reply_text(f"❌ {e}")
+        return
+
+    message = (
+        f"✅ {symbol.upper()}: تمت إضافة {added} شمعة\n"
+        f"📦 الإجمالي: {count} شمعة"
+    )
+    if count:
+        message += f" حتى {format_time(last_time)}"
+    if parsed > added:
+        message += f"\n⏭️ تم تجاهل {parsed - added} شمعة أقدم من آخر شمعة محفوظة"
+    if errors:
+        skipped = "، ".join(f"سطر {line_number} ({reason})" for line_number, reason in errors[:5])
+        message += f"\n⚠️ تم تجاهل {len(errors)} صف: {skipped}"
+    await update.message.reply_text(message)
+    logger.info(f"Stored {added} bars for {symbol} from user {update.effective_user.id}")
+
+async def bars_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Add OHLC bars for a symbol: /bars SYMBOL followed by one bar per line"""
+    if not is_privileged(update.effective_user.id):
+        await update.message.reply_text("❌ هذا الأمر متاح للمشرفين والمالك فقط")
+        return
+
+    lines = update.message.text.splitlines()
+    args = lines[0].split()[1:]
+    if len(args) != 1:
+        await update.message.reply_text(
+            "❌ خطأ في التنسيق\n\n"
+            "الاستخدام الصحيح:\n"
+            "/bars الرمز\n"
+            "الوقت,افتتاح,أعلى,أدنى,إغلاق\n"
+            "(سطر لكل شمعة، أو ملف CSV مع /bars الرمز في التعليق)\n\n"
+            "مثال:\n/bars XAUUSD\n2024-01-02,2063.5,2079.3,2059.1,2071.4"
+        )
+        return
+    await store_bars(update, args[0], lines[1:])
+
+async def bars_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Add OHLC bars from a CSV upload captioned /bars SYMBOL"""
+    if not is_privileged(update.effective_user.id):
+        await update.message.reply_text("❌ هذا الأمر متاح للمشرفين والمالك فقط")
+        return
+
+    args = update.message.caption.split()[1:]
+    if len(args) != 1:
+        await update.message.reply_text("❌ اكتب /bars الرمز في تعليق الملف")
+        return
+
+    document = update.message.document
+    if document.file_size and document.file_size > 20 * 1024 * 1024:
+        await update.message.reply_text("❌ حجم الملف كبير جداً (الحد الأقصى 20MB)")
+        return
+
+    try:
+        telegram_file = await document.get_file()
+        data = await telegram_file.download_as_bytearray()
+        lines = bytes(data).decode('utf-8-sig').splitlines()
+    except UnicodeDecodeError:
+        await update.message.reply_text("❌ يجب أن يكون الملف بترميز UTF-8")
+        return
+    except Exception as e:
+        logger.error(f"Error reading bars upload: {e}")
+        await update.message.reply_text("❌ تعذر قراءة الملف")
+        return
+    await store_bars(update, args[0], lines)
+
+def format_backtest_report(report):
+    """Arabic summary of a backtest"""
+    trade_type = "سكالبينغ (يومي)" if report.strategy == 'scalp' else "سوينغ (أسبوعي)"
+    message = f"🧪 اختبار تاريخي - {trade_type}\n"
+    message += "━━━━━━━━━━━━━━━━━━━━━━\n"
+    if report.first_time is not None:
+        message += f"📅 من {format_time(report.first_time)} إلى {format_time(report.last_time)}\n"
+    message += f"🛑 حد وقف الخسارة: {report.rules.stop_cap:g} نقطة\n"
+    message += f"📊 الصفقات: {report.trades} من {report.periods} فترة ({report.buys} شراء / {report.trades - report.buys} بيع)\n\n"
+    for target, hits in enumerate(report.target_hits, 1):
+        message += f"🎯 TP{target}: {report.rate(hits):.1%}\n"
+    message += f"🛡️ ضرب وقف الخسارة: {report.rate(report.stopped):.1%}\n"
+    message += f"✅ صفقات رابحة: {report.rate(report.wins):.1%}\n"
+    message += f"💰 صافي النقاط: {report.pnl:.2f}\n"
+    message += f"📉 أقصى تراجع: {report.max_drawdown:.2f} نقطة\n"
+    if len(report.symbols) > 1:
+        message += "\n"
+        for symbol, (trades, pnl) in sorted(report.symbols.items()):
+            message += f"• {symbol}: {trades} صفقة، {pnl:.2f} نقطة\n"
+    return message
+
+async def backtest_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Replay the scalp/swing recommendation rules over the stored bars"""
+    user_id = update.effective_user.id
+
+    if not is_privileged(user_id):
+        await update.message.reply_text("❌ هذا الأمر متاح للمشرفين والمالك فقط")
+        return
+
+    args = update.message.text.split()[1:]
+    strategy = 'scalp'
+    if args and args[0].lower() in backtest.STRATEGIES:
+        strategy = args.pop(0).lower()
+    symbols = [symbol.upper() for symbol in args] or ohlc_store.symbols()
+    if not symbols:
+        await update.message.reply_text("❌ لا توجد بيانات تاريخية، أضفها أولاً باستخدام /bars")
+        return
+
+    try:
+        # Years of bars take a moment, keep the event loop free meanwhile
+        report = await asyncio.to_thread(backtest.run, ohlc_store, symbols, strategy)
+    except (OHLCError, backtest.BacktestError) as e:
+        await update.message.reply_text(f"❌ {e}")
+        return
+
+    if not report.trades:
+        await update.message.reply_text("❌ لا توجد صفقات في البيانات المتاحة")
+        return
+    await update.message.reply_text(format_backtest_report(report))
+    logger.info(f"Backtest {strategy} of {', '.join(symbols)} for user {user_id}: {report.trades} trades")
+
+def format_watched_levels(levels):
+    """Levels of a watched symbol, one per line from R3 down to S3"""
+    ordered = sorted(((value, name) for name, value in levels.items() if value is not None), reverse=True)
+    return "\n".join(f"{price_feed.level_title(name)}: {value:.2f}" for value, name in ordered)
+
+def watch_symbol(user_id, symbol):
+    """Add a user to the watchers of a symbol"""
+    commit_change('watch', symbol=symbol, uid=user_id)
+
+def unwatch_symbol(user_id, symbol):
+    """Remove a user from the watchers of a symbol"""
+    commit_change('unwatch', symbol=symbol, uid=user_id)
+
+async def watch_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Get alerts when the live price of a symbol touches its pivot levels"""
+    user_id = update.effective_user.id
+
+    if not can_use_bot(user_id):
+        await update.message.reply_text("❌ غير مسموح لك باستخدام البوت")
+        return
+
+    args = update.message.text.split()[1:]
+    watched = [symbol for symbol, watchers in bot_settings['level_watchers'].items() if user_id in watchers]
+    if not args:
+        if not watched:
+            await update.message.reply_text(
+                "🔕 لا تتابع أي رمز\n\n"
+                "الاستخدام: /watch الرمز\n"
+                "مثال: /watch XAUUSD"
+            )
+        else:
+            await update.message.reply_text("🔔 الرموز التي تتابعها: " + "، ".join(sorted(watched)))
+        return
+
+    try:
+        symbol = normalize_symbol(args[0])
+    except OHLCError as e:
+        await update.message.reply_text(f"❌ {e}")
+        return
+    if symbol not in watched and len(watched) >= MAX_WATCHED_SYMBOLS:
+        await update.message.reply_text(f"❌ الحد الأقصى {MAX_WATCHED_SYMBOLS} رمزاً")
+        return
+
+    watch_symbol(user_id, symbol)
+    message = f"🔔 ستصلك تنبيهات عند وصول سعر {symbol} إلى مستوياته المحورية"
+    levels = tick_processor.levels(symbol) if tick_processor is not None else None
+    if levels:
+        message += "\n\n" + format_watched_levels(levels)
+    elif not PRICE_FEED:
+        message += "\n\n⚠️ لا يوجد مصدر أسعار مباشر حالياً"
+    await update.message.reply_text(message)
+    logger.info(f"User {user_id} watches {symbol}")
+
+def resolve_alert_level(user_id, symbol, text):
+    """(price, label) of an alert level given as a number or as PP/R1-R3/S1-S3
+
+    Named levels come from the live session when the feed has one, otherwise
+    from the last complete day of stored bars, with the user's formula."""
+    try:
+        return round(float(text.replace(',', '.')), 2), None
+    except ValueError:
+        pass
+    title = text.upper()
+    if title not in LEVEL_TITLES:
+        raise ValueError(f"مستوى غير معروف: {text}")
+    name = LEVELS[LEVEL_TITLES.index(title)]
+    levels = tick_processor.levels(symbol) if tick_processor is not None else None
+    if levels is None:
+        bar = ohlc_store.latest_period(symbol, 'daily', time.time())
+        if bar is None:
+            raise ValueError(f"لا توجد مستويات محسوبة للرمز {symbol}، أرسل السعر كرقم")
+        _, open_price, high, low, close = bar
+        levels = compute_levels(high, low, close, get_pivot_method(user_id), open_price)
+    if levels.get(name) is None:
+        raise ValueError(f"المستوى {title} غير متاح في هذه الصيغة")
+    return levels[name], title
+
+async def alert_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Create a one-shot price alert: /alert SYMBOL PRICE|LEVEL [note]"""
+    user_id = update.effective_user.id
+
+    if not can_use_bot(user_id):
+        await update.message.reply_text("❌ غير مسموح لك باستخدام البوت")
+        return
+
+    usage = (
+        "❌ خطأ في التنسيق\n\n"
+        "الاستخدام الصحيح:\n"
+        "/alert الرمز السعر [ملاحظة]\n"
+        "/alert الرمز R1|R2|R3|PP|S1|S2|S3\n\n"
+        "مثال: /alert XAUUSD 3250.75\n"
+        "مثال: /alert XAUUSD R1"
+    )
+    args = update.message.text.split(maxsplit=3)[1:]
+    if len(args) < 2:
+        await update.message.reply_text(usage)
+        return
+
+    try:
+        symbol = normalize_symbol(args[0])
+        price, label = resolve_alert_level(user_id, symbol, args[1])
+    except ValueError as e:
+        await update.message.reply_text(f"❌ {e}")
+        return
+    if not (math.isfinite(price) and price > 0):
+        await update.message.reply_text(usage)
+        return
+    if len(args) == 3:
+        label = f"{label} - {args[2][:100]}" if label else args[2][:100]
+
+    if len(alert_book.user_alerts(user_id)) >= MAX_ALERTS_PER_USER:
+        await update.message.reply_text(f"❌ الحد الأقصى {MAX_ALERTS_PER_USER} تنبيهاً، احذف بعضها باستخدام /delalert")
+        return
+
+    alert = alert_book.add(user_id, symbol, price, label)
+    message = f"⏰ تم إنشاء التنبيه #{alert['alert_id']}: {symbol} عند {price:.2f}"
+    if label:
+        message += f" ({label})"
+    last_price = alert_book.last_price(symbol)
+    if last_price is not None:
+        message += f"\nالسعر الحالي: {last_price:.2f}"
+    elif not PRICE_FEED:
+        message += "\n\n⚠️ لا يوجد مصدر أسعار مباشر حالياً"
+    await update.message.reply_text(message)
+    logger.info(f"User {user_id} set alert {alert['alert_id']} on {symbol} at {price}")
+
+async def alerts_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """List the active price alerts of the user"""
+    user_id = update.effective_user.id
+
+    user_alerts = alert_book.user_alerts(user_id)
+    if not user_alerts:
+        await update.message.reply_text("🔕 لا توجد تنبيهات نشطة\n\nلإنشاء تنبيه: /alert الرمز السعر")
+        return
+    lines = [f"⏰ تنبيهاتك النشطة ({len(user_alerts)}):", ""]
+    for alert in user_alerts:
+        label = f" ({alert['label']})" if alert['label'] else ""
+        lines.append(f"#{alert['alert_id']} {alert['symbol']} عند {alert['price']:.2f}{label}")
+    lines.append("")
+    lines.append("للحذف: /delalert رقم_التنبيه أو /delalert all")
+    await update.message.reply_text("\n".join(lines))
+
+async def delalert_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Cancel price alerts of the user: /delalert ID [ID...] or /delalert all"""
+    user_id = update.effective_user.id
+
+    args = update.message.text.split()[1:]
+    if args and args[0].lower() == 'all':
+        alert_ids = [alert['alert_id'] for alert in alert_book.user_alerts(user_id)]
+    else:
+        try:
+            alert_ids = [int(arg.lstrip('#')) for arg in args]
+        except ValueError:
+            alert_ids = []
+    if not alert_ids:
+        await update.message.reply_text("الاستخدام: /delalert رقم_التنبيه أو /delalert all")
+        return
+
+    cancelled = alert_book.cancel(alert_ids, user_id)
+    if not cancelled:
+        await update.message.reply_text("❌ لا توجد تنبيهات نشطة بهذه الأرقام")
+        return
+    await update.message.reply_text(f"🗑️ تم حذف {len(cancelled)} تنبيه")
+    logger.info(f"User {user_id} cancelled alerts {cancelled}")
+
+async def unwatch_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Stop the level alerts of a symbol"""
+    user_id = update.effective_user.id
+
+    args = update.message.text.split()[1:]
+    if len(args) != 1:
+        await update.message.reply_text("الاستخدام: /unwatch الرمز")
+        return
+
+    symbol = args[0].strip().upper()
+    if user_id not in bot_settings['level_watchers'].get(symbol, ()):
+        await update.message.reply_text(f"❌ أنت لا تتابع {symbol}")
+        return
+    unwatch_symbol(user_id, symbol)
+    await update.message.reply_text(f"🔕 تم إيقاف تنبيهات {symbol}")
+    logger.info(f"User {user_id} stopped watching {symbol}")
+
 async def pivot_guide(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show pivot points guide"""
     query = update.callback_query
@@ -1124,6 +2522,14 @@ async def commands_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
 • /help - دليل الاستخدام التفصيلي
 • /signal - توصيات السكالبينغ والسوينغ
 • إرسال الأرقام - حساب النقاط المحورية
+• إرسال عدة أسطر أو ملف CSV - حساب مجمّع
+• /method - اختيار صيغة الحساب (كلاسيكية، فيبوناتشي، كاماريلا، وودي، ديمارك)
+• /compare أعلى,أدنى,إغلاق - مقارنة جميع الصيغ
+• /pivot الرمز [daily|weekly|monthly] - النقاط المحورية من البيانات المحفوظة
+• /watch الرمز - تنبيه عند وصول السعر المباشر إلى المستويات
+• /unwatch الرمز - إيقاف التنبيه
+• /alert الرمز السعر|R1|S1... - تنبيه عند وصول السعر إلى مستوى
+• /alerts - تنبيهاتك النشطة، /delalert للحذف
 
 📊 كيفية الاستخدام:
 أرسل البيانات بالتنسيق: أعلى,أدنى,إغلاق
@@ -1139,6 +2545,8 @@ async def commands_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
         commands_text += """\n\n🔧 أوامر المشرفين:
 • /scalp أعلى,أدنى,إغلاق - توصية سكالبينغ مخصصة
 • /swing أعلى,أدنى,إغلاق - توصية سوينغ مخصصة
+• /bars الرمز - إضافة شموع تاريخية (نص أو ملف CSV)
+• /backtest [scalp|swing] [الرموز] - اختبار التوصيات على البيانات التاريخية
 • لوحة المشرف - إدارة القناة والرسائل
 • إعداد قناة التوصيات
 • إرسال رسائل جماعية
@@ -1273,21 +2681,23 @@ async def scalp_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         # إرسال التوصية للقناة
         channel_message = format_custom_recommendation(results, high, low, close, "scalp")
-        channel_sent = await send_to_channel(context, channel_message)
+        confirmation = (
+            f"✅ تم إرسال توصية السكالبينغ للقناة بنجاح!\n\n"
+            f"📊 البيانات المستخدمة:\n"
+            f"• أعلى: {high:.2f}\n"
+            f"• أدنى: {low:.2f}\n"
+            f"• إغلاق: {close:.2f}\n\n"
+            f"⚡ نوع التوصية: سكالبينغ (دخول وخروج سريع)"
+        )
+        queued = publish_to_channel(
+            channel_message,
+            callback=notify_when_posted(update.effective_chat.id, confirmation, "❌ فشل في إرسال التوصية للقناة!")
+        )
         
-        if channel_sent:
-            await update.message.reply_text(
-                f"✅ تم إرسال توصية السكالبينغ للقناة بنجاح!\n\n"
-                f"📊 البيانات المستخدمة:\n"
-                f"• أعلى: {high:.2f}\n"
-                f"• أدنى: {low:.2f}\n"
-                f"• إغلاق: {close:.2f}\n\n"
-                f"⚡ نوع التوصية: سكالبينغ (دخول وخروج سريع)"
-            )
-        else:
+        if not queued:
             await update.message.reply_text("❌ فشل في إرسال التوصية للقناة!")
 
-        logger.info(f"Custom scalp recommendation sent by user {user_id} - H:{high}, L:{low}, C:{close}")
+        logger.info(f"Custom scalp recommendation queued by user {user_id} - H:{high}, L:{low}, C:{close}")
 
     except ValueError:
         await update.message.reply_text(
@@ -1347,21 +2757,23 @@ async def swing_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         # إرسال التوصية للقناة
         channel_message = format_custom_recommendation(results, high, low, close, "swing")
-        channel_sent = await send_to_channel(context, channel_message)
+        confirmation = (
+            f"✅ تم إرسال توصية السوينغ للقناة بنجاح!\n\n"
+            f"📊 البيانات المستخدمة:\n"
+            f"• أعلى: {high:.2f}\n"
+            f"• أدنى: {low:.2f}\n"
+            f"• إغلاق: {close:.2f}\n\n"
+            f"📊 نوع التوصية: سوينغ (صبر على الأهداف)"
+        )
+        queued = publish_to_channel(
+            channel_message,
+            callback=notify_when_posted(update.effective_chat.id, confirmation, "❌ فشل في إرسال التوصية للقناة!")
+        )
         
-        if channel_sent:
-            await update.message.reply_text(
-                f"✅ تم إرسال توصية السوينغ للقناة بنجاح!\n\n"
-                f"📊 البيانات المستخدمة:\n"
-                f"• أعلى: {high:.2f}\n"
-                f"• أدنى: {low:.2f}\n"
-                f"• إغلاق: {close:.2f}\n\n"
-                f"📊 نوع التوصية: سوينغ (صبر على الأهداف)"
-            )
-        else:
+        if not queued:
             await update.message.reply_text("❌ فشل في إرسال التوصية للقناة!")
 
-        logger.info(f"Custom swing recommendation sent by user {user_id} - H:{high}, L:{low}, C:{close}")
+        logger.info(f"Custom swing recommendation queued by user {user_id} - H:{high}, L:{low}, C:{close}")
 
     except ValueError:
         await update.message.reply_text(
@@ -1399,79 +2811,81 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     reply_markup = InlineKeyboardMarkup(keyboard)
     await update.message.reply_text(help_message, reply_markup=reply_markup)
 
-async def handle_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle all callback queries"""
+async def revoke_permissions(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int):
+    """Remove a supervisor chosen from the revoke menu"""
     query = update.callback_query
-    data = query.data
+    if not is_owner(query.from_user.id):
+        await query.answer("❌ هذه الصفحة للمالك فقط")
+        return
 
-    try:
-        if data == "admin_panel":
-            await admin_panel(update, context)
-        elif data == "supervisor_panel":
-            await supervisor_panel(update, context)
-        elif data == "main_menu":
-            await start(update, context)
-        elif data == "commands_list":
-            await commands_list(update, context)
-        elif data == "pivot_guide":
-            await pivot_guide(update, context)
-        elif data == "trading_guide":
-            await trading_guide(update, context)
-        elif data == "manage_permissions":
-            await manage_permissions(update, context)
-        elif data == "setup_channel":
-            await setup_channel(update, context)
-        elif data == "add_channel":
-            await set_channel_start(update, context)
-        elif data == "send_broadcast":
-            await send_broadcast_start(update, context)
-        elif data == "grant_permissions":
-            await grant_permissions_start(update, context)
-        elif data.startswith("confirm_broadcast_"):
-            await confirm_broadcast(update, context)
-        elif data == "cancel_broadcast":
-            await cancel_broadcast(update, context)
-        elif data == "list_supervisors":
-            await list_supervisors(update, context)
-        elif data == "revoke_permissions":
-            await revoke_permissions_menu(update, context)
-        elif data.startswith("revoke_"):
-            user_id = int(data.split("_")[1])
-            bot_settings['privileged_users'].discard(user_id)
-            auto_save()
-            await query.answer("✅ تم إزالة الصلاحيات!")
-            await revoke_permissions_menu(update, context)
-        elif data == "edit_texts":
-            await edit_texts_menu(update, context)
-        elif data.startswith("edit_text_"):
-            await edit_text_start(update, context)
-        elif data == "toggle_bot":
-            await toggle_bot(update, context)
-        elif data == "manage_users":
-            await manage_users(update, context)
-        elif data == "detailed_stats":
-            await detailed_stats(update, context)
-        elif data in ["set_public", "set_owner_only", "set_inactive", "remove_channel"]:
-            await handle_bot_settings(update, context)
-        elif data == "list_allowed":
-            await list_allowed_users(update, context)
-        elif data == "list_blocked":
-            await list_blocked_users(update, context)
-        elif data == "unblock_user":
-            await unblock_user_start(update, context)
-        elif data.startswith("unblock_"):
-            user_id = int(data.split("_")[1])
-            bot_settings['blocked_users'].discard(user_id)
-            auto_save()
-            await query.answer("✅ تم إلغاء الحظر!")
-            await unblock_user_start(update, context)
-        elif data == "save_settings":
-            await save_settings_manually(update, context)
-        else:
-            await query.answer("❌ خيار غير معروف")
-    except Exception as e:
-        logger.error(f"Error in callback handler: {e}")
-        await query.answer("❌ حدث خطأ, يرجى المحاولة مرة أخرى")
+    discard_user_from('privileged_users', user_id)
+    await query.answer("✅ تم إزالة الصلاحيات!")
+    await revoke_permissions_menu(update, context)
+
+async def unblock_user(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int):
+    """Unblock a user chosen from the unblock menu"""
+    query = update.callback_query
+    if not is_privileged(query.from_user.id):
+        await query.answer("❌ غير مسموح لك بالوصول لهذه الصفحة")
+        return
+
+    discard_user_from('blocked_users', user_id)
+    await query.answer("✅ تم إلغاء الحظر!")
+    await unblock_user_start(update, context)
+
+async def unknown_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Answer callback data that has no route"""
+    await update.callback_query.answer("❌ خيار غير معروف")
+
+async def callback_error(update: Update, context: ContextTypes.DEFAULT_TYPE, error):
+    """Answer a callback whose handler raised"""
+    logger.error(f"Error in callback handler: {error}")
+    await update.callback_query.answer("❌ حدث خطأ, يرجى المحاولة مرة أخرى")
+
+def register_callback_routes():
+    """Fill the callback routing table"""
+    router = callback_router
+    router.add("admin_panel", admin_panel)
+    router.add("supervisor_panel", supervisor_panel)
+    router.add("main_menu", start)
+    router.add("commands_list", commands_list)
+    router.add("pivot_guide", pivot_guide)
+    router.add("trading_guide", trading_guide)
+    router.add("manage_permissions", manage_permissions)
+    router.add("setup_channel", setup_channel)
+    router.add("add_channel", set_channel_start)
+    router.add("send_broadcast", send_broadcast_start)
+    router.add("grant_permissions", grant_permissions_start)
+    router.add("cancel_broadcast", cancel_broadcast)
+    router.add("broadcast_jobs", broadcast_jobs_menu)
+    router.add("list_supervisors", list_supervisors)
+    router.add("revoke_permissions", revoke_permissions_menu)
+    router.add("edit_texts", edit_texts_menu)
+    router.add("toggle_bot", toggle_bot)
+    router.add("manage_users", manage_users)
+    router.add("detailed_stats", detailed_stats)
+    router.add("metrics_summary", metrics_summary)
+    router.add("strategy_menu", strategy_menu)
+    router.add("strategy_reset", reset_strategy)
+    router.add_many(["set_public", "set_owner_only", "set_inactive", "remove_channel"], handle_bot_settings)
+    router.add("list_allowed", list_allowed_users)
+    router.add("list_blocked", list_blocked_users)
+    router.add("unblock_user", unblock_user_start)
+    router.add("save_settings", save_settings_manually)
+    # edit_text_* buttons start the edit_text_handler conversation, which
+    # sees them before handle_callbacks()
+
+    router.add_prefix("confirm_broadcast_", confirm_broadcast, int)
+    router.add_prefix("bc_", control_broadcast_job, str, int)
+    router.add_prefix("revoke_", revoke_permissions, int)
+    router.add_prefix("unblock_", unblock_user, int)
+    router.add_prefix("method_", choose_pivot_method, str)
+    router.add_prefix("sweep_", run_strategy_sweep, trade_type_arg)
+    router.add_prefix("apply_rules_", apply_sweep_result, trade_type_arg, int)
+
+async def handle_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle all callback queries"""
+    await callback_router.dispatch(update, context, unknown_callback, callback_error)
 
 async def edit_texts_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show text editing menu for admin"""
@@ -1506,9 +2920,12 @@ async def edit_text_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     if not is_owner(query.from_user.id):
         await query.edit_message_text("❌ هذه الصفحة للمالك فقط")
-        return
+        return ConversationHandler.END
 
-    text_key = query.data.replace("edit_text_", "")
+    text_key = query.data.removeprefix("edit_text_")
+    if text_key not in bot_settings['custom_texts']:
+        await query.edit_message_text("❌ نص غير معروف")
+        return ConversationHandler.END
     context.user_data['editing_text_key'] = text_key
 
     text_names = {
@@ -1556,8 +2973,7 @@ async def edit_text_process(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return EDIT_TEXT
 
-    bot_settings['custom_texts'][text_key] = new_text
-    auto_save()
+    set_custom_text(text_key, new_text)
 
     text_names = {
         'welcome_message': 'رسالة الترحيب',
@@ -1637,19 +3053,31 @@ async def detailed_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     stats_text = f"📊 الإحصائيات التفصيلية\n"
     stats_text += "━━━━━━━━━━━━━━━━━━━━━━\n\n"
-    stats_text += f"📈 إجمالي الحسابات: {bot_settings['total_calculations']}\n"
-    stats_text += f"👥 عدد المستخدمين: {len(bot_settings['user_stats'])}\n"
+    stats_text += f"📈 إجمالي الحسابات: {user_store.total_calculations()}\n"
+    user_count = user_store.count()
+    reachable_count = user_store.reachable_count()
+    stats_text += f"👥 عدد المستخدمين: {user_count}\n"
+    stats_text += f"📬 الجمهور القابل للوصول: {reachable_count}\n"
+    stats_text += f"💀 محادثات غير متاحة: {user_count - reachable_count}\n"
     stats_text += f"✅ المسموحين: {len(bot_settings['allowed_users'])}\n"
     stats_text += f"🚫 المحظورين: {len(bot_settings['blocked_users'])}\n"
-    stats_text += f"👑 المشرفين: {len(bot_settings['privileged_users'])}\n\n"
-
-    if bot_settings['user_stats']:
-        sorted_users = sorted(
-            bot_settings['user_stats'].items(),
-            key=lambda x: x[1]['calculations'],
-            reverse=True
-        )[:5]
-
+    stats_text += f"👑 المشرفين: {len(bot_settings['privileged_users'])}\n"
+    stats_text += f"⚡ ذاكرة النتائج: {result_cache.hits} إصابة / {result_cache.misses} إخفاق ({result_cache.hit_ratio:.0%})\n"
+    if unhandled_updates:
+        unhandled = ", ".join(f"{kind}: {count}" for kind, count in sorted(unhandled_updates.items()))
+        stats_text += f"🗑️ تحديثات بدون معالج: {unhandled}\n"
+    slowest_routes = sorted(
+        (route for route in callback_router.routes if route.stats.calls),
+        key=lambda route: route.stats.average_ms, reverse=True
+    )[:3]
+    if slowest_routes:
+        stats_text += "⏱️ أبطأ الأزرار: " + ", ".join(
+            f"{route.name} {route.stats.average_ms:.0f}ms ({route.stats.errors} خطأ)" for route in slowest_routes
+        ) + "\n"
+    stats_text += "\n"
+
+    sorted_users = user_store.top_users(5)
+    if sorted_users:
         stats_text += "🏆 أكثر المستخدمين نشاطاً:\n"
         for i, (user_id_stat, data) in enumerate(sorted_users, 1):
             username = data['username'] or f"User_{user_id_stat}"
@@ -1664,6 +3092,178 @@ async def detailed_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     reply_markup = InlineKeyboardMarkup(keyboard)
     await query.edit_message_text(stats_text, reply_markup=reply_markup)
 
+def format_latency_lines(histogram, limit=8):
+    """Busiest series of a histogram as "name: p50 / p95 (count)" lines"""
+    series = sorted(histogram.series.items(), key=lambda item: item[1].count, reverse=True)[:limit]
+    return [
+        f"• {labels[0]}: {item.quantile(0.5) * 1000:.0f} / {item.quantile(0.95) * 1000:.0f}ms ({item.count})"
+        for labels, item in series
+    ]
+
+async def metrics_summary(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show a summary of the performance metrics"""
+    query = update.callback_query
+    await query.answer()
+
+    if not is_owner(query.from_user.id):
+        await query.edit_message_text("❌ هذه الصفحة للمالك فقط")
+        return
+
+    text = "📈 مقاييس الأداء\n"
+    text += "━━━━━━━━━━━━━━━━━━━━━━\n\n"
+
+    handler_lines = format_latency_lines(handler_latency)
+    if handler_lines:
+        text += "⏱️ الأوامر (p50 / p95):\n" + "\n".join(handler_lines) + "\n\n"
+
+    callback_lines = format_latency_lines(callback_latency, 5)
+    if callback_lines:
+        text += "🔘 الأزرار (p50 / p95):\n" + "\n".join(callback_lines) + "\n\n"
+
+    api_lines = format_latency_lines(api_latency, 5)
+    if api_lines:
+        text += "🌐 Telegram API (p50 / p95):\n" + "\n".join(api_lines) + "\n"
+        failed_calls = sum(api_errors.series.values())
+        text += f"❌ طلبات فاشلة: {failed_calls}\n\n"
+
+    flushes = flush_latency.get()
+    text += f"💾 حفظ الإعدادات: {flushes.count} مرة، p95 {flushes.quantile(0.95) * 1000:.0f}ms\n"
+    depths = ", ".join(f"{labels[0]}: {queue_depth.value(*labels)}" for labels in queue_depth.series)
+    text += f"📥 الطوابير: {depths}\n"
+    if METRICS_PORT:
+        text += "\n🔗 المقاييس الكاملة على /metrics"
+
+    keyboard = [[InlineKeyboardButton("🔙 رجوع", callback_data="admin_panel")]]
+    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+
+TRADE_TYPE_NAMES = {'scalp': "السكالبينغ", 'swing': "السوينغ"}
+
+def trade_type_arg(value):
+    """Callback decoder for a trade type"""
+    if value not in backtest.STRATEGIES:
+        raise ValueError(value)
+    return value
+
+def format_rules(rules):
+    """One-line Arabic description of the recommendation rules"""
+    return (
+        f"وقف ≤ {rules['stop_cap']:g} نقطة، "
+        f"الدخول عند {rules['entry_depth']:.0%} من المنطقة، "
+        f"الخروج عند TP{rules['target']}"
+    )
+
+async def strategy_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show the recommendation rules and the sweep buttons"""
+    query = update.callback_query
+    await query.answer()
+
+    if not is_owner(query.from_user.id):
+        await query.edit_message_text("❌ هذه الصفحة للمالك فقط")
+        return
+
+    text = "🧪 ضبط الاستراتيجية\n"
+    text += "━━━━━━━━━━━━━━━━━━━━━━\n\n"
+    for trade_type, name in TRADE_TYPE_NAMES.items():
+        text += f"• {name}: {format_rules(bot_settings['strategy'][trade_type])}\n"
+    text += (
+        f"\n🔍 المسح يختبر {len(sweep.grid())} تركيبة من حد وقف الخسارة وعمق الدخول وهدف الخروج "
+        "على البيانات التاريخية ويرتبها حسب صافي النقاط"
+    )
+
+    keyboard = [
+        [InlineKeyboardButton(f"🔍 مسح {name}", callback_data=f"sweep_{trade_type}")]
+        for trade_type, name in TRADE_TYPE_NAMES.items()
+    ]
+    keyboard.append([InlineKeyboardButton("♻️ استعادة الافتراضي", callback_data="strategy_reset")])
+    keyboard.append([InlineKeyboardButton("🔙 رجوع", callback_data="admin_panel")])
+    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+
+async def run_strategy_sweep(update: Update, context: ContextTypes.DEFAULT_TYPE, trade_type: str):
+    """Sweep the rule grid for a trade type and show the ranked results"""
+    query = update.callback_query
+
+    if not is_owner(query.from_user.id):
+        await query.answer("❌ هذه الصفحة للمالك فقط")
+        return
+    if sweep_lock.locked():
+        await query.answer("⏳ يوجد مسح جارٍ بالفعل")
+        return
+    if not ohlc_store.symbols():
+        await query.answer("❌ لا توجد بيانات تاريخية، أضفها أولاً باستخدام /bars", show_alert=True)
+        return
+    await query.answer()
+
+    keyboard = [[InlineKeyboardButton("🔙 رجوع", callback_data="strategy_menu")]]
+    await query.edit_message_text(f"⏳ جاري مسح {TRADE_TYPE_NAMES[trade_type]}...")
+    try:
+        async with sweep_lock:
+            # Worker processes do the work, the thread only waits for them
+            reports = await asyncio.to_thread(sweep.sweep, ohlc_store, None, trade_type, None, SWEEP_WORKERS)
+    except Exception as e:
+        logger.error(f"Strategy sweep failed: {e}")
+        await query.edit_message_text("❌ فشل المسح", reply_markup=InlineKeyboardMarkup(keyboard))
+        return
+
+    if not reports:
+        await query.edit_message_text(
+            f"❌ لا توجد مجموعة معايير بها {sweep.MIN_TRADES} صفقة على الأقل في البيانات المتاحة",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+        return
+    last_sweeps[trade_type] = reports[:SWEEP_SHOWN]
+
+    text = f"🧪 نتائج مسح {TRADE_TYPE_NAMES[trade_type]}\n"
+    text += f"<pre>{html.escape(sweep.format_table(reports, SWEEP_SHOWN))}</pre>\n"
+    text += f"الحالية: {html.escape(format_rules(bot_settings['strategy'][trade_type]))}"
+    apply_buttons = [
+        InlineKeyboardButton(f"✅ #{number}", callback_data=f"apply_rules_{trade_type}_{number}")
+        for number in range(1, min(len(reports), SWEEP_SHOWN) + 1)
+    ]
+    keyboard = [apply_buttons[index:index + 5] for index in range(0, len(apply_buttons), 5)] + keyboard
+    await query.edit_message_text(text, parse_mode="HTML", reply_markup=InlineKeyboardMarkup(keyboard))
+    logger.info(f"Strategy sweep for {trade_type}: best {reports[0].rules.as_dict()} with {reports[0].pnl:.2f} points")
+
+async def apply_sweep_result(update: Update, context: ContextTypes.DEFAULT_TYPE, trade_type: str, number: int):
+    """Use a rule set from the last sweep for the recommendations"""
+    query = update.callback_query
+
+    if not is_owner(query.from_user.id):
+        await query.answer("❌ هذه الصفحة للمالك فقط")
+        return
+
+    reports = last_sweeps.get(trade_type, [])
+    if not 1 <= number <= len(reports):
+        await query.answer("❌ انتهت صلاحية النتائج، أعد المسح", show_alert=True)
+        return
+    await query.answer()
+
+    rules = reports[number - 1].rules.as_dict()
+    commit_change('set', key='strategy', value=dict(bot_settings['strategy'], **{trade_type: rules}))
+
+    keyboard = [[InlineKeyboardButton("🔙 رجوع", callback_data="strategy_menu")]]
+    await query.edit_message_text(
+        f"✅ تم تطبيق معايير {TRADE_TYPE_NAMES[trade_type]}:\n{format_rules(rules)}",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+    logger.info(f"Owner applied {trade_type} rules {rules}")
+
+async def reset_strategy(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Restore the default recommendation rules"""
+    query = update.callback_query
+    await query.answer()
+
+    if not is_owner(query.from_user.id):
+        await query.edit_message_text("❌ هذه الصفحة للمالك فقط")
+        return
+
+    default = backtest.Rules().as_dict()
+    commit_change('set', key='strategy', value={trade_type: dict(default) for trade_type in TRADE_TYPE_NAMES})
+    keyboard = [[InlineKeyboardButton("🔙 رجوع", callback_data="strategy_menu")]]
+    await query.edit_message_text(
+        f"♻️ تمت استعادة المعايير الافتراضية:\n{format_rules(default)}",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
 async def save_settings_manually(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Manually save settings"""
     query = update.callback_query
@@ -1679,8 +3279,15 @@ async def save_settings_manually(update: Update, context: ContextTypes.DEFAULT_T
         message += f"• المسموحين: {len(bot_settings['allowed_users'])}\n"
         message += f"• المحظورين: {len(bot_settings['blocked_users'])}\n"
         message += f"• المشرفين: {len(bot_settings['privileged_users'])}\n"
-        message += f"• إجمالي الحسابات: {bot_settings['total_calculations']}\n"
-        message += f"• عدد المستخدمين: {len(bot_settings['user_stats'])}\n\n"
+        message += f"• إجمالي الحسابات: {user_store.total_calculations()}\n"
+        message += f"• عدد المستخدمين: {user_store.count()}\n\n"
+        message += "💽 الحفظ في الخلفية:\n"
+        message += f"• عمليات الكتابة: {persistence_stats['flushes']}\n"
+        message += f"• تغييرات مدمجة: {persistence_stats['coalesced_writes']}\n"
+        message += f"• آخر زمن كتابة: {persistence_stats['last_flush_ms']:.1f} ms\n"
+        message += f"• أقصى زمن كتابة: {persistence_stats['max_flush_ms']:.1f} ms\n"
+        message += f"• عمليات الضغط: {persistence_stats['compactions']}\n"
+        message += f"• سجلات اليومية الحالية: {persistence_stats['journal_records']}\n\n"
         message += "🔄 الآن عند إعادة تشغيل البوت ستبقى جميع الإعدادات محفوظة"
     else:
         message = "❌ فشل في حفظ الإعدادات!\n\n"
@@ -1700,8 +3307,8 @@ async def list_allowed_users(update: Update, context: ContextTypes.DEFAULT_TYPE)
     else:
         text = "📋 قائمة المستخدمين المسموحين:\n\n"
         for user_id in bot_settings['allowed_users']:
-            if user_id in bot_settings['user_stats']:
-                username = bot_settings['user_stats'][user_id]['username']
+            if user_id in user_store:
+                username = user_store.username(user_id)
                 text += f"• @{username} (ID: {user_id})\n"
             else:
                 text += f"• ID: {user_id}\n"
@@ -1720,8 +3327,8 @@ async def list_blocked_users(update: Update, context: ContextTypes.DEFAULT_TYPE)
     else:
         text = "🚫 قائمة المستخدمين المحظورين:\n\n"
         for user_id in bot_settings['blocked_users']:
-            if user_id in bot_settings['user_stats']:
-                username = bot_settings['user_stats'][user_id]['username']
+            if user_id in user_store:
+                username = user_store.username(user_id)
                 text += f"• @{username} (ID: {user_id})\n"
             else:
                 text += f"• ID: {user_id}\n"
@@ -1738,10 +3345,9 @@ async def handle_bot_settings(update: Update, context: ContextTypes.DEFAULT_TYPE
     action = query.data
 
     if action == "set_public":
-        bot_settings['active'] = True
-        bot_settings['owner_only'] = False
-        bot_settings['allowed_users'].clear()
-        auto_save()
+        set_setting('active', True)
+        set_setting('owner_only', False)
+        clear_users('allowed_users')
         await query.edit_message_text(
             "✅ تم تفعيل البوت للجميع بنجاح!\n\n"
             "يمكن لأي شخص استخدام البوت الآن.\n"
@@ -1750,9 +3356,8 @@ async def handle_bot_settings(update: Update, context: ContextTypes.DEFAULT_TYPE
         )
 
     elif action == "set_owner_only":
-        bot_settings['active'] = True
-        bot_settings['owner_only'] = True
-        auto_save()
+        set_setting('active', True)
+        set_setting('owner_only', True)
         await query.edit_message_text(
             "👑 تم تعيين البوت للمالك فقط!\n\n"
             "أنت الوحيد الذي يمكنه استخدام البوت الآن.\n"
@@ -1761,8 +3366,7 @@ async def handle_bot_settings(update: Update, context: ContextTypes.DEFAULT_TYPE
         )
 
     elif action == "set_inactive":
-        bot_settings['active'] = False
-        auto_save()
+        set_setting('active', False)
         await query.edit_message_text(
             "🔴 تم إيقاف البوت!\n\n"
             "البوت متوقف للجميع حالياً.\n"
@@ -1771,9 +3375,8 @@ async def handle_bot_settings(update: Update, context: ContextTypes.DEFAULT_TYPE
         )
 
     elif action == "remove_channel":
-        bot_settings['channel_id'] = None
-        bot_settings['channel_username'] = None
-        auto_save()
+        set_setting('channel_id', None)
+        set_setting('channel_username', None)
 
         await query.edit_message_text(
             "✅ تم حذف قناة التوصيات!\n\n"
@@ -1800,12 +3403,8 @@ async def add_user_process(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Process adding user"""
     try:
         user_id = int(update.message.text.strip())
-        bot_settings['allowed_users'].add(user_id)
-
-        if user_id in bot_settings['blocked_users']:
-            bot_settings['blocked_users'].remove(user_id)
-
-        auto_save()
+        add_user_to('allowed_users', user_id)
+        discard_user_from('blocked_users', user_id)
 
         keyboard = [[InlineKeyboardButton("🔙 رجوع للإدارة", callback_data="manage_users")]]
         reply_markup = InlineKeyboardMarkup(keyboard)
@@ -1849,15 +3448,9 @@ async def block_user_process(update: Update, context: ContextTypes.DEFAULT_TYPE)
             await update.message.reply_text("❌ لا يمكن حظر المالك!")
             return BLOCK_USER
 
-        bot_settings['blocked_users'].add(user_id)
-
-        if user_id in bot_settings['allowed_users']:
-            bot_settings['allowed_users'].remove(user_id)
-
-        if user_id in bot_settings['privileged_users']:
-            bot_settings['privileged_users'].remove(user_id)
-
-        auto_save()
+        add_user_to('blocked_users', user_id)
+        discard_user_from('allowed_users', user_id)
+        discard_user_from('privileged_users', user_id)
 
         keyboard = [[InlineKeyboardButton("🔙 رجوع للإدارة", callback_data="manage_users")]]
         reply_markup = InlineKeyboardMarkup(keyboard)
@@ -1896,8 +3489,8 @@ async def unblock_user_start(update: Update, context: ContextTypes.DEFAULT_TYPE)
     keyboard = []
 
     for user_id in list(bot_settings['blocked_users'])[:10]:
-        if user_id in bot_settings['user_stats']:
-            username = bot_settings['user_stats'][user_id]['username']
+        if user_id in user_store:
+            username = user_store.username(user_id)
             text += f"• @{username} (ID: {user_id})\n"
             keyboard.append([InlineKeyboardButton(f"إلغاء حظر @{username}", callback_data=f"unblock_{user_id}")])
         else:
@@ -1909,76 +3502,258 @@ async def unblock_user_start(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
     await query.edit_message_text(text, reply_markup=reply_markup)
 
+def register_queue_gauges(application):
+    """Expose internal queue depths as gauges"""
+    queue_depth.set_function(application.update_queue.qsize, "updates")
+    queue_depth.set_function(lambda: persistence_stats['pending_changes'], "settings_changes")
+    queue_depth.set_function(lambda: len(broadcast_tasks), "broadcast_jobs")
+    queue_depth.set_function(lambda: outbound_queue.size if outbound_queue else 0, "outbound")
+
+async def metrics_endpoint(headers, body):
+    """GET /metrics"""
+    return 200, METRICS_CONTENT_TYPE, metrics_registry.render().encode()
+
+def create_metrics_server(application):
+    """HTTP server with the health check and the metrics"""
+    server = WebhookServer(application, path=None)
+    server.add_route('GET', '/metrics', metrics_endpoint)
+    return server
+
+async def on_startup(application):
+    """Start background services once the application is initialized"""
+    global metrics_server
+    register_queue_gauges(application)
+    start_outbound(application)
+    start_price_feed()
+    await start_settings_writer(application)
+    await resume_broadcast_jobs(application)
+    if METRICS_PORT:
+        metrics_server = create_metrics_server(application)
+        await metrics_server.start(METRICS_HOST, int(METRICS_PORT))
+
+async def on_stop(application):
+    """Stop background services that still need the bot"""
+    global metrics_server
+    await stop_broadcast_jobs(application)
+    await stop_price_feed()
+    await stop_outbound()
+    if metrics_server is not None:
+        await metrics_server.stop()
+        metrics_server = None
+
+async def on_shutdown(application):
+    """Flush state after the application has shut down"""
+    await stop_settings_writer(application)
+    close_alert_book()
+
+# Update types each handler class can receive. TypeHandler is left out on
+# purpose, it is only used to count updates nobody handled.
+HANDLER_UPDATE_TYPES = (
+    (CommandHandler, (Update.MESSAGE,)),
+    (MessageHandler, (Update.MESSAGE,)),
+    (CallbackQueryHandler, (Update.CALLBACK_QUERY,))
+)
+
+# Update type -> number of received updates no handler accepted
+unhandled_updates = {}
+
+def handler_update_types(handler):
+    """Update types a handler needs Telegram to send"""
+    if isinstance(handler, ConversationHandler):
+        types = set()
+        nested = handler.entry_points + [h for state in handler.states.values() for h in state] + handler.fallbacks
+        for nested_handler in nested:
+            types |= handler_update_types(nested_handler)
+        return types
+    if isinstance(handler, TypeHandler):
+        return set()
+    for handler_class, types in HANDLER_UPDATE_TYPES:
+        if isinstance(handler, handler_class):
+            return set(types)
+    # Unknown handler, subscribe to everything rather than miss updates
+    return set(Update.ALL_TYPES)
+
+def handler_commands(handler):
+    """Command names a handler (or a conversation's handlers) answers"""
+    if isinstance(handler, ConversationHandler):
+        nested = handler.entry_points + [h for state in handler.states.values() for h in state] + handler.fallbacks
+        return set().union(*(handler_commands(nested_handler) for nested_handler in nested))
+    if isinstance(handler, CommandHandler):
+        return set(handler.commands)
+    return set()
+
+def derive_allowed_updates(application):
+    """Smallest allowed_updates list covering every registered handler"""
+    types = set()
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            types |= handler_update_types(handler)
+    return sorted(types) if types else list(Update.ALL_TYPES)
+
+def update_type(update):
+    """Name of the field that is set on an update, e.g. message"""
+    for name in Update.ALL_TYPES:
+        if getattr(update, name, None) is not None:
+            return name
+    return "unknown"
+
+async def count_unhandled_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Last handler of group 0, only reached when no other handler matched"""
+    if isinstance(update, Update):
+        kind = update_type(update)
+        unhandled_updates[kind] = unhandled_updates.get(kind, 0) + 1
+
+async def serve_webhook(application, allowed_updates):
+    """Run the bot behind the embedded webhook server until SIGINT/SIGTERM"""
+    secret_token = WEBHOOK_SECRET
+    if not secret_token:
+        if not WEBHOOK_URL:
+            # A hand-registered webhook must share its secret with the bot
+            raise RuntimeError("BOT_MODE=webhook needs WEBHOOK_SECRET when WEBHOOK_URL is not set")
+        # A public endpoint must never accept unsigned updates
+        secret_token = secrets.token_urlsafe(32)
+
+    server = WebhookServer(application, WEBHOOK_PATH, secret_token)
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass
+
+    # Same order as Application.run_polling(), which calls the hooks itself
+    await application.initialize()
+    await on_startup(application)
+    await application.start()
+    try:
+        await server.start(WEBHOOK_HOST, PORT)
+        if WEBHOOK_URL:
+            await application.bot.set_webhook(
+                WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+                secret_token=secret_token,
+                allowed_updates=allowed_updates
+            )
+            logger.info(f"Webhook registered at {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}")
+        else:
+            logger.warning("WEBHOOK_URL is not set, the webhook is not registered with Telegram")
+        await stop_event.wait()
+    finally:
+        await server.stop()
+        await application.stop()
+        await on_stop(application)
+        await application.shutdown()
+        await on_shutdown(application)
+
 def main():
     """Main function to run the bot"""
     try:
         load_settings()
-        application = Application.builder().token(BOT_TOKEN).build()
+        init_user_store()
+        init_broadcast_jobs()
+        init_alert_book()
+        application = (
+            Application.builder()
+            .token(TOKEN)
+            .request(InstrumentedRequest(connection_pool_size=256))
+            .get_updates_request(InstrumentedRequest())
+            .post_init(on_startup)
+            .post_stop(on_stop)
+            .post_shutdown(on_shutdown)
+            .build()
+        )
 
         # Conversation handlers
         add_user_handler = ConversationHandler(
-            entry_points=[CallbackQueryHandler(add_user_start, pattern="^add_user$")],
+            entry_points=[CallbackQueryHandler(instrumented(add_user_start), pattern="^add_user$")],
             states={
-                ADD_USER: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_user_process)]
+                ADD_USER: [MessageHandler(filters.TEXT & ~filters.COMMAND, instrumented(add_user_process))]
             },
-            fallbacks=[CommandHandler("cancel", cancel_conversation)]
+            fallbacks=[CommandHandler("cancel", instrumented(cancel_conversation))]
         )
 
         block_user_handler = ConversationHandler(
-            entry_points=[CallbackQueryHandler(block_user_start, pattern="^block_user$")],
+            entry_points=[CallbackQueryHandler(instrumented(block_user_start), pattern="^block_user$")],
             states={
-                BLOCK_USER: [MessageHandler(filters.TEXT & ~filters.COMMAND, block_user_process)]
+                BLOCK_USER: [MessageHandler(filters.TEXT & ~filters.COMMAND, instrumented(block_user_process))]
             },
-            fallbacks=[CommandHandler("cancel", cancel_conversation)]
+            fallbacks=[CommandHandler("cancel", instrumented(cancel_conversation))]
         )
 
         set_channel_handler = ConversationHandler(
-            entry_points=[CallbackQueryHandler(set_channel_start, pattern="^add_channel$")],
+            entry_points=[CallbackQueryHandler(instrumented(set_channel_start), pattern="^add_channel$")],
             states={
-                SET_CHANNEL: [MessageHandler(filters.TEXT & ~filters.COMMAND, set_channel_process)]
+                SET_CHANNEL: [MessageHandler(filters.TEXT & ~filters.COMMAND, instrumented(set_channel_process))]
             },
-            fallbacks=[CommandHandler("cancel", cancel_conversation)]
+            fallbacks=[CommandHandler("cancel", instrumented(cancel_conversation))]
         )
 
         broadcast_handler = ConversationHandler(
-            entry_points=[CallbackQueryHandler(send_broadcast_start, pattern="^send_broadcast$")],
+            entry_points=[CallbackQueryHandler(instrumented(send_broadcast_start), pattern="^send_broadcast$")],
             states={
-                SEND_BROADCAST: [MessageHandler(filters.TEXT & ~filters.COMMAND, send_broadcast_process)]
+                SEND_BROADCAST: [MessageHandler(filters.TEXT & ~filters.COMMAND, instrumented(send_broadcast_process))]
             },
-            fallbacks=[CommandHandler("cancel", cancel_conversation)]
+            fallbacks=[CommandHandler("cancel", instrumented(cancel_conversation))]
         )
 
         grant_permissions_handler = ConversationHandler(
-            entry_points=[CallbackQueryHandler(grant_permissions_start, pattern="^grant_permissions$")],
+            entry_points=[CallbackQueryHandler(instrumented(grant_permissions_start), pattern="^grant_permissions$")],
             states={
-                GRANT_PERMISSIONS: [MessageHandler(filters.TEXT & ~filters.COMMAND, grant_permissions_process)]
+                GRANT_PERMISSIONS: [MessageHandler(filters.TEXT & ~filters.COMMAND, instrumented(grant_permissions_process))]
             },
-            fallbacks=[CommandHandler("cancel", cancel_conversation)]
+            fallbacks=[CommandHandler("cancel", instrumented(cancel_conversation))]
         )
 
         edit_text_handler = ConversationHandler(
-            entry_points=[CallbackQueryHandler(edit_text_start, pattern="^edit_text_")],
+            entry_points=[CallbackQueryHandler(instrumented(edit_text_start), pattern="^edit_text_")],
             states={
-                EDIT_TEXT: [MessageHandler(filters.TEXT & ~filters.COMMAND, edit_text_process)]
+                EDIT_TEXT: [MessageHandler(filters.TEXT & ~filters.COMMAND, instrumented(edit_text_process))]
             },
-            fallbacks=[CommandHandler("cancel", cancel_conversation)]
+            fallbacks=[CommandHandler("cancel", instrumented(cancel_conversation))]
         )
 
+        # Access control, then flood protection, run before every other handler
+        application.add_handler(TypeHandler(Update, access_guard), group=-2)
+        application.add_handler(TypeHandler(Update, rate_limit_update), group=-1)
+
         # Add handlers
-        application.add_handler(CommandHandler("start", start))
-        application.add_handler(CommandHandler("help", help_command))
-        application.add_handler(CommandHandler("signal", signal_command))
-        application.add_handler(CommandHandler("scalp", scalp_command))
-        application.add_handler(CommandHandler("swing", swing_command))
-        application.add_handler(CommandHandler("admin", admin_panel))
+        application.add_handler(CommandHandler("start", instrumented(start)))
+        application.add_handler(CommandHandler("help", instrumented(help_command)))
+        application.add_handler(CommandHandler("signal", instrumented(signal_command)))
+        application.add_handler(CommandHandler("scalp", instrumented(scalp_command)))
+        application.add_handler(CommandHandler("swing", instrumented(swing_command)))
+        application.add_handler(CommandHandler("method", instrumented(method_command)))
+        application.add_handler(CommandHandler("compare", instrumented(compare_command)))
+        application.add_handler(CommandHandler("pivot", instrumented(pivot_command)))
+        application.add_handler(CommandHandler("bars", instrumented(bars_command)))
+        application.add_handler(CommandHandler("backtest", instrumented(backtest_command)))
+        application.add_handler(CommandHandler("watch", instrumented(watch_command)))
+        application.add_handler(CommandHandler("unwatch", instrumented(unwatch_command)))
+        application.add_handler(CommandHandler("alert", instrumented(alert_command)))
+        application.add_handler(CommandHandler("alerts", instrumented(alerts_command)))
+        application.add_handler(CommandHandler("delalert", instrumented(delalert_command)))
+        application.add_handler(CommandHandler("admin", instrumented(admin_panel)))
         application.add_handler(add_user_handler)
         application.add_handler(block_user_handler)
         application.add_handler(set_channel_handler)
         application.add_handler(broadcast_handler)
         application.add_handler(grant_permissions_handler)
         application.add_handler(edit_text_handler)
+        register_callback_routes()
         application.add_handler(CallbackQueryHandler(handle_callbacks))
-        application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, calculate))
+        application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, instrumented(calculate)))
+        application.add_handler(MessageHandler(
+            filters.Document.FileExtension("csv") & filters.CaptionRegex(r'^/bars(@\w+)?\b'), instrumented(bars_document)
+        ))
+        application.add_handler(MessageHandler(filters.Document.FileExtension("csv"), instrumented(calculate_document)))
+        application.add_handler(TypeHandler(Update, count_unhandled_update))
+
+        registered_commands.update(
+            command for handlers in application.handlers.values() for handler in handlers
+            for command in handler_commands(handler)
+        )
+        allowed_updates = derive_allowed_updates(application)
+        logger.info(f"Subscribed update types: {', '.join(allowed_updates)}")
 
         # Run the bot
         print("🤖 بوت النقاط المحورية يعمل الآن...")
@@ -1993,8 +3768,12 @@ def main():
         print("   - نظام صلاحيات المشرفين")
         print("   - إرسال رسائل جماعية")
 
-        # Run with polling
-        application.run_polling(allowed_updates=Update.ALL_TYPES)
+        if BOT_MODE == "webhook":
+            print(f"🌐 وضع الويب هوك على المنفذ {PORT}")
+            asyncio.run(serve_webhook(application, allowed_updates))
+        else:
+            # Run with polling
+            application.run_polling(allowed_updates=allowed_updates)
 
     except Exception as e:
         print(f"❌ خطأ في تشغيل البوت: {e}")
@@ -0,0 +1,140 @@
+"""Message layouts compiled once into format strings with named slots
+
+Admin-edited headers and footers are baked into the compiled strings, so
+rendering a reply is a single str.format_map() call. Build a new
+MessageTemplates whenever the custom texts change.
+"""
+
+SEPARATOR = "━━━━━━━━━━━━━━━━━━━━━━"
+
+
+def escape(text):
+    """Make a literal text safe to embed in a format string"""
+    return text.replace('{', '{{').replace('}', '}}')
+
+
+def compile_results(title, levels):
+    """Layout of format_results for a formula defining `levels`"""
+    message = "📊 تحليل النقاط المحورية\n"
+    message += f"{SEPARATOR}\n\n"
+
+    message += "🎯 الأهداف (مستويات المقاومة):\n"
+    if 'r3' in levels:
+        message += "الهدف الثالث: {r3:.2f}\n"
+    if 'r2' in levels:
+        message += "الهدف الثاني: {r2:.2f}\n"
+    message += "الهدف الأول: {r1:.2f}\n\n"
+
+    message += "🚪 منطقة دخول:\n"
+    message += "PP: {pivot:.2f}\n\n"
+
+    message += "🛡️ مستويات الدعم:\n"
+    message += "S1: {s1:.2f}\n"
+    if 's2' in levels:
+        message += "S2: {s2:.2f}\n"
+    if 's3' in levels:
+        message += "S3: {s3:.2f}\n"
+    message += "\n"
+
+    message += f"{SEPARATOR}\n"
+    message += f"📈 تم الحساب باستخدام الصيغة {escape(title)}"
+    return message
+
+
+def compile_channel_recommendation(header, is_buy):
+    """Layout of format_channel_recommendation for one direction"""
+    if is_buy:
+        recommendation = "📈 شراء (BUY)"
+        entry_zone = "{pivot:.2f} - {s1:.2f}"
+        targets = "🎯 الأهداف:\nTP1: {r1:.2f}\nTP2: {r2:.2f}\nTP3: {r3:.2f}"
+        stop_loss = "🛑 وقف الخسارة: {s2:.2f}"
+        scalp_target = "⚡ سكالبينغ: {r1:.2f}"
+        swing_target = "📊 سوينغ: {r2:.2f} - {r3:.2f}"
+    else:
+        recommendation = "📉 بيع (SELL)"
+        entry_zone = "{pivot:.2f} - {r1:.2f}"
+        targets = "🎯 الأهداف:\nTP1: {s1:.2f}\nTP2: {s2:.2f}\nTP3: {s3:.2f}"
+        stop_loss = "🛑 وقف الخسارة: {r2:.2f}"
+        scalp_target = "⚡ سكالبينغ: {s1:.2f}"
+        swing_target = "📊 سوينغ: {s2:.2f} - {s3:.2f}"
+
+    message = f"{escape(header)}\n"
+    message += f"{SEPARATOR}\n\n"
+    message += f"{recommendation}\n\n"
+    message += f"🔴 منطقة الدخول: {entry_zone}\n\n"
+    message += f"{targets}\n\n"
+    message += f"{stop_loss}\n\n"
+    message += f"{SEPARATOR}\n"
+    message += f"{scalp_target}\n"
+    message += f"{swing_target}\n\n"
+    message += "⚠️ تداول بحذر وأدر المخاطر بحكمة"
+    return message
+
+
+def compile_custom_recommendation(header, footer, is_buy, target_count=3):
+    """Layout of format_custom_recommendation; the entry and stop are the
+    `entry` and `stop` slots, and only the first `target_count` targets
+    are listed"""
+    if is_buy:
+        recommendation = "📈 شراء (BUY)"
+        entry_zone = "{entry:.2f} - {s1:.2f}"
+        levels = ('r1', 'r2', 'r3')
+    else:
+        recommendation = "📉 بيع (SELL)"
+        entry_zone = "{entry:.2f} - {r1:.2f}"
+        levels = ('s1', 's2', 's3')
+    targets = "🎯 الأهداف:" + "".join(
+        f"\nTP{number}: {{{level}:.2f}}" for number, level in enumerate(levels[:target_count], 1)
+    )
+
+    message = f"{escape(header)}\n"
+    message += f"{SEPARATOR}\n\n"
+    message += f"{recommendation}\n\n"
+    message += f"🔴 منطقة الدخول: {entry_zone}\n\n"
+    message += f"{targets}\n\n"
+    message += "🛑 وقف الخسارة : {stop:.2f}\n\n"
+    message += f"{SEPARATOR}\n"
+    message += "🫰🏻رجاءًا اقل لوت حبيبي\n\n"
+    message += escape(footer)
+    return message
+
+
+class MessageTemplates:
+    """Compiled layouts of the pivot, channel and custom recommendation messages"""
+
+    __slots__ = ('channel', 'custom', 'results')
+
+    def __init__(self, custom_texts):
+        self.channel = {
+            is_buy: compile_channel_recommendation(custom_texts['channel_recommendation_header'], is_buy)
+            for is_buy in (True, False)
+        }
+        self.custom = {
+            (is_buy, trade_type, target_count): compile_custom_recommendation(
+                custom_texts['custom_recommendation_header'],
+                custom_texts['scalp_footer'] if trade_type == "scalp" else custom_texts['swing_footer'],
+                is_buy,
+                target_count
+            )
+            for is_buy in (True, False)
+            for trade_type in ("scalp", "swing")
+            for target_count in (1, 2, 3)
+        }
+        # Filled lazily, one layout per formula title and set of levels
+        self.results = {}
+
+    def render_results(self, results, title):
+        # PP, R1 and S1 are always defined, the outer levels may be missing
+        key = (title, results['r2'] is None, results['r3'] is None, results['s2'] is None, results['s3'] is None)
+        template = self.results.get(key)
+        if template is None:
+            levels = [name for name, value in results.items() if value is not None]
+            template = self.results[key] = compile_results(title, levels)
+        return template.format_map(results)
+
+    def render_channel_recommendation(self, results, is_buy):
+        return self.channel[is_buy].format_map(results)
+
+    def render_custom_recommendation(self, results, is_buy, trade_type, stop, entry=None, target_count=3):
+        entry = results['pivot'] if entry is None else entry
+        return self.custom[(is_buy, trade_type, target_count)].format_map(dict(results, stop=stop, entry=entry))
@@ -0,0 +1,350 @@
+"""Append-only columnar store of OHLC bars per symbol
+
+Each symbol is a directory with one file per column (`time` as int64 epoch
+seconds, `open`, `high`, `low`, `close` as float64). Bars are only ever
+appended in time order, and columns are read through mmap, so reading
+history costs no parsing and no copies. Resampled daily, weekly and monthly
+bars are cached per symbol and extended with the bars appended since the
+last query instead of rescanning the history.
+
+Times are UTC. Weeks start on Monday. The store may be used from worker
+threads (backtests, sweeps, uploads) while the event loop reads it.
+"""
+import array
+import csv
+import datetime
+import logging
+import mmap
+import os
+import re
+import sys
+import threading
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# column -> array typecode
+COLUMNS = (('time', 'q'), ('open', 'd'), ('high', 'd'), ('low', 'd'), ('close', 'd'))
+ITEM_SIZE = 8
+
+PERIODS = ('daily', 'weekly', 'monthly')
+DAY = 86400
+# 1970-01-01 was a Thursday; shifting by 3 days makes weeks start on Monday
+WEEK_SHIFT = 3
+EPOCH = datetime.date(1970, 1, 1)
+
+SYMBOL_PATTERN = re.compile(r'^[A-Z0-9][A-Z0-9._-]{0,19}$')
+MAX_CSV_BARS = 500000
+
+
+class OHLCError(ValueError):
+    """Raised for invalid symbols, periods or bars"""
+
+
+def normalize_symbol(symbol):
+    """Upper-case symbol, checked so it is safe as a directory name"""
+    symbol = symbol.strip().upper()
+    if not SYMBOL_PATTERN.match(symbol):
+        raise OHLCError(f"رمز غير صالح: {symbol}")
+    return symbol
+
+
+def period_key(timestamp, period):
+    """Number of the period a bar time falls in; consecutive periods have
+    consecutive keys"""
+    days = timestamp // DAY
+    if period == 'daily':
+        return days
+    if period == 'weekly':
+        return (days + WEEK_SHIFT) // 7
+    if period == 'monthly':
+        date = EPOCH + datetime.timedelta(days=days)
+        return date.year * 12 + date.month - 1
+    raise OHLCError(f"فترة غير معروفة: {period}")
+
+
+def period_keys(times, period):
+    """period_key() for a NumPy array of times"""
+    days = times // DAY
+    if period == 'daily':
+        return days
+    if period == 'weekly':
+        return (days + WEEK_SHIFT) // 7
+    months = days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+    # datetime64 months count from 1970-01
+    return months + 1970 * 12
+
+
+def parse_time(value):
+    """Epoch seconds from an epoch number or an ISO date/datetime (UTC)"""
+    value = value.strip()
+    try:
+        return int(float(value))
+    except ValueError:
+        pass
+    parsed = datetime.datetime.fromisoformat(value.replace('/', '-'))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return int(parsed.timestamp())
+
+
+def format_time(timestamp, period='daily'):
+    """Display form of a bar or period start time"""
+    moment = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+    if period == 'monthly':
+        return moment.strftime('%Y-%m')
+    if period in ('daily', 'weekly') and timestamp % DAY == 0:
+        return moment.strftime('%Y-%m-%d')
+    return moment.strftime('%Y-%m-%d %H:%M')
+
+
+def parse_bars(lines, max_bars=MAX_CSV_BARS):
+    """Parse rows of `time,open,high,low,close`
+
+    Returns (bars, errors) where bars are (time, open, high, low, close)
+    tuples sorted by time and errors are (line_number, text) pairs for rows
+    that were skipped.
+    """
+    bars = []
+    errors = []
+    for line_number, fields in enumerate(csv.reader(lines), 1):
+        fields = [field for field in fields if field.strip()]
+        if not fields:
+            continue
+        if len(fields) != 5:
+            errors.append((line_number, "عدد القيم غير صحيح"))
+            continue
+        try:
+            timestamp = parse_time(fields[0])
+            open_price, high, low, close = (float(field.strip()) for field in fields[1:])
+        except ValueError:
+            # First line of an uploaded CSV is usually a header
+            if line_number == 1:
+                continue
+            errors.append((line_number, "قيم غير صالحة"))
+            continue
+        if high < low or not low <= open_price <= high or not low <= close <= high:
+            errors.append((line_number, "الافتتاح والإغلاق يجب أن يكونا بين الأدنى والأعلى"))
+            continue
+        bars.append((timestamp, open_price, high, low, close))
+        if len(bars) > max_bars:
+            raise OHLCError(f"الحد الأقصى {max_bars} شمعة")
+    bars.sort(key=lambda bar: bar[0])
+    return bars, errors
+
+
+class Resampled:
+    """Bars aggregated to one period; the last one may still be growing"""
+
+    __slots__ = ('keys', 'times', 'open', 'high', 'low', 'close', 'rows')
+
+    def __init__(self):
+        self.keys = []
+        self.times = []
+        self.open = []
+        self.high = []
+        self.low = []
+        self.close = []
+        # Source bars already folded in
+        self.rows = 0
+
+    def __len__(self):
+        return len(self.keys)
+
+    def bar(self, index):
+        """(start time, open, high, low, close) of one period"""
+        return self.times[index], self.open[index], self.high[index], self.low[index], self.close[index]
+
+    def _extend(self, key, start, open_price, high, low, close):
+        if self.keys and self.keys[-1] == key:
+            # Continues the period the previous query ended in
+            self.high[-1] = max(self.high[-1], high)
+            self.low[-1] = min(self.low[-1], low)
+            self.close[-1] = close
+            return
+        self.keys.append(key)
+        self.times.append(start)
+        self.open.append(open_price)
+        self.high.append(high)
+        self.low.append(low)
+        self.close.append(close)
+
+    def fold(self, times, opens, highs, lows, closes, period):
+        """Fold the given new source bars in"""
+        count = len(times)
+        if not count:
+            return
+        if np is not None:
+            times = np.asarray(times)
+            keys = period_keys(times, period)
+            starts = np.concatenate(([0], np.flatnonzero(np.diff(keys)) + 1))
+            ends = np.append(starts[1:], count) - 1
+            period_highs = np.maximum.reduceat(np.asarray(highs), starts)
+            period_lows = np.minimum.reduceat(np.asarray(lows), starts)
+            for key, start, end, high, low in zip(keys[starts].tolist(), starts.tolist(), ends.tolist(),
+                                                  period_highs.tolist(), period_lows.tolist()):
+                self._extend(key, int(times[start]), float(opens[start]), high, low, float(closes[end]))
+        else:
+            for index in range(count):
+                timestamp = times[index]
+                self._extend(period_key(timestamp, period), timestamp, opens[index],
+                             highs[index], lows[index], closes[index])
+        self.rows += count
+
+
+class SymbolSeries:
+    """The column files of one symbol"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.paths = {name: os.path.join(directory, name) for name, _ in COLUMNS}
+        for path in self.paths.values():
+            if not os.path.exists(path):
+                open(path, 'wb').close()
+
+        # A crash between column writes leaves some columns longer; cut
+        # them back to the last complete bar
+        sizes = [os.path.getsize(path) // ITEM_SIZE for path in self.paths.values()]
+        self.count = min(sizes)
+        for path, size in zip(self.paths.values(), sizes):
+            if size != self.count:
+                logger.warning(f"Truncating torn column {path} from {size} to {self.count} bars")
+                with open(path, 'r+b') as f:
+                    f.truncate(self.count * ITEM_SIZE)
+
+        self.maps = {}
+        self.mapped = 0
+        self.resampled = {}
+        # Guards the files, maps and resampled caches; reentrant because
+        # append() and resample() go through column()
+        self.lock = threading.RLock()
+
+    def _remap(self):
+        if self.mapped == self.count:
+            return
+        # Old maps stay alive as long as views into them do
+        maps = {}
+        for name, _ in COLUMNS:
+            with open(self.paths[name], 'rb') as f:
+                maps[name] = mmap.mmap(f.fileno(), self.count * ITEM_SIZE, access=mmap.ACCESS_READ)
+        self.maps = maps
+        self.mapped = self.count
+
+    def column(self, name, start=0, stop=None):
+        """Zero-copy view of a column: a NumPy array, or a memoryview of
+        ints/floats without NumPy"""
+        typecode = dict(COLUMNS)[name]
+        with self.lock:
+            stop = self.count if stop is None else min(stop, self.count)
+            if start >= stop:
+                return np.empty(0, dtype=typecode) if np is not None else array.array(typecode)
+            self._remap()
+            buffer = memoryview(self.maps[name])[start * ITEM_SIZE:stop * ITEM_SIZE]
+        if np is not None:
+            return np.frombuffer(buffer, dtype=np.int64 if typecode == 'q' else np.float64)
+        return buffer.cast(typecode)
+
+    def columns(self, start=0, stop=None):
+        """column() of every column, all cut at the same bar even while
+        another thread appends"""
+        with self.lock:
+            stop = self.count if stop is None else min(stop, self.count)
+            return [self.column(name, start, stop) for name, _ in COLUMNS]
+
+    def last_time(self):
+        with self.lock:
+            return self.column('time', self.count - 1)[0] if self.count else None
+
+    def append(self, bars):
+        """Append (time, open, high, low, close) bars newer than the last
+        stored one; returns how many were added"""
+        with self.lock:
+            last = self.last_time()
+            if last is not None:
+                bars = [bar for bar in bars if bar[0] > last]
+            if not bars:
+                return 0
+            columns = list(zip(*bars))
+            for (name, typecode), values in zip(COLUMNS, columns):
+                data = array.array(typecode, values)
+                if sys.byteorder != 'little':
+                    data.byteswap()
+                with open(self.paths[name], 'ab') as f:
+                    f.write(data.tobytes())
+            self.count += len(bars)
+            return len(bars)
+
+    def resample(self, period):
+        """Bars of `period`, extended with the bars appended since the last call"""
+        if period not in PERIODS:
+            raise OHLCError(f"فترة غير معروفة: {period}")
+        with self.lock:
+            resampled = self.resampled.get(period)
+            if resampled is None:
+                resampled = self.resampled[period] = Resampled()
+            start = resampled.rows
+            if start < self.count:
+                resampled.fold(*(self.column(name, start) for name, _ in COLUMNS), period)
+            return resampled
+
+
+class OHLCStore:
+    """Bars of every symbol under one directory"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def symbols(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name for name in os.listdir(self.directory) if SYMBOL_PATTERN.match(name))
+
+    def get(self, symbol, create=False):
+        """Series of a symbol, or None when it has no data and create is False"""
+        symbol = normalize_symbol(symbol)
+        with self.lock:
+            series = self.series.get(symbol)
+            if series is None:
+                directory = os.path.join(self.directory, symbol)
+                if not create and not os.path.isdir(directory):
+                    return None
+                series = self.series[symbol] = SymbolSeries(directory)
+            return series
+
+    def append(self, symbol, bars):
+        return self.get(symbol, create=True).append(bars)
+
+    def latest_period(self, symbol, period, now):
+        """(start time, open, high, low, close) of the last complete period,
+        or None when there is not enough data
+
+        The period containing `now` is still open, so the pivot for it comes
+        from the one before."""
+        series = self.get(symbol)
+        if series is None or not series.count:
+            return None
+        with series.lock:
+            resampled = series.resample(period)
+            index = len(resampled) - 1
+            if resampled.keys[index] >= period_key(int(now), period):
+                index -= 1
+            return resampled.bar(index) if index >= 0 else None
+
+    def current_period(self, symbol, period, now):
+        """(start time, open, high, low, close) of the bars stored so far for
+        the period containing `now`, or None when there are none"""
+        series = self.get(symbol)
+        if series is None or not series.count:
+            return None
+        with series.lock:
+            resampled = series.resample(period)
+            if resampled.keys[-1] != period_key(int(now), period):
+                return None
+            return resampled.bar(len(resampled) - 1)
@@ -0,0 +1,186 @@
+"""Background queue for outgoing messages
+
+Handlers put messages on the queue and return right away; worker tasks send
+them. Messages to the same chat are sent one at a time in the order they
+were queued, while different chats are served in parallel. Transient errors
+are retried with exponential backoff, and the queue holds at most
+`max_size` messages: put() waits for room, put_nowait() raises
+asyncio.QueueFull.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+
+from telegram.error import RetryAfter
+
+from broadcast import RETRY, SENT, FAILED, classify_error, retry_after_seconds
+
+logger = logging.getLogger(__name__)
+
+WORKERS = 4
+MAX_SIZE = 1000
+MAX_ATTEMPTS = 4
+
+
+class OutboundMessage:
+    """A queued message and its completion callback"""
+
+    __slots__ = ('chat_id', 'text', 'options', 'callback', 'queued')
+
+    def __init__(self, chat_id, text, options, callback, queued):
+        self.chat_id = chat_id
+        self.text = text
+        self.options = options
+        self.callback = callback
+        self.queued = queued
+
+
+class OutboundQueue:
+    """Per-chat ordered message queue drained by a pool of workers"""
+
+    def __init__(self, send, workers=WORKERS, max_size=MAX_SIZE, max_attempts=MAX_ATTEMPTS,
+                 bucket=None, on_outcome=None, clock=time.monotonic):
+        # send(chat_id, text, **options) is a coroutine. A shared TokenBucket
+        # keeps the queue within the bot-wide rate limit.
+        self.send = send
+        self.workers = workers
+        self.max_size = max_size
+        self.max_attempts = max_attempts
+        self.bucket = bucket
+        self.on_outcome = on_outcome
+        self.clock = clock
+        self.size = 0
+        # chat_id -> deque of messages; a chat is either waiting in `ready`,
+        # delayed by its interval, or being served by exactly one worker
+        self.pending = {}
+        self.ready = asyncio.Queue()
+        self.intervals = {}
+        self.last_sent = {}
+        self.waiters = deque()
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.tasks = []
+
+    def start(self):
+        if not self.tasks:
+            self.tasks = [asyncio.create_task(self.worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout=5.0):
+        """Give queued messages `timeout` seconds, then fail the rest"""
+        if self.size:
+            try:
+                await asyncio.wait_for(self.idle.wait(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Outbound queue stopped with {self.size} unsent messages")
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        for messages in self.pending.values():
+            for message in messages:
+                self._finish(message, FAILED)
+        self.pending.clear()
+
+    def set_interval(self, chat_id, seconds):
+        """Keep at least `seconds` between two messages to `chat_id`"""
+        if seconds > 0:
+            self.intervals[chat_id] = seconds
+        else:
+            self.intervals.pop(chat_id, None)
+
+    def put_nowait(self, chat_id, text, callback=None, **options):
+        """Queue a message; callback(outcome) is called once it is sent or failed"""
+        if self.size >= self.max_size:
+            raise asyncio.QueueFull
+        self._enqueue(OutboundMessage(chat_id, text, options, callback, self.clock()))
+
+    async def put(self, chat_id, text, callback=None, **options):
+        """Queue a message, waiting while the queue is full"""
+        while self.size >= self.max_size:
+            waiter = asyncio.get_running_loop().create_future()
+            self.waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                if waiter in self.waiters:
+                    self.waiters.remove(waiter)
+        self._enqueue(OutboundMessage(chat_id, text, options, callback, self.clock()))
+
+    def _enqueue(self, message):
+        self.size += 1
+        self.idle.clear()
+        messages = self.pending.get(message.chat_id)
+        if messages is None:
+            self.pending[message.chat_id] = deque([message])
+            self._schedule(message.chat_id)
+        else:
+            messages.append(message)
+
+    def _schedule(self, chat_id):
+        """Hand the chat to a worker once its interval has passed"""
+        interval = self.intervals.get(chat_id)
+        wait = self.last_sent.get(chat_id, float('-inf')) + interval - self.clock() if interval else 0
+        if wait > 0:
+            asyncio.get_running_loop().call_later(wait, self.ready.put_nowait, chat_id)
+        else:
+            self.ready.put_nowait(chat_id)
+
+    def _finish(self, message, outcome):
+        self.size -= 1
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                break
+        if self.size == 0:
+            self.idle.set()
+
+        try:
+            if self.on_outcome is not None:
+                self.on_outcome(message.chat_id, outcome, self.clock() - message.queued)
+            if message.callback is not None:
+                message.callback(outcome)
+        except Exception as e:
+            logger.warning(f"Outbound callback failed for {message.chat_id}: {e}")
+
+    async def deliver(self, message):
+        """Send one message, retrying transient errors; returns SENT or FAILED"""
+        for attempt in range(1, self.max_attempts + 1):
+            if self.bucket is not None:
+                await self.bucket.acquire()
+            try:
+                await self.send(message.chat_id, message.text, **message.options)
+                return SENT
+            except Exception as e:
+                if classify_error(e) != RETRY or attempt == self.max_attempts:
+                    logger.error(f"Failed to send message to {message.chat_id}: {e}")
+                    return FAILED
+                if isinstance(e, RetryAfter):
+                    wait = retry_after_seconds(e)
+                    if self.bucket is not None:
+                        # Flood control applies to the whole bot
+                        self.bucket.pause(wait)
+                else:
+                    wait = 2 ** (attempt - 1)
+                await asyncio.sleep(wait)
+        return FAILED
+
+    async def worker(self):
+        while True:
+            chat_id = await self.ready.get()
+            messages = self.pending[chat_id]
+            message = messages.popleft()
+            outcome = FAILED
+            try:
+                outcome = await self.deliver(message)
+            except Exception as e:
+                logger.error(f"Outbound worker error for {chat_id}: {e}")
+            finally:
+                if chat_id in self.intervals:
+                    self.last_sent[chat_id] = self.clock()
+                if messages:
+                    self._schedule(chat_id)
+                else:
+                    del self.pending[chat_id]
+                self._finish(message, outcome)
@@ -0,0 +1,277 @@
+"""Pivot point formulas for single inputs and batches of rows
+
+Every formula is written once against plain arithmetic, so the same code
+runs on floats and, for batches, on NumPy arrays when NumPy is installed.
+"""
+import csv
+import html
+import io
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+LEVELS = ('pivot', 'r1', 'r2', 'r3', 's1', 's2', 's3')
+LEVEL_TITLES = ('PP', 'R1', 'R2', 'R3', 'S1', 'S2', 'S3')
+
+MAX_TEXT_ROWS = 200
+MAX_CSV_ROWS = 100000
+
+
+class BatchError(ValueError):
+    """Raised when a batch cannot be parsed"""
+
+
+def _to_float(value):
+    return float(value.strip().replace(' ', ''))
+
+
+def parse_rows(lines, max_rows=MAX_TEXT_ROWS):
+    """Parse rows of `high,low,close` or `label,high,low,close`
+
+    Returns (rows, errors) where rows are (label, high, low, close) tuples
+    and errors are (line_number, text) pairs for rows that were skipped.
+    """
+    rows = []
+    errors = []
+    reader = csv.reader(lines, delimiter=',')
+
+    for line_number, fields in enumerate(reader, 1):
+        fields = [field for field in fields if field.strip()]
+        if not fields:
+            continue
+        if len(fields) == 1 and ';' in fields[0]:
+            fields = fields[0].split(';')
+
+        label = ""
+        if len(fields) == 4:
+            label = fields[0].strip()
+            fields = fields[1:]
+
+        if len(fields) != 3:
+            errors.append((line_number, "عدد القيم غير صحيح"))
+            continue
+
+        try:
+            high, low, close = (_to_float(field) for field in fields)
+        except ValueError:
+            # First line of an uploaded CSV is usually a header
+            if line_number == 1:
+                continue
+            errors.append((line_number, "قيم غير رقمية"))
+            continue
+
+        if high < low:
+            errors.append((line_number, "أعلى سعر أقل من أدنى سعر"))
+            continue
+
+        rows.append((label or str(len(rows) + 1), high, low, close))
+        if len(rows) > max_rows:
+            raise BatchError(f"الحد الأقصى {max_rows} صف")
+
+    return rows, errors
+
+
+def _demark_x(high, low, close, open_price):
+    """DeMark's X, which depends on the close relative to the open"""
+    if np is not None and isinstance(close, np.ndarray):
+        return np.where(
+            close < open_price, high + 2 * low + close,
+            np.where(close > open_price, 2 * high + low + close, high + low + 2 * close)
+        )
+    if close < open_price:
+        return high + 2 * low + close
+    if close > open_price:
+        return 2 * high + low + close
+    return high + low + 2 * close
+
+
+def classic_levels(high, low, close, open_price, pivot, price_range):
+    return {
+        'pivot': pivot,
+        'r1': 2 * pivot - low,
+        'r2': pivot + price_range,
+        'r3': high + 2 * (pivot - low),
+        's1': 2 * pivot - high,
+        's2': pivot - price_range,
+        's3': low - 2 * (high - pivot)
+    }
+
+
+def fibonacci_levels(high, low, close, open_price, pivot, price_range):
+    return {
+        'pivot': pivot,
+        'r1': pivot + 0.382 * price_range,
+        'r2': pivot + 0.618 * price_range,
+        'r3': pivot + price_range,
+        's1': pivot - 0.382 * price_range,
+        's2': pivot - 0.618 * price_range,
+        's3': pivot - price_range
+    }
+
+
+def camarilla_levels(high, low, close, open_price, pivot, price_range):
+    step = price_range * 1.1
+    return {
+        'pivot': pivot,
+        'r1': close + step / 12,
+        'r2': close + step / 6,
+        'r3': close + step / 4,
+        's1': close - step / 12,
+        's2': close - step / 6,
+        's3': close - step / 4
+    }
+
+
+def woodie_levels(high, low, close, open_price, pivot, price_range):
+    pivot = (high + low + 2 * close) / 4
+    return {
+        'pivot': pivot,
+        'r1': 2 * pivot - low,
+        'r2': pivot + price_range,
+        'r3': high + 2 * (pivot - low),
+        's1': 2 * pivot - high,
+        's2': pivot - price_range,
+        's3': low - 2 * (high - pivot)
+    }
+
+
+def demark_levels(high, low, close, open_price, pivot, price_range):
+    # DeMark only defines one resistance and one support
+    x = _demark_x(high, low, close, open_price)
+    return {
+        'pivot': x / 4,
+        'r1': x / 2 - low,
+        'r2': None,
+        'r3': None,
+        's1': x / 2 - high,
+        's2': None,
+        's3': None
+    }
+
+
+# name -> (Arabic title, formula); register_formula() adds more
+PIVOT_FORMULAS = {
+    'classic': ("الكلاسيكية", classic_levels),
+    'fibonacci': ("فيبوناتشي", fibonacci_levels),
+    'camarilla': ("كاماريلا", camarilla_levels),
+    'woodie': ("وودي", woodie_levels),
+    'demark': ("ديمارك", demark_levels)
+}
+
+DEFAULT_METHOD = 'classic'
+
+
+def register_formula(name, title, formula):
+    """Add a pivot formula: formula(high, low, close, open, pivot, range) -> levels"""
+    PIVOT_FORMULAS[name] = (title, formula)
+
+
+def method_title(method):
+    """Arabic display name of a formula"""
+    return PIVOT_FORMULAS.get(method, PIVOT_FORMULAS[DEFAULT_METHOD])[0]
+
+
+def _round_levels(levels):
+    return {name: (round(float(value), 2) if value is not None else None) for name, value in levels.items()}
+
+
+def compute_levels(high, low, close, method=DEFAULT_METHOD, open_price=None):
+    """Pivot levels of one formula, rounded to 2 digits"""
+    if open_price is None:
+        open_price = close
+    formula = PIVOT_FORMULAS.get(method, PIVOT_FORMULAS[DEFAULT_METHOD])[1]
+    pivot = (high + low + close) / 3
+    return _round_levels(formula(high, low, close, open_price, pivot, high - low))
+
+
+def compute_all(high, low, close, open_price=None):
+    """Levels of every formula, sharing the pivot and range between them"""
+    if open_price is None:
+        open_price = close
+    pivot = (high + low + close) / 3
+    price_range = high - low
+    return {
+        method: _round_levels(formula(high, low, close, open_price, pivot, price_range))
+        for method, (title, formula) in PIVOT_FORMULAS.items()
+    }
+
+
+def calculate_batch(highs, lows, closes, method=DEFAULT_METHOD, opens=None):
+    """Pivot levels for many rows in one pass, rounded to 2 digits"""
+    formula = PIVOT_FORMULAS.get(method, PIVOT_FORMULAS[DEFAULT_METHOD])[1]
+
+    if np is not None:
+        high = np.asarray(highs, dtype=np.float64)
+        low = np.asarray(lows, dtype=np.float64)
+        close = np.asarray(closes, dtype=np.float64)
+        open_price = np.asarray(opens, dtype=np.float64) if opens is not None else close
+
+        pivot = (high + low + close) / 3
+        levels = formula(high, low, close, open_price, pivot, high - low)
+        return {
+            name: (np.round(values, 2).tolist() if values is not None else [None] * len(high))
+            for name, values in levels.items()
+        }
+
+    if opens is None:
+        opens = closes
+    levels = {name: [] for name in LEVELS}
+    for high, low, close, open_price in zip(highs, lows, closes, opens):
+        row = _round_levels(formula(high, low, close, open_price, (high + low + close) / 3, high - low))
+        for name in LEVELS:
+            levels[name].append(row[name])
+    return levels
+
+
+def calculate_rows(rows, method=DEFAULT_METHOD):
+    """Calculate levels for parsed rows"""
+    if not rows:
+        return {name: [] for name in LEVELS}
+    _, highs, lows, closes = zip(*rows)
+    return calculate_batch(highs, lows, closes, method)
+
+
+def _format_level(value):
+    return f"{value:.2f}" if value is not None else "-"
+
+
+def format_methods_table(all_levels):
+    """Monospace table (HTML <pre>) comparing the levels of every formula"""
+    names = list(all_levels)
+    label_width = max(len(name) for name in names)
+    columns = [[_format_level(all_levels[name][level]) for name in names] for level in LEVELS]
+    widths = [max([len(title)] + [len(value) for value in column]) for title, column in zip(LEVEL_TITLES, columns)]
+
+    lines = [" ".join([" " * label_width] + [title.rjust(width) for title, width in zip(LEVEL_TITLES, widths)])]
+    for index, name in enumerate(names):
+        cells = [column[index].rjust(width) for column, width in zip(columns, widths)]
+        lines.append(" ".join([name.ljust(label_width)] + cells))
+
+    return "<pre>" + html.escape("\n".join(lines)) + "</pre>"
+
+
+def format_batch_table(rows, levels):
+    """Compact monospace table (HTML <pre>) of batch results"""
+    labels = [row[0] for row in rows]
+    label_width = min(max(len(label) for label in labels), 12) if labels else 1
+    columns = [[_format_level(value) for value in levels[name]] for name in LEVELS]
+    widths = [max([len(title)] + [len(value) for value in column]) for title, column in zip(LEVEL_TITLES, columns)]
+
+    lines = [" ".join([" " * label_width] + [title.rjust(width) for title, width in zip(LEVEL_TITLES, widths)])]
+    for index, label in enumerate(labels):
+        cells = [column[index].rjust(width) for column, width in zip(columns, widths)]
+        lines.append(" ".join([label[:label_width].ljust(label_width)] + cells))
+
+    return "<pre>" + html.escape("\n".join(lines)) + "</pre>"
+
+
+def format_batch_csv(rows, levels):
+    """Batch results as CSV text"""
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(['label', 'high', 'low', 'close'] + list(LEVEL_TITLES))
+    for index, (label, high, low, close) in enumerate(rows):
+        writer.writerow([label, high, low, close] + [_format_level(levels[name][index]) for name in LEVELS])
+    return output.getvalue()
@@ -0,0 +1,340 @@
+"""Live price feeds, session bars and level-touch detection
+
+A feed yields batches of raw tick lines, `SYMBOL,price[,epoch seconds]`.
+Two stand-ins for a real market data connection are provided: FileTailFeed
+follows a file that another process appends ticks to, and SocketFeed
+accepts newline-separated ticks on a local TCP port.
+
+TickProcessor folds ticks into the current session bar of each symbol.
+When a session closes, the pivot levels of the next one are computed from
+that bar alone, so no history is re-read. Every tick is checked against
+the sorted levels of its symbol with bisect, and each level triggers
+on_touch at most once per session. Closed minute bars can be appended to
+the OHLC store so /pivot and backtests see the live data too.
+
+    run_feed(feed, processor) runs until the feed ends or is cancelled.
+"""
+import asyncio
+import bisect
+import logging
+import math
+import os
+import time
+
+from ohlc_store import normalize_symbol, period_key
+from pivot_engine import DEFAULT_METHOD, LEVEL_TITLES, LEVELS, compute_levels
+
+logger = logging.getLogger(__name__)
+
+READ_SIZE = 65536
+BATCH_SIZE = 5000
+BAR_SECONDS = 60
+
+
+def parse_tick(line):
+    """(symbol, price, timestamp or None) from `SYMBOL,price[,time]`"""
+    fields = line.split(',')
+    if len(fields) not in (2, 3):
+        raise ValueError(f"Invalid tick: {line!r}")
+    price = float(fields[1])
+    timestamp = float(fields[2]) if len(fields) == 3 and fields[2].strip() else None
+    # nan and inf parse as floats; one of them would end up in the
+    # append-only store and in every level computed after it
+    if not (math.isfinite(price) and price > 0):
+        raise ValueError(f"Invalid tick price: {line!r}")
+    if timestamp is not None and not (math.isfinite(timestamp) and timestamp > 0):
+        raise ValueError(f"Invalid tick time: {line!r}")
+    return fields[0].strip().upper(), price, timestamp
+
+
+class PriceFeed:
+    """Source of tick lines; subclasses implement batches()"""
+
+    name = "feed"
+
+    async def batches(self):
+        """Async iterator of lists of tick lines"""
+        raise NotImplementedError
+        yield
+
+    async def close(self):
+        pass
+
+
+class FileTailFeed(PriceFeed):
+    """Ticks appended to a file, followed like `tail -f`"""
+
+    name = "file"
+
+    def __init__(self, path, poll_interval=0.2, from_start=False):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.from_start = from_start
+
+    async def batches(self):
+        position = None
+        pending = b""
+        while True:
+            try:
+                size = os.path.getsize(self.path)
+            except OSError:
+                await asyncio.sleep(self.poll_interval)
+                continue
+            if position is None:
+                position = 0 if self.from_start else size
+            elif size < position:
+                # Truncated or replaced, start over
+                logger.info(f"Tick file {self.path} was truncated, reading from the start")
+                position, pending = 0, b""
+            if size == position:
+                await asyncio.sleep(self.poll_interval)
+                continue
+
+            with open(self.path, 'rb') as f:
+                f.seek(position)
+                data = f.read(min(size - position, READ_SIZE * 16))
+            position += len(data)
+            lines = (pending + data).split(b"\n")
+            pending = lines.pop()
+            yield [line.decode('utf-8', 'replace') for line in lines if line.strip()]
+
+
+class SocketFeed(PriceFeed):
+    """Ticks sent as lines to a local TCP port, from any number of clients"""
+
+    name = "socket"
+
+    def __init__(self, host="127.0.0.1", port=9009, max_pending=1000):
+        self.host = host
+        self.port = port
+        self.queue = asyncio.Queue(max_pending)
+        self.server = None
+
+    async def _client(self, reader, writer):
+        pending = b""
+        try:
+            while True:
+                data = await reader.read(READ_SIZE)
+                if not data:
+                    break
+                lines = (pending + data).split(b"\n")
+                pending = lines.pop()
+                # Waiting here pushes back on the sender when ticks pile up
+                await self.queue.put([line.decode('utf-8', 'replace') for line in lines if line.strip()])
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._client, self.host, self.port)
+        logger.info(f"Price feed listening on {self.host}:{self.port}")
+
+    async def batches(self):
+        if self.server is None:
+            await self.start()
+        while True:
+            lines = await self.queue.get()
+            while len(lines) < BATCH_SIZE and not self.queue.empty():
+                lines.extend(self.queue.get_nowait())
+            yield lines
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+
+def create_feed(spec):
+    """Feed from a spec: `file:/path/to/ticks.csv` or `tcp:host:port`"""
+    kind, _, target = spec.partition(':')
+    if kind == 'file' and target:
+        return FileTailFeed(target)
+    if kind == 'tcp' and target:
+        host, _, port = target.rpartition(':')
+        return SocketFeed(host or "127.0.0.1", int(port))
+    raise ValueError(f"Unknown price feed: {spec}")
+
+
+class SymbolSession:
+    """Running state of one symbol"""
+
+    __slots__ = ('key', 'open', 'high', 'low', 'close', 'bar', 'levels', 'prices', 'names', 'touched', 'last_price')
+
+    def __init__(self):
+        self.key = None
+        self.open = self.high = self.low = self.close = None
+        # Minute bar being built: [start, open, high, low, close]
+        self.bar = None
+        self.levels = None
+        # Levels sorted by price, with their names in the same order
+        self.prices = []
+        self.names = []
+        self.touched = set()
+        self.last_price = None
+
+    def set_levels(self, levels):
+        self.levels = levels
+        pairs = sorted((value, name) for name, value in levels.items() if value is not None)
+        self.prices = [value for value, _ in pairs]
+        self.names = [name for _, name in pairs]
+        self.touched = set()
+
+
+class TickProcessor:
+    """Session bars, incremental pivots and level touches from ticks"""
+
+    def __init__(self, period='daily', method=DEFAULT_METHOD, store=None, bar_seconds=BAR_SECONDS,
+                 on_touch=None, on_session=None, on_price=None, clock=time.time):
+        # on_touch(symbol, level name, level, price),
+        # on_session(symbol, closed bar, new levels) and on_price(symbol, price)
+        # are plain callbacks
+        self.period = period
+        self.method = method
+        self.store = store
+        self.bar_seconds = bar_seconds
+        self.on_touch = on_touch
+        self.on_session = on_session
+        self.on_price = on_price
+        self.clock = clock
+        self.sessions = {}
+        self.ticks = 0
+        self.bad_ticks = 0
+
+    def levels(self, symbol):
+        session = self.sessions.get(symbol)
+        return session.levels if session is not None else None
+
+    def _session(self, symbol, timestamp):
+        session = self.sessions.get(symbol)
+        if session is None:
+            session = self.sessions[symbol] = SymbolSession()
+            if self.store is not None:
+                self._seed(symbol, session, timestamp)
+        return session
+
+    def _seed(self, symbol, session, timestamp):
+        """Start from stored history: levels from the last complete period,
+        and the bars of the current one stored before a restart"""
+        try:
+            previous = self.store.latest_period(symbol, self.period, timestamp)
+            current = self.store.current_period(symbol, self.period, timestamp)
+        except ValueError:
+            return
+        if previous is not None:
+            _, open_price, high, low, close = previous
+            session.set_levels(compute_levels(high, low, close, self.method, open_price))
+        if current is not None:
+            # Otherwise the session would close with the range seen since
+            # the restart only, and the next levels would be wrong
+            _, session.open, session.high, session.low, session.close = current
+            session.key = period_key(int(timestamp), self.period)
+
+    def _flush_bar(self, symbol, session):
+        if self.store is not None and session.bar is not None:
+            try:
+                self.store.append(symbol, [tuple(session.bar)])
+            except (OSError, ValueError) as e:
+                logger.warning(f"Could not store {symbol} bar: {e}")
+        session.bar = None
+
+    def process(self, symbol, price, timestamp=None):
+        """Fold one tick in"""
+        if timestamp is None:
+            timestamp = self.clock()
+        self.ticks += 1
+        session = self._session(symbol, timestamp)
+        key = period_key(int(timestamp), self.period)
+
+        if session.key != key:
+            if session.key is not None and key < session.key:
+                # Late tick from a closed session
+                return
+            if session.key is not None:
+                closed = (session.open, session.high, session.low, session.close)
+                session.set_levels(compute_levels(session.high, session.low, session.close, self.method, session.open))
+                if self.on_session is not None:
+                    self.on_session(symbol, closed, session.levels)
+            session.key = key
+            session.open = session.high = session.low = price
+            session.last_price = None
+        else:
+            session.high = max(session.high, price)
+            session.low = min(session.low, price)
+        session.close = price
+
+        bar_start = int(timestamp) // self.bar_seconds * self.bar_seconds
+        bar = session.bar
+        if bar is None or bar_start > bar[0]:
+            self._flush_bar(symbol, session)
+            session.bar = [bar_start, price, price, price, price]
+        else:
+            bar[2] = max(bar[2], price)
+            bar[3] = min(bar[3], price)
+            bar[4] = price
+
+        previous, session.last_price = session.last_price, price
+        if session.prices and previous is not None and previous != price:
+            self._check_touches(symbol, session, previous, price)
+        if self.on_price is not None:
+            try:
+                self.on_price(symbol, price)
+            except Exception as e:
+                logger.warning(f"Price callback failed for {symbol}: {e}")
+
+    def _check_touches(self, symbol, session, previous, price):
+        # Levels within (previous, price] when rising, [price, previous) when falling
+        if price > previous:
+            low, high = bisect.bisect_right(session.prices, previous), bisect.bisect_right(session.prices, price)
+        else:
+            low, high = bisect.bisect_left(session.prices, price), bisect.bisect_left(session.prices, previous)
+        for index in range(low, high):
+            name = session.names[index]
+            if name in session.touched:
+                continue
+            session.touched.add(name)
+            if self.on_touch is not None:
+                try:
+                    self.on_touch(symbol, name, session.prices[index], price)
+                except Exception as e:
+                    logger.warning(f"Level touch callback failed for {symbol}: {e}")
+
+    def process_lines(self, lines):
+        """Fold a batch of tick lines in; returns how many were valid"""
+        valid = 0
+        for line in lines:
+            try:
+                symbol, price, timestamp = parse_tick(line)
+                self.process(normalize_symbol(symbol), price, timestamp)
+                valid += 1
+            except ValueError:
+                self.bad_ticks += 1
+        return valid
+
+    def flush(self):
+        """Store the minute bars still being built"""
+        for symbol, session in self.sessions.items():
+            self._flush_bar(symbol, session)
+
+
+async def run_feed(feed, processor, on_batch=None):
+    """Feed ticks to the processor until cancelled; on_batch(valid, invalid)
+    is called after every batch"""
+    try:
+        async for lines in feed.batches():
+            for start in range(0, len(lines), BATCH_SIZE):
+                chunk = lines[start:start + BATCH_SIZE]
+                valid = processor.process_lines(chunk)
+                if on_batch is not None:
+                    on_batch(valid, len(chunk) - valid)
+                # Let handlers run between large batches
+                await asyncio.sleep(0)
+    finally:
+        processor.flush()
+        await feed.close()
+
+
+def level_title(name):
+    """Display name of a level, e.g. 'r1' -> 'R1'"""
+    return LEVEL_TITLES[LEVELS.index(name)]
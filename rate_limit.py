@@ -0,0 +1,114 @@
+"""Token bucket rate limiting"""
+import asyncio
+import time
+from collections import OrderedDict
+
+
+class TokenBucket:
+    """Token bucket refilled at `rate` tokens per second up to `capacity`"""
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self.clock = clock
+        self.tokens = self.capacity
+        self.updated = clock()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated = now
+
+    def delay(self, tokens=1):
+        """Seconds to wait before `tokens` are available"""
+        now = self.clock()
+        self._refill(now)
+        wait = max(self.blocked_until - now, 0.0)
+        if self.tokens < tokens:
+            wait = max(wait, (tokens - self.tokens) / self.rate)
+        return wait
+
+    def try_acquire(self, tokens=1):
+        """Take tokens if available right now"""
+        if self.delay(tokens) > 0:
+            return False
+        self.tokens -= tokens
+        return True
+
+    async def acquire(self, tokens=1):
+        """Wait until tokens are available and take them"""
+        while True:
+            wait = self.delay(tokens)
+            if wait <= 0:
+                self.tokens -= tokens
+                return
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds):
+        """Block the bucket, e.g. after a flood-control RetryAfter"""
+        self.blocked_until = max(self.blocked_until, self.clock() + seconds)
+        self.tokens = 0.0
+
+
+class KeyedRateLimiter:
+    """One token bucket per key (e.g. user and command), bounded in memory
+
+    Buckets live in an LRU ordered dict; when more than `max_keys` keys are
+    tracked the least recently used bucket is dropped. A dropped bucket was
+    idle the longest, so it has most likely refilled anyway.
+    """
+
+    def __init__(self, rate, capacity=None, max_keys=10000, clock=time.monotonic):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self.max_keys = max_keys
+        self.clock = clock
+        # key -> [tokens, updated, limited]
+        self.buckets = OrderedDict()
+        self.allowed = 0
+        self.denied = 0
+
+    def hit(self, key):
+        """Take one token for `key`; returns (allowed, first_denial)
+
+        first_denial is True only for the first rejected request after an
+        accepted one, so callers can warn the user once per burst.
+        """
+        now = self.clock()
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = [self.capacity, now, False]
+            if len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(key)
+            elapsed = now - bucket[1]
+            if elapsed > 0:
+                bucket[0] = min(self.capacity, bucket[0] + elapsed * self.rate)
+                bucket[1] = now
+
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            bucket[2] = False
+            self.allowed += 1
+            return True, False
+
+        first_denial = not bucket[2]
+        bucket[2] = True
+        self.denied += 1
+        return False, first_denial
+
+    def __len__(self):
+        return len(self.buckets)
+
+
+def parse_limit(text):
+    """Parse "count/seconds" into (rate per second, burst capacity)"""
+    count, _, seconds = text.partition("/")
+    count = float(count)
+    seconds = float(seconds or 1)
+    if count <= 0 or seconds <= 0:
+        raise ValueError(f"Invalid rate limit: {text}")
+    return count / seconds, count
@@ -0,0 +1,255 @@
+"""Schema of the settings snapshot: versions, migrations and validation
+
+Snapshots carry a "schema_version". Loading parses the JSON (keeping keys
+that were written twice), upgrades it one version at a time through
+MIGRATIONS and then validates every field against FIELDS, so the bot
+always gets int user ids and well-typed values.
+
+Versions:
+    1  original format, no version field; user_stats is a dict of dicts with
+       ISO timestamps. Ids went through JSON as strings and came back as
+       strings next to the int ids of new entries, so the same user could
+       be saved twice.
+    2  user ids are unique ints (strings in JSON keys), user_stats rows are
+       compact lists (see user_store.UserTable)
+"""
+import json
+import logging
+
+from backtest import Rules
+from ohlc_store import normalize_symbol
+from user_store import UserRecord, UserTable
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSION = 2
+
+
+class SettingsError(ValueError):
+    """Raised when a settings snapshot cannot be loaded"""
+
+
+class UnsupportedSchema(SettingsError):
+    """Raised for snapshots written by a newer version of the bot"""
+
+
+class DuplicateKeys(dict):
+    """JSON object that had repeated keys; `duplicates` holds the values that
+    were overwritten, in file order"""
+
+    def __init__(self, items, duplicates):
+        super().__init__(items)
+        self.duplicates = duplicates
+
+
+def _collect_pairs(pairs):
+    result = {}
+    duplicates = []
+    for key, value in pairs:
+        if key in result:
+            duplicates.append((key, result[key]))
+        result[key] = value
+    return DuplicateKeys(result, duplicates) if duplicates else result
+
+
+def parse(text):
+    """Parse snapshot JSON without silently dropping repeated keys"""
+    return json.loads(text, object_pairs_hook=_collect_pairs)
+
+
+def user_id(value):
+    """Canonical user id: an int, whatever JSON turned it into"""
+    if isinstance(value, bool):
+        raise ValueError(f"Invalid user id: {value!r}")
+    if isinstance(value, str):
+        value = value.strip()
+    return int(value)
+
+
+def merge_records(first, second):
+    """Merge two records of the same user that drifted apart"""
+    latest = second if second.last_seen >= first.last_seen else first
+    first_uses = [record.first_use for record in (first, second) if record.first_use]
+    return UserRecord(
+        latest.username or first.username or second.username,
+        latest.first_name or first.first_name or second.first_name,
+        first.calculations + second.calculations,
+        min(first_uses) if first_uses else 0,
+        max(first.last_seen, second.last_seen),
+        latest.failures,
+        latest.unreachable
+    )
+
+
+def _migrate_1_to_2(raw):
+    """Unify user ids as ints and merge the users saved under two keys"""
+    stats = raw.get('user_stats') or {}
+    entries = list(getattr(stats, 'duplicates', [])) + list(stats.items())
+    users = UserTable()
+    merged = 0
+    for key, row in entries:
+        try:
+            record = UserRecord.from_row(row)
+            uid = user_id(key)
+        except (TypeError, ValueError) as e:
+            logger.warning(f"Dropping invalid user_stats entry {key!r}: {e}")
+            continue
+        if uid in users:
+            users[uid] = merge_records(users[uid], record)
+            merged += 1
+        else:
+            users[uid] = record
+    if merged:
+        logger.warning(f"Merged {merged} duplicate user_stats entries")
+    raw['user_stats'] = users.to_json()
+
+    methods = raw.get('pivot_methods') or {}
+    raw['pivot_methods'] = {str(user_id(key)): value for key, value in methods.items()}
+    return raw
+
+
+# version -> function upgrading a raw snapshot of that version by one
+MIGRATIONS = {
+    1: _migrate_1_to_2
+}
+
+
+def _bool(value):
+    if not isinstance(value, bool):
+        raise ValueError(f"expected true/false, got {value!r}")
+    return value
+
+
+def _count(value):
+    value = int(value)
+    if value < 0:
+        raise ValueError(f"expected a count, got {value!r}")
+    return value
+
+
+def _id_set(values):
+    return {user_id(value) for value in values}
+
+
+def _chat(value):
+    # Channels are stored by numeric id or @username
+    if value is None or isinstance(value, (int, str)) and not isinstance(value, bool):
+        return value
+    raise ValueError(f"expected a chat id, got {value!r}")
+
+
+def _optional_text(value):
+    if value is None or isinstance(value, str):
+        return value
+    raise ValueError(f"expected text, got {value!r}")
+
+
+def _user_table(rows):
+    return UserTable.from_json(rows)
+
+
+def _pivot_methods(methods):
+    return {user_id(key): str(value) for key, value in methods.items()}
+
+
+def _strategy(strategy):
+    # Round trip through Rules to check every parameter
+    return {trade_type: Rules.from_dict(strategy[trade_type]).as_dict() for trade_type in ('scalp', 'swing')}
+
+
+def _watchers(watchers):
+    return {normalize_symbol(symbol): {user_id(uid) for uid in uids} for symbol, uids in watchers.items() if uids}
+
+
+def _texts(texts):
+    if not isinstance(texts, dict) or not all(isinstance(value, str) for value in texts.values()):
+        raise ValueError("expected texts")
+    return dict(texts)
+
+
+# key -> converter from the JSON value to the in-memory value
+FIELDS = {
+    'active': _bool,
+    'owner_only': _bool,
+    'allowed_users': _id_set,
+    'blocked_users': _id_set,
+    'privileged_users': _id_set,
+    'total_calculations': _count,
+    'user_stats': _user_table,
+    'channel_id': _chat,
+    'channel_username': _optional_text,
+    'pivot_methods': _pivot_methods,
+    'strategy': _strategy,
+    'level_watchers': _watchers,
+    'custom_texts': _texts
+}
+
+
+def migrate(raw):
+    """Upgrade a raw snapshot to SCHEMA_VERSION"""
+    version = raw.pop('schema_version', 1)
+    if not isinstance(version, int) or version < 1:
+        raise SettingsError(f"Invalid schema version {version!r}")
+    if version > SCHEMA_VERSION:
+        raise UnsupportedSchema(f"Settings schema {version} is newer than this bot ({SCHEMA_VERSION})")
+    while version < SCHEMA_VERSION:
+        raw = MIGRATIONS[version](raw)
+        version += 1
+        logger.info(f"Migrated settings to schema {version}")
+    return raw
+
+
+def load(text, default_texts):
+    """Parse, migrate and validate a snapshot
+
+    Returns (settings, journal_seq) where settings holds only the valid
+    fields, so missing or invalid ones keep their current value. Custom
+    texts are merged over `default_texts`, which keeps texts added since
+    the snapshot was written.
+    """
+    raw = parse(text)
+    if not isinstance(raw, dict):
+        raise SettingsError("Settings snapshot is not an object")
+    raw = migrate(raw)
+
+    journal_seq = raw.pop('journal_seq', 0)
+    settings = {}
+    for key, convert in FIELDS.items():
+        if key not in raw:
+            continue
+        try:
+            settings[key] = convert(raw[key])
+        except (TypeError, ValueError, AttributeError, KeyError) as e:
+            logger.warning(f"Ignoring invalid setting {key}: {e}")
+
+    if 'custom_texts' in settings:
+        texts = dict(default_texts)
+        texts.update((key, value) for key, value in settings['custom_texts'].items() if key in texts)
+        settings['custom_texts'] = texts
+
+    unknown = set(raw) - set(FIELDS)
+    if unknown:
+        logger.warning(f"Ignoring unknown settings: {', '.join(sorted(unknown))}")
+    return settings, _count(journal_seq)
+
+
+def dump(settings, journal_seq):
+    """JSON-ready snapshot of the in-memory settings"""
+    return {
+        'schema_version': SCHEMA_VERSION,
+        'active': settings['active'],
+        'owner_only': settings['owner_only'],
+        'allowed_users': list(settings['allowed_users']),
+        'blocked_users': list(settings['blocked_users']),
+        'privileged_users': list(settings['privileged_users']),
+        'total_calculations': settings['total_calculations'],
+        # Copies so the snapshot can be written from another thread
+        'user_stats': settings['user_stats'].to_json(),
+        'channel_id': settings['channel_id'],
+        'channel_username': settings['channel_username'],
+        'pivot_methods': dict(settings['pivot_methods']),
+        'strategy': {trade_type: dict(rules) for trade_type, rules in settings['strategy'].items()},
+        'level_watchers': {symbol: list(uids) for symbol, uids in settings['level_watchers'].items()},
+        'custom_texts': dict(settings['custom_texts']),
+        'journal_seq': journal_seq
+    }
@@ -0,0 +1,191 @@
+"""Parameter sweep of the recommendation rules over stored bars
+
+Every combination of stop cap, entry depth and exit target in the grid is
+backtested, and the results are ranked by net points (then by the smaller
+drawdown). The price columns are copied once into one shared memory block
+that the worker processes attach to, so the history is not pickled to,
+or duplicated in, every worker.
+
+    python sweep.py [--strategy scalp|swing] [--workers N] [--top 20] [SYMBOL ...]
+"""
+import itertools
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import backtest
+from ohlc_store import COLUMNS, ITEM_SIZE
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+STOP_CAPS = (5.0, 10.0, 15.0, 20.0, 25.0, 30.0, 40.0, 50.0)
+ENTRY_DEPTHS = (0.0, 0.25, 0.5, 0.75)
+TARGETS = (1, 2, 3)
+# Rule sets with fewer trades are not ranked: a handful of lucky trades
+# says nothing about the rules
+MIN_TRADES = 20
+# Each worker is a fresh interpreter that re-imports the caller's modules
+MAX_DEFAULT_WORKERS = 2
+
+
+def grid(stop_caps=STOP_CAPS, entry_depths=ENTRY_DEPTHS, targets=TARGETS):
+    """Rules for every combination of the parameters"""
+    return [backtest.Rules(stop_cap, entry_depth, target)
+            for stop_cap, entry_depth, target in itertools.product(stop_caps, entry_depths, targets)]
+
+
+def _views(buffer, layout):
+    """symbol -> columns over a shared buffer laid out by SharedBars"""
+    columns = {}
+    for symbol, offset, count in layout:
+        views = []
+        for index, (_, typecode) in enumerate(COLUMNS):
+            start = offset + index * count * ITEM_SIZE
+            view = buffer[start:start + count * ITEM_SIZE]
+            views.append(np.frombuffer(view, dtype=typecode) if np is not None else view.cast(typecode))
+        columns[symbol] = views
+    return columns
+
+
+class SharedBars:
+    """The bars of some symbols copied into one shared memory block"""
+
+    def __init__(self, store, symbols):
+        self.layout = []
+        snapshots = []
+        size = 0
+        for symbol in symbols:
+            data = store.get(symbol)
+            if data is None or not data.count:
+                continue
+            # Cut every column at the same bar, the bot may append meanwhile
+            columns = data.columns()
+            count = len(columns[0])
+            self.layout.append((symbol.upper(), size, count))
+            snapshots.append(columns)
+            size += count * ITEM_SIZE * len(COLUMNS)
+
+        self.memory = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        for (symbol, offset, count), columns in zip(self.layout, snapshots):
+            for index, column in enumerate(columns):
+                start = offset + index * count * ITEM_SIZE
+                self.memory.buf[start:start + count * ITEM_SIZE] = memoryview(column).cast('B')
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.memory.close()
+        self.memory.unlink()
+
+
+# Set in each worker process by _attach()
+_worker_memory = None
+_worker_columns = None
+
+
+def _attach(name, layout):
+    global _worker_memory, _worker_columns
+    # Workers share the parent's resource tracker, which unlinks the
+    # block if the parent dies without closing it
+    _worker_memory = shared_memory.SharedMemory(name=name)
+    _worker_columns = _views(_worker_memory.buf, layout)
+
+
+def _evaluate(task):
+    rules, strategy, start, end = task
+    report = backtest.BacktestReport(strategy, rules)
+    period = backtest.STRATEGIES[strategy]
+    for symbol, columns in _worker_columns.items():
+        report.add(symbol, backtest.simulate_columns(columns, period, rules), start, end)
+    return report.finish()
+
+
+def default_workers():
+    """Worker count when none is given: the CPUs this process may use,
+    at most MAX_DEFAULT_WORKERS"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    return max(1, min(MAX_DEFAULT_WORKERS, cpus))
+
+
+def rank(reports, min_trades=MIN_TRADES):
+    """Best first: most net points, then smallest drawdown; rule sets with
+    fewer than min_trades trades are left out"""
+    ranked = [report for report in reports if report.trades >= min_trades]
+    return sorted(ranked, key=lambda report: (-report.pnl, report.max_drawdown))
+
+
+def sweep(store, symbols=None, strategy='scalp', rules_grid=None, workers=None, start=None, end=None,
+          min_trades=MIN_TRADES):
+    """Backtest every rule set of the grid; returns the ranked reports"""
+    if strategy not in backtest.STRATEGIES:
+        raise backtest.BacktestError(f"Unknown strategy: {strategy}")
+    rules_grid = rules_grid or grid()
+    workers = workers or default_workers()
+    tasks = [(rules, strategy, start, end) for rules in rules_grid]
+
+    with SharedBars(store, symbols or store.symbols()) as shared:
+        if not shared.layout:
+            return []
+        # Spawned rather than forked: the bot calls this from a worker
+        # thread while its event loop keeps running
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(workers, mp_context=context, initializer=_attach,
+                                 initargs=(shared.name, shared.layout)) as pool:
+            reports = list(pool.map(_evaluate, tasks, chunksize=max(1, len(tasks) // (workers * 4))))
+    logger.info(f"Swept {len(tasks)} rule sets for {strategy} with {workers} workers")
+    return rank(reports, min_trades)
+
+
+def format_table(reports, limit=10):
+    """Monospace table of the best rule sets"""
+    lines = ["  # cap  entry TP trades  win%  stop%   points   max DD"]
+    for number, report in enumerate(reports[:limit], 1):
+        rules = report.rules
+        lines.append(
+            f"{number:3d} {rules.stop_cap:4g} {rules.entry_depth:6.2f} {rules.target:2d} {report.trades:6d} "
+            f"{report.rate(report.wins) * 100:5.1f} {report.rate(report.stopped) * 100:6.1f} "
+            f"{report.pnl:8.1f} {report.max_drawdown:8.1f}"
+        )
+    return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    from ohlc_store import OHLCStore, parse_time
+
+    parser = argparse.ArgumentParser(description="Sweep the stop cap, entry depth and exit target")
+    parser.add_argument('symbols', nargs='*', help="symbols to test (default: all stored)")
+    parser.add_argument('--strategy', choices=sorted(backtest.STRATEGIES), default='scalp')
+    parser.add_argument('--workers', type=int, help=f"worker processes (default: CPUs, at most {MAX_DEFAULT_WORKERS})")
+    parser.add_argument('--min-trades', type=int, default=MIN_TRADES, help="leave out rule sets with fewer trades")
+    parser.add_argument('--top', type=int, default=20, help="rows to print")
+    parser.add_argument('--from', dest='start', type=parse_time, help="first period, e.g. 2023-01-01")
+    parser.add_argument('--to', dest='end', type=parse_time, help="end of the last period")
+    parser.add_argument('--dir', default=os.getenv("OHLC_DIR", "ohlc"), help="OHLC store directory")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    results = sweep(OHLCStore(args.dir), args.symbols, args.strategy,
+                    workers=args.workers, start=args.start, end=args.end, min_trades=args.min_trades)
+    print(format_table(results, args.top))
+    print(f"({len(results)} rule sets, {time.perf_counter() - started:.2f}s)")
@@ -0,0 +1,152 @@
+"""Alert matching at level boundaries, and alert durability"""
+import math
+import sqlite3
+
+import pytest
+
+from alerts import AlertBook, AlertIndex, AlertStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = AlertStore(str(tmp_path / "alerts.db"))
+    yield store
+    store.close()
+
+
+def alert(alert_id, price, symbol='XAUUSD'):
+    return {'alert_id': alert_id, 'user_id': 1, 'symbol': symbol, 'price': price}
+
+
+def matched(index, symbol, price):
+    return sorted(alert['alert_id'] for alert in index.match(symbol, price))
+
+
+def test_rising_includes_new_price_excludes_previous():
+    index = AlertIndex()
+    for alert_id, price in enumerate((100.0, 101.0, 102.0, 103.0), 1):
+        index.add(alert(alert_id, price))
+    index.match('XAUUSD', 100.0)
+
+    assert matched(index, 'XAUUSD', 102.0) == [2, 3]
+    assert sorted(index.alerts) == [1, 4]
+
+
+def test_falling_includes_new_price_excludes_previous():
+    index = AlertIndex()
+    for alert_id, price in enumerate((100.0, 101.0, 102.0, 103.0), 1):
+        index.add(alert(alert_id, price))
+    index.match('XAUUSD', 103.0)
+
+    assert matched(index, 'XAUUSD', 101.0) == [2, 3]
+    assert sorted(index.alerts) == [1, 4]
+
+
+def test_first_and_unchanged_prices_do_not_trigger():
+    index = AlertIndex()
+    index.add(alert(1, 100.0))
+
+    assert matched(index, 'XAUUSD', 100.0) == []
+    assert matched(index, 'XAUUSD', 100.0) == []
+    # Leaving the level is not reaching it
+    assert matched(index, 'XAUUSD', 99.0) == []
+    assert matched(index, 'XAUUSD', 100.0) == [1]
+
+
+def test_alerts_on_the_same_level_fire_together():
+    index = AlertIndex()
+    index.add(alert(1, 100.0))
+    index.add(alert(2, 100.0))
+    index.add(alert(3, 100.0, symbol='EURUSD'))
+    index.match('XAUUSD', 99.0)
+
+    assert matched(index, 'XAUUSD', 100.0) == [1, 2]
+    assert 'XAUUSD' not in index.symbols
+    assert sorted(index.alerts) == [3]
+
+
+def test_removed_alert_does_not_fire():
+    index = AlertIndex()
+    index.add(alert(1, 100.0))
+    index.add(alert(2, 100.0))
+    index.match('XAUUSD', 99.0)
+
+    assert index.remove(1)['alert_id'] == 1
+    assert index.remove(1) is None
+    assert matched(index, 'XAUUSD', 101.0) == [2]
+
+
+@pytest.mark.parametrize("price", [math.nan, math.inf, -math.inf, 0.0, -5.0])
+def test_invalid_alert_price_is_refused(store, price):
+    book = AlertBook(store)
+
+    with pytest.raises(ValueError):
+        book.add(1, 'XAUUSD', price)
+    assert store.active() == []
+
+
+def test_non_finite_price_is_ignored(store):
+    book = AlertBook(store)
+    book.add(1, 'XAUUSD', 100.0)
+    book.on_price('XAUUSD', 99.0)
+
+    assert book.on_price('XAUUSD', math.nan) == []
+    assert book.on_price('XAUUSD', math.inf) == []
+    assert book.last_price('XAUUSD') == 99.0
+    assert [a['price'] for a in book.on_price('XAUUSD', 100.5)] == [100.0]
+
+
+def test_triggered_alerts_are_stored(store, tmp_path):
+    fired = []
+    book = AlertBook(store, lambda alert, price: fired.append((alert['alert_id'], price)) or True)
+    first = book.add(1, 'XAUUSD', 100.0)
+    second = book.add(1, 'XAUUSD', 110.0)
+    book.on_price('XAUUSD', 99.0)
+    book.on_price('XAUUSD', 101.0)
+
+    assert fired == [(first['alert_id'], 101.0)]
+    reloaded = AlertBook(AlertStore(str(tmp_path / "alerts.db")))
+    assert list(reloaded.index.alerts) == [second['alert_id']]
+
+
+@pytest.mark.parametrize("outcome", [False, RuntimeError("queue closed")])
+def test_unsent_alert_stays_active(store, outcome):
+    def on_trigger(alert, price):
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    book = AlertBook(store, on_trigger)
+    book.add(1, 'XAUUSD', 100.0)
+    book.on_price('XAUUSD', 99.0)
+
+    assert book.on_price('XAUUSD', 101.0) == []
+    assert len(book.index) == 1
+    assert len(store.active()) == 1
+
+    book.on_trigger = lambda alert, price: True
+    assert len(book.on_price('XAUUSD', 99.0)) == 1
+    assert store.active() == []
+
+
+def test_alert_stays_indexed_when_it_cannot_be_marked(store, monkeypatch):
+    book = AlertBook(store)
+    book.add(1, 'XAUUSD', 100.0)
+    book.on_price('XAUUSD', 99.0)
+
+    def fail(alert_ids, price):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(store, 'mark_triggered', fail)
+    assert len(book.on_price('XAUUSD', 101.0)) == 1
+    assert len(book.index) == 1
+
+
+def test_users_cancel_only_their_own_alerts(store):
+    book = AlertBook(store)
+    mine = book.add(1, 'XAUUSD', 100.0)
+    theirs = book.add(2, 'XAUUSD', 105.0)
+
+    assert book.cancel([mine['alert_id'], theirs['alert_id']], user_id=1) == [mine['alert_id']]
+    assert [a['alert_id'] for a in book.user_alerts(2)] == [theirs['alert_id']]
+    assert list(book.index.alerts) == [theirs['alert_id']]
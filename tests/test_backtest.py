@@ -0,0 +1,76 @@
+"""The vectorized and loop backtests must agree trade for trade"""
+import random
+
+import pytest
+
+import backtest
+
+np = pytest.importorskip("numpy")
+
+DAY = 86400
+
+
+def random_bars(days, bars_per_day=96, seed=1):
+    """Random-walk (time, open, high, low, close) columns with gaps"""
+    rng = random.Random(seed)
+    times, opens, highs, lows, closes = [], [], [], [], []
+    price = 2000.0
+    start = 1700006400 - 1700006400 % DAY
+    step = DAY // bars_per_day
+    for day in range(days):
+        for index in range(bars_per_day):
+            open_price = price
+            # An occasional jump gaps through levels and stops
+            price += rng.gauss(0, 15.0 if rng.random() < 0.01 else 1.5)
+            price = max(price, 100.0)
+            times.append(start + day * DAY + index * step)
+            opens.append(open_price)
+            highs.append(max(open_price, price) + rng.random())
+            lows.append(min(open_price, price) - rng.random())
+            closes.append(price)
+    return [
+        np.array(times, dtype=np.int64),
+        np.array(opens), np.array(highs), np.array(lows), np.array(closes)
+    ]
+
+
+def assert_same_trades(first, second):
+    assert first.periods == second.periods
+    assert first.times == second.times
+    assert first.is_buy == second.is_buy
+    assert first.stopped == second.stopped
+    assert first.hits == second.hits
+    assert first.entry == pytest.approx(second.entry)
+    assert first.exit == pytest.approx(second.exit)
+
+
+@pytest.mark.parametrize("period", ['daily', 'weekly'])
+@pytest.mark.parametrize("rules", [
+    backtest.Rules(),
+    backtest.Rules(stop_cap=5.0, entry_depth=0.5, target=1),
+    backtest.Rules(stop_cap=50.0, entry_depth=0.75, target=2),
+    backtest.Rules(method='camarilla'),
+    backtest.Rules(method='woodie', entry_depth=0.25),
+])
+def test_vectorized_matches_loop(period, rules):
+    columns = random_bars(120)
+    vectorized = backtest._simulate_vectorized(*columns, period, rules)
+    looped = backtest._simulate_loop(*(column.tolist() for column in columns), period, rules)
+
+    assert_same_trades(vectorized, looped)
+
+
+@pytest.mark.parametrize("period", ['daily', 'weekly'])
+def test_default_rules_trade(period):
+    columns = random_bars(120)
+
+    assert len(backtest.simulate_columns(columns, period, backtest.Rules())) > 0
+
+
+def test_stopped_trades_never_gain():
+    columns = random_bars(200, seed=7)
+    trades = backtest.simulate_columns(columns, 'daily', backtest.Rules(stop_cap=10.0))
+
+    for stopped, pnl in zip(trades.stopped, trades.pnl()):
+        if stopped:
+            assert pnl <= 0
@@ -0,0 +1,151 @@
+"""Broadcast error classification, engine and durable jobs"""
+import asyncio
+
+import pytest
+
+pytest.importorskip("telegram")
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TimedOut  # noqa: E402
+
+import broadcast  # noqa: E402
+from broadcast import DEAD, FAILED, RETRY, SENT, BroadcastEngine, BroadcastProgress, classify_error  # noqa: E402
+
+
+@pytest.mark.parametrize("error, outcome", [
+    (RetryAfter(5), RETRY),
+    (TimedOut(), RETRY),
+    (NetworkError("connection reset"), RETRY),
+    (Forbidden("Forbidden: bot was blocked by the user"), DEAD),
+    (BadRequest("Chat not found"), DEAD),
+    (BadRequest("Forbidden: user is deactivated"), DEAD),
+    (BadRequest("Message is too long"), FAILED),
+    (ValueError("bug"), FAILED),
+])
+def test_errors_are_classified(error, outcome):
+    assert classify_error(error) == outcome
+
+
+def broadcast_to(chat_ids, send, **kwargs):
+    engine = BroadcastEngine(rate=10000, **kwargs)
+    results = {}
+
+    async def on_result(chat_id, outcome):
+        results[chat_id] = outcome
+
+    progress = asyncio.run(engine.run(send, chat_ids, BroadcastProgress(len(chat_ids)), on_result))
+    return engine, progress, results
+
+
+def test_outcomes_are_counted(monkeypatch):
+    monkeypatch.setattr(broadcast, 'PER_CHAT_INTERVAL', 0)
+    errors = {2: [Forbidden("bot was blocked by the user")], 3: [BadRequest("Message is too long")],
+              4: [TimedOut()]}
+
+    async def send(chat_id):
+        if errors.get(chat_id):
+            raise errors[chat_id].pop(0)
+
+    _, progress, results = broadcast_to([1, 2, 3, 4], send, max_attempts=2)
+
+    assert results == {1: SENT, 2: DEAD, 3: FAILED, 4: SENT}
+    assert (progress.sent, progress.dead, progress.failed, progress.retries) == (2, 1, 1, 1)
+    assert progress.finished
+
+
+def test_retry_after_pauses_every_worker(monkeypatch):
+    monkeypatch.setattr(broadcast, 'PER_CHAT_INTERVAL', 0)
+    sent = {}
+    limited = []
+
+    async def send(chat_id):
+        now = asyncio.get_running_loop().time()
+        if chat_id == 1 and not limited:
+            limited.append(now)
+            raise RetryAfter(0.1)
+        sent[chat_id] = now
+
+    engine, progress, results = broadcast_to([1, 2, 3, 4, 5], send, concurrency=3)
+
+    assert set(results.values()) == {SENT}
+    assert progress.retries == 1
+    # Nothing is sent until the flood-control wait is over
+    assert min(sent.values()) - limited[0] >= 0.09
+
+
+def test_concurrency_is_bounded():
+    running = 0
+    peak = 0
+
+    async def send(chat_id):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.001)
+        running -= 1
+
+    _, progress, _ = broadcast_to(list(range(200)), send)
+
+    assert progress.sent == 200
+    assert peak == broadcast.CONCURRENCY
+
+
+def test_should_stop_leaves_the_rest_untouched():
+    sent = []
+
+    async def send(chat_id):
+        sent.append(chat_id)
+
+    engine = BroadcastEngine(rate=10000, concurrency=1)
+    progress = asyncio.run(engine.run(send, list(range(100)), BroadcastProgress(100),
+                                      should_stop=lambda: len(sent) >= 10))
+
+    assert sent == list(range(10))
+    assert progress.sent == 10
+
+
+def test_job_resumes_where_it_stopped(tmp_path):
+    path = str(tmp_path / "broadcasts.db")
+    store = broadcast.BroadcastJobStore(path)
+    recipients = [7, 3, 1200, 45, 3, 900, 12, 600]
+    job_id = store.create_job(1, "hello", recipients)
+    done = {3: SENT, 45: DEAD, 600: FAILED}
+    for user_id, state in done.items():
+        store.mark(job_id, user_id, state)
+    store.close()
+
+    # The bot restarts
+    store = broadcast.BroadcastJobStore(path)
+    job = store.get_job(job_id)
+    progress = store.progress(job_id)
+
+    assert (job['total'], job['text'], job['status']) == (7, "hello", store.RUNNING)
+    assert list(store.pending_recipients(job_id, batch_size=2)) == [7, 12, 900, 1200]
+    assert (progress.total, progress.sent, progress.dead, progress.failed) == (7, 1, 1, 1)
+    assert progress.done == progress.initial == 3
+    store.close()
+
+
+def test_resumed_broadcast_sends_to_nobody_twice(tmp_path):
+    path = str(tmp_path / "broadcasts.db")
+    store = broadcast.BroadcastJobStore(path)
+    job_id = store.create_job(1, "hello", range(1, 51))
+    sent = []
+
+    async def send(chat_id):
+        sent.append(chat_id)
+
+    async def on_result(chat_id, outcome):
+        store.mark(job_id, chat_id, outcome)
+
+    engine = BroadcastEngine(rate=10000, concurrency=4)
+    asyncio.run(engine.run(send, store.pending_recipients(job_id), store.progress(job_id), on_result,
+                           should_stop=lambda: len(sent) >= 20))
+    store.close()
+
+    store = broadcast.BroadcastJobStore(path)
+    progress = asyncio.run(engine.run(send, store.pending_recipients(job_id), store.progress(job_id), on_result))
+
+    assert sorted(sent) == list(range(1, 51))
+    assert progress.sent == 50
+    assert store.counts(job_id) == {SENT: 50}
+    store.close()
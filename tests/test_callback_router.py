@@ -0,0 +1,95 @@
+"""Callback routing: exact routes, longest prefixes and payload decoding"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from callback_router import CallbackRouter, PayloadError
+
+
+def handler(name):
+    async def handle(update, context, *args):
+        update.calls.append((name, args))
+    return handle
+
+
+@pytest.fixture
+def router():
+    router = CallbackRouter()
+    router.add("bc_list", handler("list"))
+    router.add_prefix("bc_", handler("job"), int)
+    router.add_prefix("bc_pause_", handler("pause"), int)
+    router.add_prefix("revoke_", handler("revoke"), int)
+    router.add_prefix("alert_", handler("alert"), str, int)
+    router.add_many(("admin_panel", "back_to_admin"), handler("admin"))
+    return router
+
+
+def dispatch(router, data):
+    """The calls one callback led to, and the errors it raised"""
+    update = SimpleNamespace(callback_query=SimpleNamespace(data=data), calls=[], errors=[])
+
+    async def on_unknown(update, context):
+        update.calls.append(("unknown", ()))
+
+    async def on_error(update, context, error):
+        update.errors.append(error)
+
+    asyncio.run(router.dispatch(update, None, on_unknown, on_error))
+    return update.calls, update.errors
+
+
+@pytest.mark.parametrize("data, call", [
+    ("bc_pause_12", ("pause", (12,))),
+    ("bc_12", ("job", (12,))),
+    ("bc_list", ("list", ())),
+    ("revoke_42", ("revoke", (42,))),
+    ("alert_XAUUSD_7", ("alert", ("XAUUSD", 7))),
+    ("back_to_admin", ("admin", ())),
+])
+def test_callbacks_are_routed(router, data, call):
+    assert dispatch(router, data) == ([call], [])
+
+
+def test_longest_prefix_wins(router):
+    route, args = router.match("bc_pause_3")
+    assert (route.name, args) == ("bc_pause_*", (3,))
+
+
+def test_exact_route_beats_a_prefix(router):
+    route, args = router.match("bc_list")
+    assert (route.name, args) == ("bc_list", ())
+
+
+@pytest.mark.parametrize("data", ["", "nothing", "bc", "revoke", "admin_panel_x"])
+def test_unknown_callback_goes_to_the_fallback(router, data):
+    assert dispatch(router, data) == ([("unknown", ())], [])
+
+
+@pytest.mark.parametrize("data", ["revoke_abc", "revoke_", "bc_pause_x", "alert_XAUUSD", "alert_XAUUSD_x"])
+def test_malformed_payload_goes_to_the_fallback(router, data):
+    with pytest.raises(PayloadError):
+        router.match(data)
+    assert dispatch(router, data) == ([("unknown", ())], [])
+
+
+def test_last_field_keeps_the_separators():
+    router = CallbackRouter()
+    router.add_prefix("text_", handler("text"), int, str)
+
+    assert router.match("text_5_scalp_footer")[1] == (5, "scalp_footer")
+
+
+def test_failures_are_reported_and_counted():
+    observed = []
+    router = CallbackRouter(observe=lambda route, elapsed, failed: observed.append((route.name, failed)))
+
+    async def broken(update, context):
+        raise RuntimeError("boom")
+
+    route = router.add("broken", broken)
+    calls, errors = dispatch(router, "broken")
+
+    assert [str(error) for error in errors] == ["boom"]
+    assert observed == [("broken", True)]
+    assert (route.stats.calls, route.stats.errors) == (1, 1)
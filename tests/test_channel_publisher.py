@@ -0,0 +1,108 @@
+"""Channel posts: dedup window, spacing and dedup keys"""
+import asyncio
+
+import pytest
+
+pytest.importorskip("telegram")
+
+from broadcast import FAILED, SENT  # noqa: E402
+from channel_publisher import DROPPED, DUPLICATE, ChannelPublisher, level_key  # noqa: E402
+
+CHANNEL = -100
+
+
+class FakeOutbound:
+    """Keeps queued posts until the test says how they went"""
+
+    def __init__(self, max_size=10):
+        self.max_size = max_size
+        self.queued = []
+        self.intervals = {}
+
+    def set_interval(self, chat_id, seconds):
+        self.intervals[chat_id] = seconds
+
+    def put_nowait(self, chat_id, text, callback=None):
+        if len(self.queued) >= self.max_size:
+            raise asyncio.QueueFull
+        self.queued.append((chat_id, text, callback))
+
+    def finish(self, outcome):
+        _, _, callback = self.queued.pop(0)
+        callback(outcome)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def publisher():
+    outcomes = []
+    publisher = ChannelPublisher(FakeOutbound(), min_interval=3, dedup_window=300, clock=FakeClock(),
+                                 on_outcome=lambda chat_id, outcome, seconds: outcomes.append(outcome))
+    publisher.outcomes = outcomes
+    return publisher
+
+
+def test_posts_to_a_channel_are_spaced(publisher):
+    assert publisher.submit(CHANNEL, "post")
+    assert publisher.outbound.intervals == {CHANNEL: 3}
+
+
+def test_same_levels_are_posted_once_per_window(publisher):
+    assert publisher.submit(CHANNEL, "first", dedup_key='k')
+    # Still queued, so an identical post is dropped too
+    assert not publisher.submit(CHANNEL, "queued", dedup_key='k')
+    publisher.outbound.finish(SENT)
+    publisher.clock.now += 299
+    assert not publisher.submit(CHANNEL, "again", dedup_key='k')
+    assert publisher.submit(-200, "other channel", dedup_key='k')
+    assert publisher.submit(CHANNEL, "other levels", dedup_key='j')
+
+    publisher.clock.now += 1
+    assert publisher.submit(CHANNEL, "expired", dedup_key='k')
+    assert publisher.outcomes == [DUPLICATE, SENT, DUPLICATE]
+
+
+def test_failed_post_does_not_block_a_retry(publisher):
+    results = []
+    assert publisher.submit(CHANNEL, "first", dedup_key='k', callback=results.append)
+    publisher.outbound.finish(FAILED)
+
+    assert results == [False]
+    assert publisher.outcomes == [FAILED]
+    assert publisher.submit(CHANNEL, "retry", dedup_key='k', callback=results.append)
+    publisher.outbound.finish(SENT)
+    assert results == [False, True]
+    assert not publisher.submit(CHANNEL, "duplicate", dedup_key='k')
+
+
+def test_full_queue_drops_without_blocking_a_retry(publisher):
+    publisher.outbound.max_size = 0
+
+    assert not publisher.submit(CHANNEL, "post", dedup_key='k')
+    assert publisher.outcomes == [DROPPED]
+    assert publisher.pending == {}
+    publisher.outbound.max_size = 1
+    assert publisher.submit(CHANNEL, "post", dedup_key='k')
+
+
+def levels(pivot):
+    return {'pivot': pivot, 'r1': pivot + 10, 's1': pivot - 10}
+
+
+def test_close_levels_share_a_key():
+    # Within 0.05% of a 2000 pivot, i.e. one 1.0 step
+    assert level_key(levels(2000.0), 2010) == level_key(levels(2000.3), 2010)
+    assert level_key(levels(2000.0), 2010) != level_key(levels(2003.0), 2010)
+    # Proportional levels around another pivot are another recommendation
+    assert level_key(levels(2000.0), 2010) != level_key({'pivot': 2500.0, 'r1': 2512.5, 's1': 2487.5}, 2510)
+    assert level_key(levels(1.1000), 1.2) != level_key(levels(1.1010), 1.2)
+    assert level_key(levels(1.1000), 1.2) == level_key(levels(1.10003), 1.2)
+    # The same levels in the other direction are another recommendation
+    assert level_key(levels(2000.0), 2010) != level_key(levels(2000.0), 1990)
@@ -0,0 +1,135 @@
+"""Settings journal: replay after a crash, torn records and compaction"""
+import importlib
+import json
+import os
+import sys
+
+import pytest
+
+import metrics
+
+pytest.importorskip("telegram")
+
+
+def fresh_main():
+    """main imported anew, as a restarted bot would be"""
+    old = sys.modules.pop('main', None)
+    if old is not None:
+        old.close_journal()
+    # main registers its metrics on import
+    metrics.registry = metrics.Registry()
+    return importlib.import_module('main')
+
+
+@pytest.fixture
+def main(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(metrics, 'registry', metrics.registry)
+    module = fresh_main()
+    module.load_settings()
+    yield module
+    sys.modules['main'].close_journal()
+    sys.modules.pop('main', None)
+
+
+def run_writer(module):
+    """Behave as if the background writer runs, so changes only reach the journal"""
+    module._flush_requested = module.asyncio.Event()
+
+
+def journal_lines(module):
+    lines = []
+    for segment in module.journal_segments():
+        with open(f"{module.JOURNAL_PREFIX}{segment}", encoding='utf-8') as f:
+            lines.extend(f)
+    return lines
+
+
+def make_changes(module):
+    module.add_user_to('blocked_users', 5)
+    module.set_pivot_method(7, 'camarilla')
+    module.watch_symbol(7, 'XAUUSD')
+    module.watch_symbol(8, 'XAUUSD')
+    module.unwatch_symbol(7, 'XAUUSD')
+    module.update_user_stats(7, 'trader', 'T')
+    module.update_user_stats(7, 'trader', 'T')
+
+
+def test_journal_is_replayed_after_a_crash(main):
+    run_writer(main)
+    make_changes(main)
+
+    assert not os.path.exists(main.SETTINGS_FILE)
+    main.close_journal()
+    restarted = fresh_main()
+    restarted.load_settings()
+
+    assert restarted.persistence_stats['replayed_records'] == 7
+    assert restarted.bot_settings['blocked_users'] == {5}
+    assert restarted.bot_settings['pivot_methods'] == {7: 'camarilla'}
+    assert restarted.bot_settings['level_watchers'] == {'XAUUSD': {8}}
+    assert restarted.user_store.total_calculations() == 2
+    assert restarted.journal_state['seq'] == 7
+
+
+def test_torn_last_record_is_skipped(main):
+    run_writer(main)
+    make_changes(main)
+    main.close_journal()
+    path = f"{main.JOURNAL_PREFIX}{main.journal_state['segment']}"
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('{"op":"add","key":"blocked_users","uid":9')
+
+    restarted = fresh_main()
+    restarted.load_settings()
+
+    assert restarted.persistence_stats['replayed_records'] == 7
+    assert restarted.bot_settings['blocked_users'] == {5}
+
+
+def test_unknown_record_does_not_stop_replay(main):
+    run_writer(main)
+    main.journal_record({'op': 'nonsense'})
+    main.add_user_to('blocked_users', 5)
+    main.close_journal()
+
+    restarted = fresh_main()
+    restarted.load_settings()
+
+    assert restarted.bot_settings['blocked_users'] == {5}
+
+
+def test_compaction_drops_covered_segments(main):
+    run_writer(main)
+    make_changes(main)
+    covered = main.journal_segments()
+
+    assert main.save_settings()
+    assert not set(covered) & set(main.journal_segments())
+    assert journal_lines(main) == []
+    with open(main.SETTINGS_FILE, encoding='utf-8') as f:
+        assert json.load(f)['journal_seq'] == 7
+
+    main.update_user_stats(8, 'other', None)
+    main.close_journal()
+    restarted = fresh_main()
+    restarted.load_settings()
+
+    # Records already in the snapshot are not applied twice
+    assert restarted.persistence_stats['replayed_records'] == 1
+    assert restarted.user_store.total_calculations() == 3
+    assert restarted.bot_settings['level_watchers'] == {'XAUUSD': {8}}
+
+
+def test_snapshot_records_left_behind_are_not_reapplied(main):
+    run_writer(main)
+    make_changes(main)
+    # A crash between writing the snapshot and deleting the old segments
+    main.write_settings_file(main.serialize_settings())
+    main.close_journal()
+
+    restarted = fresh_main()
+    restarted.load_settings()
+
+    assert restarted.persistence_stats['replayed_records'] == 0
+    assert restarted.user_store.total_calculations() == 2
@@ -0,0 +1,118 @@
+"""Columnar OHLC store: appends, incremental resampling and torn columns"""
+import os
+import random
+
+import pytest
+
+import ohlc_store
+from ohlc_store import COLUMNS, DAY, ITEM_SIZE, OHLCStore, Resampled
+
+START = 1700006400 - 1700006400 % DAY
+
+
+@pytest.fixture(params=['numpy', 'python'])
+def backend(request, monkeypatch):
+    if request.param == 'numpy':
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(ohlc_store, 'np', None)
+    return request.param
+
+
+def hourly_bars(start, count, seed=1):
+    rng = random.Random(seed)
+    bars = []
+    price = 2000.0
+    for index in range(count):
+        open_price = price
+        price += rng.gauss(0, 3)
+        bars.append((start + index * 3600, open_price, max(open_price, price) + 1, min(open_price, price) - 1, price))
+    return bars
+
+
+def resampled_bars(resampled):
+    return [resampled.bar(index) for index in range(len(resampled))]
+
+
+@pytest.mark.parametrize("period", ['daily', 'weekly', 'monthly'])
+def test_appending_after_a_resample_matches_a_full_resample(tmp_path, backend, period, monkeypatch):
+    bars = hourly_bars(START, 24 * 80 + 7)
+    # Splits inside a period, so the last resampled bar has to keep growing
+    first, second, third = bars[:24 * 30 + 5], bars[24 * 30 + 5:24 * 50 + 13], bars[24 * 50 + 13:]
+
+    store = OHLCStore(str(tmp_path / "incremental"))
+    store.append('XAUUSD', first)
+    store.get('XAUUSD').resample(period)
+    folded = []
+    fold = Resampled.fold
+    monkeypatch.setattr(Resampled, 'fold', lambda self, times, *rest: folded.append(len(times)) or fold(self, times, *rest))
+    store.append('XAUUSD', second)
+    store.get('XAUUSD').resample(period)
+    store.append('XAUUSD', third)
+    incremental = store.get('XAUUSD').resample(period)
+
+    full = OHLCStore(str(tmp_path / "full"))
+    full.append('XAUUSD', bars)
+
+    # Only the new bars are folded in, history is not rescanned
+    assert folded == [len(second), len(third)]
+    assert incremental.rows == len(bars)
+    assert resampled_bars(incremental) == pytest.approx(resampled_bars(full.get('XAUUSD').resample(period)))
+
+
+def test_resampled_periods(tmp_path, backend):
+    store = OHLCStore(str(tmp_path))
+    store.append('XAUUSD', [
+        (START, 10.0, 12.0, 9.0, 11.0),
+        (START + 3600, 11.0, 15.0, 10.0, 14.0),
+        (START + DAY, 14.0, 14.5, 8.0, 9.0),
+    ])
+
+    assert resampled_bars(store.get('XAUUSD').resample('daily')) == [
+        (START, 10.0, 15.0, 9.0, 14.0),
+        (START + DAY, 14.0, 14.5, 8.0, 9.0),
+    ]
+    assert store.latest_period('XAUUSD', 'daily', START + DAY + 60) == (START, 10.0, 15.0, 9.0, 14.0)
+    assert store.current_period('XAUUSD', 'daily', START + DAY + 60) == (START + DAY, 14.0, 14.5, 8.0, 9.0)
+    assert store.current_period('XAUUSD', 'daily', START + 2 * DAY) is None
+
+
+def test_old_and_repeated_bars_are_not_appended(tmp_path, backend):
+    store = OHLCStore(str(tmp_path))
+    bars = hourly_bars(START, 10)
+
+    assert store.append('XAUUSD', bars[:6]) == 6
+    assert store.append('XAUUSD', bars[3:]) == 4
+    assert list(store.get('XAUUSD').column('time')) == [bar[0] for bar in bars]
+
+
+def test_torn_columns_are_cut_to_the_shortest(tmp_path, backend):
+    store = OHLCStore(str(tmp_path))
+    bars = hourly_bars(START, 10)
+    store.append('XAUUSD', bars)
+    directory = tmp_path / "XAUUSD"
+    # A crash while appending: some columns got the last bars, one did not,
+    # and one stopped halfway through a value
+    with open(directory / "high", 'r+b') as f:
+        f.truncate(7 * ITEM_SIZE)
+    with open(directory / "close", 'r+b') as f:
+        f.truncate(8 * ITEM_SIZE + 3)
+
+    reopened = OHLCStore(str(tmp_path)).get('XAUUSD')
+
+    assert reopened.count == 7
+    for name, _ in COLUMNS:
+        assert os.path.getsize(directory / name) == 7 * ITEM_SIZE
+    assert [list(column) for column in reopened.columns()] == [list(column) for column in zip(*bars[:7])]
+    # Appending goes on from the last complete bar
+    assert reopened.append(bars[7:]) == 3
+    assert reopened.count == 10
+
+
+def test_invalid_symbols_are_refused(tmp_path):
+    store = OHLCStore(str(tmp_path))
+
+    for symbol in ("../etc", "", "A" * 30, "XAU/USD"):
+        with pytest.raises(ohlc_store.OHLCError):
+            store.append(symbol, hourly_bars(START, 1))
+    assert store.get("unknown") is None
@@ -0,0 +1,190 @@
+"""Outbound queue: per-chat order, spacing, retries, back-pressure and shutdown"""
+import asyncio
+import random
+
+import pytest
+
+pytest.importorskip("telegram")
+
+from telegram.error import BadRequest, NetworkError, RetryAfter  # noqa: E402
+
+from broadcast import FAILED, SENT  # noqa: E402
+from outbound import OutboundQueue  # noqa: E402
+from rate_limit import TokenBucket  # noqa: E402
+
+
+class FakeSend:
+    """Records what was sent; errors[chat_id] is a list of exceptions to
+    raise on the next attempts"""
+
+    def __init__(self, clock=None, delay=0.0):
+        self.clock = clock
+        self.delay = delay
+        self.sent = []
+        self.attempts = 0
+        self.errors = {}
+        self.in_flight = set()
+        self.overlapped = False
+
+    async def __call__(self, chat_id, text, **options):
+        self.attempts += 1
+        if chat_id in self.in_flight:
+            self.overlapped = True
+        self.in_flight.add(chat_id)
+        try:
+            if self.delay:
+                await asyncio.sleep(random.random() * self.delay)
+            errors = self.errors.get(chat_id)
+            if errors:
+                raise errors.pop(0)
+            self.sent.append((chat_id, text, self.clock() if self.clock else None))
+        finally:
+            self.in_flight.discard(chat_id)
+
+
+def run(test):
+    return asyncio.run(test())
+
+
+def test_messages_to_a_chat_keep_their_order():
+    async def test():
+        send = FakeSend(delay=0.002)
+        queue = OutboundQueue(send, workers=4)
+        queue.start()
+        for index in range(30):
+            for chat_id in (1, 2, 3):
+                queue.put_nowait(chat_id, f"{chat_id}-{index}")
+        await asyncio.wait_for(queue.idle.wait(), 5)
+        await queue.stop()
+
+        for chat_id in (1, 2, 3):
+            texts = [text for chat, text, _ in send.sent if chat == chat_id]
+            assert texts == [f"{chat_id}-{index}" for index in range(30)]
+        assert not send.overlapped
+    run(test)
+
+
+def test_interval_spaces_messages_to_a_chat():
+    async def test():
+        clock = asyncio.get_running_loop().time
+        send = FakeSend(clock)
+        queue = OutboundQueue(send, workers=3, clock=clock)
+        queue.set_interval(1, 0.05)
+        queue.start()
+        for index in range(4):
+            queue.put_nowait(1, str(index))
+            queue.put_nowait(2, str(index))
+        await asyncio.wait_for(queue.idle.wait(), 5)
+        await queue.stop()
+
+        spaced = [when for chat, _, when in send.sent if chat == 1]
+        assert len(spaced) == 4
+        assert all(later - earlier >= 0.049 for earlier, later in zip(spaced, spaced[1:]))
+        # Chats without an interval are not held back
+        unspaced = [when for chat, _, when in send.sent if chat == 2]
+        assert unspaced[-1] - unspaced[0] < 0.05
+    run(test)
+
+
+def test_retry_after_is_retried_and_pauses_the_bucket():
+    async def test():
+        outcomes = []
+        send = FakeSend()
+        send.errors[1] = [RetryAfter(0.01)]
+        bucket = TokenBucket(1000)
+        queue = OutboundQueue(send, workers=1, bucket=bucket)
+        queue.start()
+        queue.put_nowait(1, "hi", outcomes.append)
+        await asyncio.wait_for(queue.idle.wait(), 5)
+        await queue.stop()
+
+        assert outcomes == [SENT]
+        assert send.attempts == 2
+        assert bucket.blocked_until > 0
+    run(test)
+
+
+def test_transient_errors_back_off_then_fail(monkeypatch):
+    sleep = asyncio.sleep
+    waits = []
+
+    async def fake_sleep(seconds):
+        waits.append(seconds)
+        await sleep(0)
+
+    async def test():
+        outcomes = []
+        send = FakeSend()
+        send.errors[1] = [NetworkError("connection reset") for _ in range(4)]
+        queue = OutboundQueue(send, workers=1, max_attempts=4)
+        queue.start()
+        queue.put_nowait(1, "hi", outcomes.append)
+        with monkeypatch.context() as patch:
+            patch.setattr(asyncio, 'sleep', fake_sleep)
+            await asyncio.wait_for(queue.idle.wait(), 5)
+        await queue.stop()
+
+        assert outcomes == [FAILED]
+        assert send.attempts == 4
+        assert waits == [1, 2, 4]
+    run(test)
+
+
+def test_permanent_error_is_not_retried():
+    async def test():
+        outcomes = []
+        send = FakeSend()
+        send.errors[1] = [BadRequest("message is too long")]
+        queue = OutboundQueue(send, workers=1)
+        queue.start()
+        queue.put_nowait(1, "hi", outcomes.append)
+        queue.put_nowait(1, "next", outcomes.append)
+        await asyncio.wait_for(queue.idle.wait(), 5)
+        await queue.stop()
+
+        assert outcomes == [FAILED, SENT]
+        assert send.attempts == 2
+    run(test)
+
+
+def test_full_queue_pushes_back():
+    async def test():
+        send = FakeSend()
+        queue = OutboundQueue(send, workers=1, max_size=2)
+        queue.put_nowait(1, "a")
+        queue.put_nowait(2, "b")
+        with pytest.raises(asyncio.QueueFull):
+            queue.put_nowait(3, "c")
+
+        waiting = asyncio.create_task(queue.put(3, "c"))
+        await asyncio.sleep(0.01)
+        assert not waiting.done()
+
+        queue.start()
+        await asyncio.wait_for(waiting, 5)
+        await asyncio.wait_for(queue.idle.wait(), 5)
+        await queue.stop()
+        assert sorted(text for _, text, _ in send.sent) == ["a", "b", "c"]
+    run(test)
+
+
+def test_stop_fails_what_is_left_once():
+    async def test():
+        outcomes = []
+        blocked = asyncio.Event()
+
+        async def send(chat_id, text, **options):
+            await blocked.wait()
+
+        queue = OutboundQueue(send, workers=2)
+        queue.start()
+        for index in range(3):
+            queue.put_nowait(1, str(index), lambda outcome, index=index: outcomes.append((index, outcome)))
+        queue.put_nowait(2, "x", lambda outcome: outcomes.append(("x", outcome)))
+        await asyncio.sleep(0.01)
+        await queue.stop(timeout=0.05)
+
+        assert sorted(outcomes, key=str) == sorted([(0, FAILED), (1, FAILED), (2, FAILED), ("x", FAILED)], key=str)
+        assert queue.size == 0
+        assert queue.idle.is_set()
+    run(test)
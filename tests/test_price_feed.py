@@ -0,0 +1,203 @@
+"""Tick parsing, live sessions, level touches and the file feed"""
+import asyncio
+import random
+import time
+
+import pytest
+
+from ohlc_store import DAY, OHLCStore
+from pivot_engine import compute_levels
+from price_feed import FileTailFeed, TickProcessor, parse_tick
+
+
+def test_tick_is_parsed():
+    assert parse_tick(" xauusd ,2350.5,1700000000\n") == ('XAUUSD', 2350.5, 1700000000.0)
+    assert parse_tick("XAUUSD,2350.5") == ('XAUUSD', 2350.5, None)
+    assert parse_tick("XAUUSD,2350.5,") == ('XAUUSD', 2350.5, None)
+
+
+@pytest.mark.parametrize("line", [
+    "XAUUSD,nan", "XAUUSD,inf", "XAUUSD,-inf", "XAUUSD,0", "XAUUSD,-1", "XAUUSD,1e400",
+    "XAUUSD,2350,nan", "XAUUSD,2350,inf", "XAUUSD,2350,-5", "XAUUSD,2350,0",
+    "XAUUSD", "XAUUSD,1,2,3", "XAUUSD,abc",
+])
+def test_invalid_tick_is_refused(line):
+    with pytest.raises(ValueError):
+        parse_tick(line)
+
+
+def test_invalid_ticks_are_counted_not_processed():
+    prices = []
+    processor = TickProcessor(on_price=lambda symbol, price: prices.append(price), clock=lambda: 1700000000)
+
+    assert processor.process_lines(["XAUUSD,2350", "XAUUSD,nan", "XAUUSD,inf,1700000001", "XAUUSD,2351"]) == 2
+    assert processor.bad_ticks == 2
+    assert prices == [2350.0, 2351.0]
+    assert processor.sessions['XAUUSD'].high == 2351.0
+
+
+def day_ticks(start, count, seed):
+    """A day of ticks one minute apart, swinging widely in the first half"""
+    rng = random.Random(seed)
+    ticks = []
+    price = 2000.0
+    for index in range(count):
+        price += rng.gauss(0, 5 if index < count // 2 else 0.5)
+        ticks.append((price, start + index * 60))
+    return ticks
+
+
+def test_session_survives_a_restart(tmp_path):
+    start = 1700006400 - 1700006400 % DAY
+    ticks = day_ticks(start, 600, seed=3)
+    next_day = start + DAY + 60
+
+    def run(processors):
+        sessions = []
+        for processor, part in processors:
+            processor.on_session = lambda symbol, bar, levels: sessions.append((bar, levels))
+            for price, timestamp in part:
+                processor.process('XAUUSD', price, timestamp)
+            processor.flush()
+        processor.process('XAUUSD', ticks[-1][0], next_day)
+        return sessions
+
+    uninterrupted = run([(TickProcessor(store=OHLCStore(str(tmp_path / "a"))), ticks)])
+    # The bot restarts halfway, the second process reopens the store
+    restarted = run([
+        (TickProcessor(store=OHLCStore(str(tmp_path / "b"))), ticks[:300]),
+        (TickProcessor(store=OHLCStore(str(tmp_path / "b"))), ticks[300:]),
+    ])
+
+    assert len(uninterrupted) == len(restarted) == 1
+    assert restarted[0][0] == pytest.approx(uninterrupted[0][0])
+    assert restarted[0][1] == pytest.approx(uninterrupted[0][1])
+
+
+LEVELS = {'s1': 95.0, 'pivot': 100.0, 'r1': 105.0}
+START = 1700006400 - 1700006400 % DAY
+
+
+def with_levels(**kwargs):
+    """Processor already in a session with LEVELS, and the touches it reports"""
+    touches = []
+    processor = TickProcessor(on_touch=lambda symbol, name, level, price: touches.append((name, price)),
+                              clock=lambda: START + 60, **kwargs)
+    processor.process('XAUUSD', 101.0, START)
+    processor.sessions['XAUUSD'].set_levels(LEVELS)
+    return processor, touches
+
+
+def test_crossing_levels_up_and_down():
+    processor, touches = with_levels()
+    processor.process('XAUUSD', 106.0)
+    processor.process('XAUUSD', 94.0)
+
+    assert touches[0] == ('r1', 106.0)
+    assert sorted(touches[1:]) == [('pivot', 94.0), ('s1', 94.0)]
+
+
+def test_landing_on_a_level_touches_it_once():
+    processor, touches = with_levels()
+    processor.process('XAUUSD', 100.0)
+    processor.process('XAUUSD', 100.0)
+    processor.process('XAUUSD', 102.0)
+    processor.process('XAUUSD', 99.0)
+
+    assert touches == [('pivot', 100.0)]
+
+
+def test_first_tick_of_a_session_touches_nothing():
+    touches = []
+    processor = TickProcessor(on_touch=lambda *touch: touches.append(touch))
+    processor.process('XAUUSD', 100.0, START)
+    processor.sessions['XAUUSD'].set_levels(LEVELS)
+    processor.process('XAUUSD', 110.0, START + DAY)
+
+    assert touches == []
+
+
+def test_levels_are_recomputed_at_session_close():
+    sessions = []
+    processor = TickProcessor(on_session=lambda symbol, bar, levels: sessions.append((bar, levels)))
+    for offset, price in enumerate((100.0, 108.0, 97.0, 103.0)):
+        processor.process('XAUUSD', price, START + offset * 60)
+    processor.process('XAUUSD', 104.0, START + DAY)
+
+    assert sessions == [((100.0, 108.0, 97.0, 103.0), compute_levels(108.0, 97.0, 103.0, 'classic', 100.0))]
+    assert processor.levels('XAUUSD') == sessions[0][1]
+    session = processor.sessions['XAUUSD']
+    assert (session.open, session.high, session.low, session.close) == (104.0, 104.0, 104.0, 104.0)
+
+
+def test_late_tick_from_a_closed_session_is_dropped():
+    processor = TickProcessor()
+    processor.process('XAUUSD', 100.0, START)
+    processor.process('XAUUSD', 101.0, START + DAY)
+    processor.process('XAUUSD', 150.0, START + DAY - 1)
+
+    session = processor.sessions['XAUUSD']
+    assert (session.high, session.close) == (101.0, 101.0)
+
+
+def test_minute_bars_are_stored(tmp_path):
+    store = OHLCStore(str(tmp_path))
+    processor = TickProcessor(store=store)
+    for timestamp, price in ((START, 100.0), (START + 20, 102.0), (START + 40, 99.0),
+                             (START + 60, 101.0), (START + 130, 103.0)):
+        processor.process('XAUUSD', price, timestamp)
+
+    # A bar is stored once the next one starts
+    assert store.get('XAUUSD').count == 2
+    processor.flush()
+    series = store.get('XAUUSD')
+    assert [list(column) for column in series.columns()] == [
+        [START, START + 60, START + 120],
+        [100.0, 101.0, 103.0],
+        [102.0, 101.0, 103.0],
+        [99.0, 101.0, 103.0],
+        [99.0, 101.0, 103.0],
+    ]
+
+
+def test_file_feed_keeps_a_partial_line_for_the_next_batch(tmp_path):
+    path = tmp_path / "ticks.csv"
+    path.write_bytes(b"XAUUSD,1\nXAUUSD,2\nXAU")
+
+    async def read():
+        batches = FileTailFeed(str(path), poll_interval=0.01, from_start=True).batches()
+        first = await batches.__anext__()
+        with open(path, 'ab') as f:
+            f.write(b"USD,3\n")
+        second = await batches.__anext__()
+        await batches.aclose()
+        return first, second
+
+    assert asyncio.run(read()) == (["XAUUSD,1", "XAUUSD,2"], ["XAUUSD,3"])
+
+
+def test_file_feed_starts_at_the_end(tmp_path):
+    path = tmp_path / "ticks.csv"
+    path.write_bytes(b"XAUUSD,1\n")
+
+    async def read():
+        batches = FileTailFeed(str(path), poll_interval=0.01).batches()
+        pending = asyncio.ensure_future(batches.__anext__())
+        await asyncio.sleep(0.05)
+        with open(path, 'ab') as f:
+            f.write(b"XAUUSD,2\n")
+        batch = await asyncio.wait_for(pending, 2)
+        await batches.aclose()
+        return batch
+
+    assert asyncio.run(read()) == ["XAUUSD,2"]
+
+
+def test_ticks_are_processed_quickly():
+    processor, touches = with_levels()
+    lines = [f"XAUUSD,{100 + (index % 200 - 100) * 0.07:.2f},{START + index}" for index in range(5000)]
+
+    started = time.perf_counter()
+    assert processor.process_lines(lines) == 5000
+    assert time.perf_counter() - started < 0.5
+    assert {name for name, _ in touches} == set(LEVELS)
@@ -0,0 +1,122 @@
+"""Token buckets and per-key rate limits"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from rate_limit import KeyedRateLimiter, TokenBucket, parse_limit
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_bucket_allows_a_burst_then_refills():
+    clock = FakeClock()
+    bucket = TokenBucket(2, capacity=3, clock=clock)
+
+    assert [bucket.try_acquire() for _ in range(4)] == [True, True, True, False]
+    assert bucket.delay() == pytest.approx(0.5)
+    clock.now += 0.5
+    assert bucket.try_acquire()
+    clock.now += 100
+    assert [bucket.try_acquire() for _ in range(4)] == [True, True, True, False]
+
+
+def test_pause_blocks_the_bucket():
+    clock = FakeClock()
+    bucket = TokenBucket(10, clock=clock)
+    bucket.pause(5)
+
+    assert bucket.delay() == pytest.approx(5)
+    assert not bucket.try_acquire()
+    clock.now += 5
+    assert bucket.try_acquire()
+
+
+def test_acquire_waits_for_a_token():
+    async def test():
+        bucket = TokenBucket(50, capacity=1)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        for _ in range(3):
+            await bucket.acquire()
+        return loop.time() - started
+
+    assert asyncio.run(test()) >= 0.035
+
+
+@pytest.mark.parametrize("text, limit", [("5/10", (0.5, 5.0)), ("3", (3.0, 3.0)), ("30/1", (30.0, 30.0))])
+def test_limits_are_parsed(text, limit):
+    assert parse_limit(text) == limit
+
+
+@pytest.mark.parametrize("text", ["0/10", "5/0", "-1", "x/1"])
+def test_invalid_limits_are_refused(text):
+    with pytest.raises(ValueError):
+        parse_limit(text)
+
+
+def test_keys_refill_over_time():
+    clock = FakeClock()
+    limiter = KeyedRateLimiter(0.5, capacity=2, clock=clock)
+
+    assert [limiter.hit(1) for _ in range(4)] == [(True, False), (True, False), (False, True), (False, False)]
+    assert limiter.hit(2) == (True, False)
+    clock.now += 2
+    assert limiter.hit(1) == (True, False)
+    assert limiter.hit(1) == (False, True)
+    clock.now += 100
+    assert [limiter.hit(1)[0] for _ in range(3)] == [True, True, False]
+    assert (limiter.allowed, limiter.denied) == (6, 4)
+
+
+def test_least_recently_used_key_is_evicted():
+    clock = FakeClock()
+    limiter = KeyedRateLimiter(1 / 60, capacity=1, max_keys=2, clock=clock)
+    limiter.hit('a')
+    limiter.hit('b')
+    limiter.hit('a')
+    limiter.hit('c')
+
+    assert list(limiter.buckets) == ['a', 'c']
+    assert len(limiter) == 2
+    assert limiter.hit('a') == (False, False)
+    # An evicted key starts over with a full bucket
+    assert limiter.hit('b') == (True, False)
+    assert list(limiter.buckets) == ['a', 'b']
+
+
+def message_update(user_id, text=None, document=None):
+    message = SimpleNamespace(from_user=SimpleNamespace(id=user_id), text=text, document=document)
+    return SimpleNamespace(callback_query=None, message=message)
+
+
+def test_commands_and_calculations_have_separate_limits(monkeypatch):
+    pytest.importorskip("telegram")
+    import main
+
+    clock = FakeClock()
+    monkeypatch.setattr(main, 'registered_commands', {'help', 'scalp'})
+    monkeypatch.setattr(main, 'rate_limiters', {
+        kind: KeyedRateLimiter(*parse_limit(limit), clock=clock) for kind, limit in
+        {'calculate': "2/60", 'command': "2/60", 'callback': "2/60"}.items()
+    })
+
+    def allowed(update):
+        kind, key = main.rate_limit_key(update)
+        return main.rate_limiters[kind].hit(key)[0]
+
+    assert [allowed(message_update(1, "2400 2380 2390")) for _ in range(3)] == [True, True, False]
+    # Each registered command has its own bucket, unaffected by calculations
+    assert [allowed(message_update(1, "/help")) for _ in range(3)] == [True, True, False]
+    assert allowed(message_update(1, "/scalp@PivotBot now"))
+    # Unknown commands share one bucket
+    assert [allowed(message_update(1, f"/made_up_{index}")) for index in range(3)] == [True, True, False]
+    assert allowed(message_update(2, "2400 2380 2390"))
+    assert main.rate_limit_key(message_update(1, document=object())) == ('calculate', 1)
+    assert main.rate_limit_key(message_update(1)) is None
@@ -0,0 +1,96 @@
+"""Loading, migrating and validating settings snapshots"""
+import json
+
+import pytest
+
+import settings_model
+from user_store import to_epoch
+
+DEFAULT_TEXTS = {'welcome_message': "default welcome", 'help_message': "default help"}
+
+# Schema 1: no version, string ids next to int ids, user 42 saved twice
+LEGACY = """{
+    "active": true,
+    "owner_only": false,
+    "allowed_users": [1, "1", 2],
+    "blocked_users": [],
+    "privileged_users": ["5"],
+    "total_calculations": 7,
+    "user_stats": {
+        "42": {"username": "a", "first_name": "A", "calculations": 3,
+               "first_use": "2024-01-01T10:00:00", "last_seen": "2024-01-02T10:00:00"},
+        "42": {"username": "b", "first_name": "B", "calculations": 2,
+               "first_use": "2023-12-01T10:00:00", "last_seen": "2024-02-01T10:00:00"},
+        "7": {"username": null, "first_name": "X", "calculations": 1,
+              "first_use": "2024-01-01T10:00:00", "last_seen": "2024-01-01T10:00:00"}
+    },
+    "channel_id": "@chan",
+    "channel_username": "chan",
+    "pivot_methods": {"42": "fibonacci"},
+    "custom_texts": {"welcome_message": "hi", "bogus": "x"},
+    "journal_seq": 5
+}"""
+
+
+def full_settings(loaded):
+    """Loaded fields on top of the fields every snapshot carries"""
+    settings = {
+        'level_watchers': {},
+        'strategy': {trade_type: {'stop_cap': 25.0, 'entry_depth': 0.0, 'target': 3}
+                     for trade_type in ('scalp', 'swing')}
+    }
+    settings.update(loaded)
+    return settings
+
+
+def test_legacy_ids_become_ints():
+    settings, journal_seq = settings_model.load(LEGACY, DEFAULT_TEXTS)
+
+    assert journal_seq == 5
+    assert settings['allowed_users'] == {1, 2}
+    assert settings['privileged_users'] == {5}
+    assert settings['pivot_methods'] == {42: 'fibonacci'}
+    assert sorted(settings['user_stats']) == [7, 42]
+
+
+def test_legacy_duplicate_users_are_merged():
+    settings, _ = settings_model.load(LEGACY, DEFAULT_TEXTS)
+    record = settings['user_stats'][42]
+
+    assert record.calculations == 5
+    assert record.first_use == to_epoch("2023-12-01T10:00:00")
+    assert record.last_seen == to_epoch("2024-02-01T10:00:00")
+    # Names come from the most recently seen entry
+    assert record.username == 'b'
+    assert record.first_name == 'B'
+
+
+def test_custom_texts_merge_over_defaults():
+    settings, _ = settings_model.load(LEGACY, DEFAULT_TEXTS)
+
+    assert settings['custom_texts'] == {'welcome_message': "hi", 'help_message': "default help"}
+
+
+def test_migrated_snapshot_round_trips():
+    settings, journal_seq = settings_model.load(LEGACY, DEFAULT_TEXTS)
+    snapshot = json.loads(json.dumps(settings_model.dump(full_settings(settings), journal_seq)))
+
+    assert snapshot['schema_version'] == settings_model.SCHEMA_VERSION
+    reloaded, reloaded_seq = settings_model.load(json.dumps(snapshot), DEFAULT_TEXTS)
+    assert reloaded_seq == journal_seq
+    assert reloaded['allowed_users'] == settings['allowed_users']
+    assert reloaded['pivot_methods'] == settings['pivot_methods']
+    assert reloaded['user_stats'][42].calculations == 5
+
+
+def test_newer_schema_is_refused():
+    with pytest.raises(settings_model.UnsupportedSchema):
+        settings_model.load('{"schema_version": %d}' % (settings_model.SCHEMA_VERSION + 1), DEFAULT_TEXTS)
+
+
+def test_invalid_fields_keep_their_current_value():
+    settings, _ = settings_model.load(
+        '{"schema_version": 2, "active": "yes", "total_calculations": -1, "owner_only": true}', DEFAULT_TEXTS
+    )
+
+    assert settings == {'owner_only': True}
@@ -0,0 +1,186 @@
+"""The webhook HTTP server, driven over real connections on an ephemeral port"""
+import asyncio
+import json
+
+import pytest
+
+import webhook_server
+from webhook_server import WebhookServer, post_updates
+
+SECRET = "s3cret"
+
+
+class FakeApplication:
+    def __init__(self, running=True):
+        self.running = running
+        self.bot = None
+        self.update_queue = asyncio.Queue()
+
+
+def serve(test, running=True, **kwargs):
+    """Run test(server, port) against a server started on a free port"""
+    async def main():
+        server = WebhookServer(FakeApplication(running), "/webhook", SECRET, **kwargs)
+        await server.start("127.0.0.1", 0)
+        port = server.server.sockets[0].getsockname()[1]
+        try:
+            return await test(server, port)
+        finally:
+            await server.stop()
+    return asyncio.run(main())
+
+
+async def read_response(reader):
+    """(status, headers, body) of one response"""
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode('latin-1')
+        if line in ("\r\n", ""):
+            break
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get('content-length', 0)))
+    return status, headers, body
+
+
+def post(body, secret=SECRET, path="/webhook", length=None):
+    headers = f"POST {path} HTTP/1.1\r\nHost: test\r\n"
+    if secret is not None:
+        headers += f"X-Telegram-Bot-Api-Secret-Token: {secret}\r\n"
+    if length != 'omit':
+        headers += f"Content-Length: {len(body) if length is None else length}\r\n"
+    return (headers + "\r\n").encode('latin-1') + body
+
+
+async def exchange(port, *requests):
+    """Send requests on one connection, returns their responses"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        responses = []
+        for request in requests:
+            writer.write(request)
+            await writer.drain()
+            responses.append(await read_response(reader))
+        return responses
+    finally:
+        writer.close()
+
+
+@pytest.mark.parametrize("secret", [None, "", "wrong", SECRET + "x"])
+def test_update_without_the_secret_is_forbidden(secret):
+    async def test(server, port):
+        (status, _, _), = await exchange(port, post(b'{"update_id": 1}', secret))
+        assert status == 403
+        assert server.stats['rejected'] == 1
+        assert server.application.update_queue.empty()
+    serve(test)
+
+
+def test_server_refuses_to_run_without_a_secret():
+    with pytest.raises(ValueError):
+        WebhookServer(FakeApplication(), "/webhook")
+
+
+def test_missing_length_is_refused():
+    async def test(server, port):
+        (status, headers, _), = await exchange(port, post(b"{}", length='omit'))
+        assert status == 411
+        assert headers['connection'] == 'close'
+    serve(test)
+
+
+def test_large_body_is_refused():
+    async def test(server, port):
+        (status, _, _), = await exchange(port, post(b"", length=webhook_server.MAX_BODY_SIZE + 1))
+        assert status == 413
+    serve(test)
+
+
+def test_unknown_path_and_method():
+    async def test(server, port):
+        responses = await exchange(
+            port,
+            b"GET /nowhere HTTP/1.1\r\n\r\n",
+            b"GET /webhook HTTP/1.1\r\n\r\n"
+        )
+        assert [status for status, _, _ in responses] == [404, 405]
+    serve(test)
+
+
+def test_connection_is_kept_alive():
+    async def test(server, port):
+        request = b"GET /healthz HTTP/1.1\r\nHost: test\r\n\r\n"
+        responses = await exchange(port, request, request)
+        assert [status for status, _, _ in responses] == [200, 200]
+        assert responses[0][1]['connection'] == 'keep-alive'
+    serve(test)
+
+
+def test_connection_close_is_honoured():
+    async def test(server, port):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"GET /healthz HTTP/1.1\r\nConnection: close\r\n\r\n")
+        status, headers, _ = await read_response(reader)
+        assert (status, headers['connection']) == (200, 'close')
+        assert await reader.read() == b""
+        writer.close()
+    serve(test)
+
+
+@pytest.mark.parametrize("running, expected", [(True, 200), (False, 503)])
+def test_health(running, expected):
+    async def test(server, port):
+        (status, _, body), = await exchange(port, b"GET /healthz HTTP/1.1\r\n\r\n")
+        assert status == expected
+        assert json.loads(body)['status'] == ("ok" if running else "stopped")
+    serve(test, running)
+
+
+def test_stalled_request_is_dropped(monkeypatch):
+    monkeypatch.setattr(webhook_server, 'REQUEST_TIMEOUT', 0.2)
+
+    async def test(server, port):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        # Promises a body that never comes
+        writer.write(post(b"", length=1000))
+        await writer.drain()
+        assert await asyncio.wait_for(reader.read(), 2) == b""
+        writer.close()
+    serve(test)
+
+
+def test_connections_over_the_limit_get_503():
+    async def test(server, port):
+        idle = [await asyncio.open_connection("127.0.0.1", port) for _ in range(2)]
+        # Let the server accept them
+        await asyncio.sleep(0.05)
+        (status, _, _), = await exchange(port, b"GET /healthz HTTP/1.1\r\n\r\n")
+        assert status == 503
+        assert server.stats['busy'] == 1
+        for _, writer in idle:
+            writer.close()
+    serve(test, max_connections=2)
+
+
+def test_post_updates_is_refused_with_a_wrong_secret(tmp_path):
+    path = tmp_path / "updates.jsonl"
+    path.write_text('{"update_id": 1}\n{"update_id": 2}\n', encoding='utf-8')
+
+    async def test(server, port):
+        url = f"http://127.0.0.1:{port}/webhook"
+        return await asyncio.to_thread(post_updates, url, [str(path)], "wrong")
+    assert serve(test) == [403, 403]
+
+
+def test_post_updates_round_trip(tmp_path):
+    pytest.importorskip("telegram")
+    path = tmp_path / "updates.json"
+    path.write_text(json.dumps([{"update_id": 1}, {"update_id": 2}]), encoding='utf-8')
+
+    async def test(server, port):
+        url = f"http://127.0.0.1:{port}/webhook"
+        statuses = await asyncio.to_thread(post_updates, url, [str(path)], SECRET)
+        updates = [server.application.update_queue.get_nowait() for _ in range(2)]
+        return statuses, [update.update_id for update in updates], server.stats['updates']
+    assert serve(test) == ([200, 200], [1, 2], 2)
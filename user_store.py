@@ -0,0 +1,372 @@
+"""User statistics storage backends
+
+Both stores expose the same small interface so the bot can switch between
+the in-memory dict kept in bot_settings (persisted through the settings
+snapshot/journal) and a SQLite database with indexed columns.
+"""
+import datetime
+import heapq
+import sqlite3
+import sys
+import threading
+
+# Broadcast delivery outcomes, see broadcast.py
+SENT, FAILED, DEAD = "sent", "failed", "dead"
+
+
+def to_epoch(timestamp):
+    """Epoch seconds from an int or a legacy ISO timestamp string"""
+    if timestamp is None or timestamp == '':
+        return 0
+    if isinstance(timestamp, str):
+        return int(datetime.datetime.fromisoformat(timestamp).timestamp())
+    return int(timestamp)
+
+
+def to_iso(epoch):
+    """ISO timestamp string (local time) of epoch seconds"""
+    return datetime.datetime.fromtimestamp(epoch).isoformat() if epoch else ''
+
+
+def intern_name(name):
+    return sys.intern(name) if name else name
+
+
+class UserRecord:
+    """Stats of one user, less than half the memory of the dict it replaces"""
+
+    __slots__ = ('username', 'first_name', 'calculations', 'first_use', 'last_seen', 'failures', 'unreachable')
+
+    def __init__(self, username, first_name, calculations=0, first_use=0, last_seen=0, failures=0, unreachable=False):
+        self.username = intern_name(username)
+        self.first_name = intern_name(first_name)
+        self.calculations = calculations
+        self.first_use = first_use
+        self.last_seen = last_seen
+        self.failures = failures
+        self.unreachable = unreachable
+
+    def to_row(self):
+        """Compact JSON form, see UserTable"""
+        return [
+            self.username, self.first_name, self.calculations, self.first_use,
+            self.last_seen, self.failures, 1 if self.unreachable else 0
+        ]
+
+    @classmethod
+    def from_row(cls, row):
+        """Read a row, or a dict written by older versions"""
+        if isinstance(row, dict):
+            first_use = to_epoch(row.get('first_use'))
+            return cls(
+                row.get('username'),
+                row.get('first_name'),
+                int(row.get('calculations', 0)),
+                first_use,
+                to_epoch(row.get('last_seen')) or first_use,
+                int(row.get('failures', 0)),
+                bool(row.get('unreachable'))
+            )
+        username, first_name, calculations, first_use, last_seen, failures, unreachable = row
+        return cls(username, first_name, calculations, first_use, last_seen, failures, bool(unreachable))
+
+    def as_dict(self):
+        """Same shape as SqliteUserStore.get()"""
+        return {
+            'username': self.username,
+            'first_name': self.first_name,
+            'calculations': self.calculations,
+            'first_use': to_iso(self.first_use),
+            'last_seen': to_iso(self.last_seen),
+            'failures': self.failures,
+            'unreachable': self.unreachable
+        }
+
+
+class UserTable(dict):
+    """user_id -> UserRecord, serialized as {"user_id": row} with list rows"""
+
+    def to_json(self):
+        return {str(user_id): record.to_row() for user_id, record in self.items()}
+
+    @classmethod
+    def from_json(cls, data):
+        return cls((int(user_id), UserRecord.from_row(row)) for user_id, row in data.items())
+
+
+class MemoryUserStore:
+    """User stats kept in bot_settings['user_stats'] as a UserTable"""
+
+    journaled = True
+
+    def __init__(self, settings):
+        # load_settings() replaces the table, so always go through settings
+        self.settings = settings
+
+    @property
+    def users(self):
+        return self.settings['user_stats']
+
+    def record_use(self, user_id, username, first_name, timestamp):
+        """Count one calculation for a user"""
+        timestamp = to_epoch(timestamp)
+        users = self.users
+        record = users.get(user_id)
+        if record is None:
+            record = users[user_id] = UserRecord(username, first_name, 0, timestamp)
+        else:
+            if username != record.username:
+                record.username = intern_name(username)
+            if first_name and first_name != record.first_name:
+                record.first_name = intern_name(first_name)
+
+        record.calculations += 1
+        record.last_seen = timestamp
+        if record.unreachable or record.failures:
+            # The user talked to the bot again, so the chat works
+            record.unreachable = False
+            record.failures = 0
+        self.settings['total_calculations'] += 1
+
+    def record_delivery(self, user_id, outcome):
+        """Track a broadcast delivery outcome, returns True if anything changed"""
+        record = self.users.get(user_id)
+        if record is None:
+            return False
+
+        if outcome == SENT:
+            if not record.failures and not record.unreachable:
+                return False
+            record.failures = 0
+            record.unreachable = False
+        elif outcome == DEAD:
+            if record.unreachable:
+                return False
+            record.failures += 1
+            record.unreachable = True
+        else:
+            record.failures += 1
+        return True
+
+    def get(self, user_id):
+        """Return the stats dict of a user or None"""
+        record = self.users.get(user_id)
+        return record.as_dict() if record is not None else None
+
+    def username(self, user_id, default=None):
+        """Return the stored username of a user"""
+        record = self.users.get(user_id)
+        if record is None:
+            return default
+        return record.username or default
+
+    def __contains__(self, user_id):
+        return user_id in self.users
+
+    def count(self):
+        """Number of known users"""
+        return len(self.users)
+
+    def total_calculations(self):
+        """Total calculations made by all users"""
+        return self.settings['total_calculations']
+
+    def top_users(self, limit=5):
+        """Most active users as (user_id, stats) pairs"""
+        top = heapq.nlargest(limit, self.users.items(), key=lambda item: item[1].calculations)
+        return [(user_id, record.as_dict()) for user_id, record in top]
+
+    def reachable_count(self):
+        """Number of users that can still receive broadcasts"""
+        return sum(1 for record in self.users.values() if not record.unreachable)
+
+    def iter_user_ids(self, batch_size=500, reachable_only=False):
+        """Yield every known user id"""
+        # Copy so the table may change while a broadcast is running
+        if reachable_only:
+            yield from [user_id for user_id, record in self.users.items() if not record.unreachable]
+        else:
+            yield from list(self.users.keys())
+
+    def close(self):
+        pass
+
+
+class SqliteUserStore:
+    """User stats in a SQLite database (WAL mode) with indexed columns"""
+
+    journaled = False
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            calculations INTEGER NOT NULL DEFAULT 0,
+            first_use TEXT NOT NULL,
+            last_seen TEXT NOT NULL,
+            failures INTEGER NOT NULL DEFAULT 0,
+            unreachable INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS idx_users_calculations ON users(calculations);
+        CREATE INDEX IF NOT EXISTS idx_users_first_use ON users(first_use);
+        CREATE INDEX IF NOT EXISTS idx_users_last_seen ON users(last_seen);
+        CREATE INDEX IF NOT EXISTS idx_users_unreachable ON users(unreachable, user_id);
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+        INSERT OR IGNORE INTO meta (key, value) VALUES ('total_calculations', 0);
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.migrate()
+        self.db.executescript(self.SCHEMA)
+        self.db.commit()
+
+    def migrate(self):
+        """Add columns missing from databases created by older versions"""
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(users)")}
+        if not columns:
+            return
+        if 'failures' not in columns:
+            self.db.execute("ALTER TABLE users ADD COLUMN failures INTEGER NOT NULL DEFAULT 0")
+        if 'unreachable' not in columns:
+            self.db.execute("ALTER TABLE users ADD COLUMN unreachable INTEGER NOT NULL DEFAULT 0")
+
+    def record_use(self, user_id, username, first_name, timestamp):
+        """Count one calculation for a user"""
+        timestamp = to_iso(to_epoch(timestamp))
+        with self.lock, self.db:
+            self.db.execute(
+                """INSERT INTO users (user_id, username, first_name, calculations, first_use, last_seen)
+                   VALUES (?, ?, ?, 1, ?, ?)
+                   ON CONFLICT(user_id) DO UPDATE SET
+                       username = excluded.username,
+                       first_name = COALESCE(excluded.first_name, users.first_name),
+                       calculations = users.calculations + 1,
+                       last_seen = excluded.last_seen,
+                       failures = 0,
+                       unreachable = 0""",
+                (user_id, username, first_name, timestamp, timestamp)
+            )
+            self.db.execute("UPDATE meta SET value = value + 1 WHERE key = 'total_calculations'")
+
+    def import_users(self, users):
+        """Merge a UserTable (or its legacy dict-of-dicts form) into the database"""
+        rows = []
+        total = 0
+        for user_id, record in users.items():
+            if not isinstance(record, UserRecord):
+                record = UserRecord.from_row(record)
+            total += record.calculations
+            rows.append((
+                int(user_id),
+                record.username,
+                record.first_name,
+                record.calculations,
+                to_iso(record.first_use),
+                to_iso(record.last_seen or record.first_use),
+                record.failures,
+                1 if record.unreachable else 0
+            ))
+
+        with self.lock, self.db:
+            self.db.executemany(
+                """INSERT INTO users (user_id, username, first_name, calculations, first_use, last_seen, failures, unreachable)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(user_id) DO UPDATE SET
+                       username = COALESCE(excluded.username, users.username),
+                       first_name = COALESCE(excluded.first_name, users.first_name),
+                       calculations = users.calculations + excluded.calculations,
+                       first_use = MIN(users.first_use, excluded.first_use),
+                       last_seen = MAX(users.last_seen, excluded.last_seen)""",
+                rows
+            )
+            self.db.execute("UPDATE meta SET value = value + ? WHERE key = 'total_calculations'", (total,))
+        return len(rows)
+
+    def record_delivery(self, user_id, outcome):
+        """Track a broadcast delivery outcome, returns True if anything changed"""
+        if outcome == SENT:
+            sql = "UPDATE users SET failures = 0, unreachable = 0 WHERE user_id = ? AND (failures > 0 OR unreachable = 1)"
+        elif outcome == DEAD:
+            sql = "UPDATE users SET failures = failures + 1, unreachable = 1 WHERE user_id = ? AND unreachable = 0"
+        else:
+            sql = "UPDATE users SET failures = failures + 1 WHERE user_id = ?"
+        with self.lock, self.db:
+            return self.db.execute(sql, (user_id,)).rowcount > 0
+
+    def get(self, user_id):
+        """Return the stats dict of a user or None"""
+        with self.lock:
+            row = self.db.execute(
+                """SELECT username, first_name, calculations, first_use, last_seen, failures, unreachable
+                   FROM users WHERE user_id = ?""",
+                (user_id,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def username(self, user_id, default=None):
+        """Return the stored username of a user"""
+        with self.lock:
+            row = self.db.execute("SELECT username FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None:
+            return default
+        return row[0] or default
+
+    def __contains__(self, user_id):
+        with self.lock:
+            row = self.db.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        return row is not None
+
+    def count(self):
+        """Number of known users"""
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def reachable_count(self):
+        """Number of users that can still receive broadcasts"""
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM users WHERE unreachable = 0").fetchone()[0]
+
+    def total_calculations(self):
+        """Total calculations made by all users"""
+        with self.lock:
+            return self.db.execute("SELECT value FROM meta WHERE key = 'total_calculations'").fetchone()[0]
+
+    def top_users(self, limit=5):
+        """Most active users as (user_id, stats) pairs, read from the index"""
+        with self.lock:
+            rows = self.db.execute(
+                """SELECT user_id, username, first_name, calculations, first_use, last_seen
+                   FROM users ORDER BY calculations DESC LIMIT ?""",
+                (limit,)
+            ).fetchall()
+        return [(row['user_id'], dict(row)) for row in rows]
+
+    def iter_user_ids(self, batch_size=500, reachable_only=False):
+        """Yield every known user id using keyset pagination"""
+        condition = "AND unreachable = 0" if reachable_only else ""
+        last_id = -(2 ** 63)
+        while True:
+            with self.lock:
+                rows = self.db.execute(
+                    f"SELECT user_id FROM users WHERE user_id > ? {condition} ORDER BY user_id LIMIT ?",
+                    (last_id, batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield row[0]
+            last_id = rows[-1][0]
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,259 @@
+"""Small asyncio HTTP server that feeds Telegram webhook updates to the bot
+
+Routes:
+    POST <path>    update JSON, checked against X-Telegram-Bot-Api-Secret-Token
+    GET  /healthz  liveness probe
+
+Connections are kept alive, so Telegram can reuse them between updates.
+Headers and body must arrive within REQUEST_TIMEOUT, and at most
+MAX_CONNECTIONS connections are served at once; the rest get a 503.
+For local testing, POST recorded updates to a running server:
+
+    python webhook_server.py http://127.0.0.1:8443/webhook update.json [...]
+"""
+import asyncio
+import hmac
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+MAX_BODY_SIZE = 1024 * 1024
+MAX_HEADERS = 100
+IDLE_TIMEOUT = 75.0
+REQUEST_TIMEOUT = 30.0
+MAX_CONNECTIONS = 100
+
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    411: "Length Required",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+    503: "Service Unavailable"
+}
+
+
+class HttpError(Exception):
+    """Ends a request with an HTTP error status"""
+
+    def __init__(self, status):
+        super().__init__(REASONS.get(status, str(status)))
+        self.status = status
+
+
+class WebhookServer:
+    """Receive updates over HTTP and put them on the application's update queue"""
+
+    def __init__(self, application, path="/webhook", secret_token=None, max_connections=MAX_CONNECTIONS):
+        if path is not None and not secret_token:
+            # A public endpoint must never accept unsigned updates
+            raise ValueError("The webhook route needs a secret token")
+        self.application = application
+        self.path = path
+        self.secret_token = secret_token
+        self.server = None
+        self.started = time.monotonic()
+        self.stats = {'updates': 0, 'rejected': 0, 'errors': 0, 'busy': 0}
+        self.connections = asyncio.Semaphore(max_connections)
+        # (method, path) -> async handler(headers, body) -> (status, content type, body)
+        self.routes = {('GET', '/healthz'): self.handle_health}
+        if path is not None:
+            # Without a path only the health check and added routes are served
+            self.routes[('POST', path)] = self.handle_update
+
+    def add_route(self, method, path, handler):
+        """Serve another path, e.g. a metrics endpoint"""
+        self.routes[(method, path)] = handler
+
+    async def start(self, host, port):
+        self.server = await asyncio.start_server(self.handle_connection, host, port)
+        logger.info(f"HTTP server listening on {host}:{port}")
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def handle_update(self, headers, body):
+        received = headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(received.encode(), self.secret_token.encode()):
+            self.stats['rejected'] += 1
+            raise HttpError(403)
+
+        try:
+            data = json.loads(body)
+        except ValueError:
+            raise HttpError(400)
+        if not isinstance(data, dict):
+            raise HttpError(400)
+
+        # Imported here so the test client below works without telegram installed
+        from telegram import Update
+        update = Update.de_json(data, self.application.bot)
+        await self.application.update_queue.put(update)
+        self.stats['updates'] += 1
+        return 200, "text/plain", b"OK"
+
+    async def handle_health(self, headers, body):
+        running = self.application.running
+        status = {
+            'status': "ok" if running else "stopped",
+            'uptime': round(time.monotonic() - self.started, 1),
+            'update_queue': self.application.update_queue.qsize(),
+            **self.stats
+        }
+        return (200 if running else 503), "application/json", json.dumps(status).encode()
+
+    async def read_request(self, reader):
+        """Parse one request, returns None when the client closed the connection"""
+        line = await asyncio.wait_for(reader.readline(), IDLE_TIMEOUT)
+        if not line:
+            return None
+        try:
+            method, target, version = line.decode('latin-1').split()
+        except ValueError:
+            raise HttpError(400)
+        # A client that stalls mid-request must not hold the connection
+        headers, body = await asyncio.wait_for(self.read_message(reader, method), REQUEST_TIMEOUT)
+        keep_alive = headers.get('connection', '').lower() != 'close' and version != 'HTTP/1.0'
+        return method, target.split('?', 1)[0], headers, body, keep_alive
+
+    async def read_message(self, reader, method):
+        """Headers and body of a request whose request line was read"""
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            if len(headers) >= MAX_HEADERS:
+                raise HttpError(400)
+            name, _, value = line.decode('latin-1').partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        body = b""
+        if method == 'POST':
+            if 'content-length' not in headers:
+                raise HttpError(411)
+            try:
+                length = int(headers['content-length'])
+            except ValueError:
+                raise HttpError(400)
+            if length > MAX_BODY_SIZE:
+                raise HttpError(413)
+            body = await reader.readexactly(length)
+        return headers, body
+
+    async def dispatch(self, method, path, headers, body):
+        handler = self.routes.get((method, path))
+        if handler is None:
+            if any(route_path == path for _, route_path in self.routes):
+                raise HttpError(405)
+            raise HttpError(404)
+        return await handler(headers, body)
+
+    @staticmethod
+    def write_response(writer, status, content_type, payload, keep_alive):
+        writer.write(
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1') + payload
+        )
+
+    async def handle_connection(self, reader, writer):
+        if self.connections.locked():
+            self.stats['busy'] += 1
+            try:
+                self.write_response(writer, 503, "text/plain", REASONS[503].encode(), False)
+                await writer.drain()
+            except ConnectionError:
+                pass
+            finally:
+                writer.close()
+            return
+        async with self.connections:
+            await self.serve_connection(reader, writer)
+
+    async def serve_connection(self, reader, writer):
+        try:
+            while True:
+                keep_alive = False
+                try:
+                    request = await self.read_request(reader)
+                    if request is None:
+                        break
+                    method, path, headers, body, keep_alive = request
+                    status, content_type, payload = await self.dispatch(method, path, headers, body)
+                except HttpError as e:
+                    status, content_type, payload = e.status, "text/plain", str(e).encode()
+                    # The rest of a rejected request may still be unread
+                    keep_alive = keep_alive and e.status in (403, 404, 405)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except Exception as e:
+                    self.stats['errors'] += 1
+                    logger.error(f"Webhook request error: {e}")
+                    status, content_type, payload = 500, "text/plain", b"Internal Server Error"
+
+                self.write_response(writer, status, content_type, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+def load_updates(path):
+    """Read recorded updates: one JSON object, a JSON list, or JSON lines"""
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read()
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    return data if isinstance(data, list) else [data]
+
+
+def post_updates(url, paths, secret_token=None):
+    """POST recorded updates to a running webhook server; returns the
+    response statuses in order"""
+    import urllib.error
+    import urllib.request
+
+    headers = {'Content-Type': 'application/json'}
+    if secret_token:
+        headers['X-Telegram-Bot-Api-Secret-Token'] = secret_token
+
+    statuses = []
+    for path in paths:
+        for update in load_updates(path):
+            request = urllib.request.Request(url, data=json.dumps(update).encode(), headers=headers)
+            try:
+                with urllib.request.urlopen(request) as response:
+                    status = response.status
+            except urllib.error.HTTPError as e:
+                status = e.code
+            print(f"{path}: update {update.get('update_id')} -> {status}")
+            statuses.append(status)
+    return statuses
+
+
+if __name__ == '__main__':
+    import argparse
+    import os
+
+    parser = argparse.ArgumentParser(description="POST recorded Telegram updates to a webhook server")
+    parser.add_argument('url', help="webhook URL, e.g. http://127.0.0.1:8443/webhook")
+    parser.add_argument('files', nargs='+', help="JSON files with recorded updates")
+    parser.add_argument('--secret', default=os.getenv("WEBHOOK_SECRET"), help="secret token (default: $WEBHOOK_SECRET)")
+    args = parser.parse_args()
+    post_updates(args.url, args.files, args.secret)